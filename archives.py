@@ -0,0 +1,239 @@
+import contextlib
+import errno
+import io
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ZIP_SUFFIX = ".zip"
+GZIP_SUFFIX = ".gz"
+
+# Where a path leaves a .zip for one of its members
+_MEMBER_SEPARATOR = re.compile(r"\.zip[/\\]", re.IGNORECASE)
+
+# Member listings (ZipInfo by name) of the archives seen by this process,
+# keyed by path, size and mtime, so listing the exports and both payout
+# sources opens each archive once. zipfile and gzip are imported when first
+# needed, as most data folders hold neither.
+_zip_listings: Dict[Tuple[str, int, int], Dict] = {}
+
+
+def file_digest(file_path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def member_path(archive: str, member: str) -> str:
+    """Return the path standing for member of a .zip, as used by every loader."""
+    return f"{archive}/{member}"
+
+
+def split_member(path: str) -> Tuple[str, Optional[str]]:
+    """Return (archive, member) for a path inside a .zip, or (path, None)."""
+    for separator in _MEMBER_SEPARATOR.finditer(path):
+        archive = path[: separator.end() - 1]
+        if os.path.isfile(archive):
+            return archive, path[separator.end() :]
+    return path, None
+
+
+def source_name(path: str) -> str:
+    """
+    Return the name of the CSV a source holds: the file name of a plain CSV
+    or of a .zip member, or the name of a .gz without its suffix.
+    """
+    name = os.path.basename(path)
+    if name.lower().endswith(GZIP_SUFFIX):
+        name = name[: -len(GZIP_SUFFIX)]
+    return name
+
+
+def _zip_members(archive: str) -> Dict:
+    """
+    Return the files in archive by member name, from the listing cache.
+
+    Raises:
+        OSError: If archive cannot be read, including when it is not a .zip
+    """
+    import zipfile
+
+    stat = os.stat(archive)
+    key = (os.path.abspath(archive), stat.st_size, stat.st_mtime_ns)
+    if key not in _zip_listings:
+        try:
+            with zipfile.ZipFile(archive) as zip_file:
+                _zip_listings[key] = {
+                    info.filename: info
+                    for info in zip_file.infolist()
+                    if not info.is_dir()
+                }
+        except zipfile.BadZipFile as e:
+            raise OSError(f"Not a readable .zip: {e}") from None
+    return _zip_listings[key]
+
+
+def _member_info(path: str):
+    archive, member = split_member(path)
+    try:
+        return _zip_members(archive)[member]
+    except KeyError:
+        raise FileNotFoundError(
+            errno.ENOENT, f"No {member} in {os.path.basename(archive)}", path
+        ) from None
+
+
+def archive_members(archive: str) -> List[str]:
+    """Return the paths of the files in a .zip (see member_path)."""
+    return [member_path(archive, member) for member in _zip_members(archive)]
+
+
+def list_sources(
+    folder: str, prefix: str, extensions: Iterable[str] = (".csv",)
+) -> List[str]:
+    """
+    List the CSV sources in folder whose name starts with prefix and ends
+    with one of extensions, sorted by path.
+
+    Sources are plain files, gzipped files (matched by their name without
+    .gz) and the members of every .zip in folder, matched by their own name
+    whatever the archive is called. An archive that cannot be read is
+    skipped with a warning.
+    """
+    extensions = tuple(extensions)
+
+    def matches(name):
+        return name.startswith(prefix) and name.endswith(extensions)
+
+    sources = []
+    try:
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        if entry.name.startswith(".") or not entry.is_file():
+            continue
+        if entry.name.lower().endswith(ZIP_SUFFIX):
+            try:
+                members = archive_members(entry.path)
+            except OSError as e:
+                print(f"Warning: Skipping unreadable archive {entry.name}: {e}")
+                continue
+            sources.extend(
+                member for member in members if matches(os.path.basename(member))
+            )
+        elif matches(source_name(entry.name)):
+            sources.append(entry.path)
+    return sorted(sources)
+
+
+def is_compressed(path: str) -> bool:
+    """Tell whether a source is a .zip member or a .gz, which cannot be mapped or sought."""
+    return split_member(path)[1] is not None or path.lower().endswith(GZIP_SUFFIX)
+
+
+def source_stat(path: str) -> os.stat_result:
+    """Return the os.stat of the file holding a source (its archive for a member)."""
+    return os.stat(split_member(path)[0])
+
+
+def source_exists(path: str) -> bool:
+    try:
+        archive, member = split_member(path)
+        if member is not None:
+            _member_info(path)
+        return os.path.isfile(archive)
+    except OSError:
+        return False
+
+
+def source_size(path: str) -> int:
+    """Return the bytes read from disk for a source: compressed for archives."""
+    if split_member(path)[1] is not None:
+        return _member_info(path).compress_size
+    return os.path.getsize(path)
+
+
+def source_digest(path: str) -> str:
+    """
+    Return a digest of a source's content: the SHA-256 of a file, or the
+    CRC-32 and size a .zip records for a member, so a member is fingerprinted
+    without decompressing it.
+    """
+    if split_member(path)[1] is not None:
+        info = _member_info(path)
+        return f"crc32:{info.CRC:08x}:{info.file_size}"
+    return file_digest(path)
+
+
+class SourceOpener:
+    """
+    Open CSV sources, plain, gzipped or in a .zip, as streams decompressed on
+    the fly.
+
+    Every .zip is opened once however many of its members are read, so the
+    members of one archive are read in one pass over it. Closing the opener
+    (it is a context manager) closes every stream and archive it opened.
+    """
+
+    def __init__(self):
+        self._archives = {}
+        self._stack = contextlib.ExitStack()
+
+    def open(
+        self,
+        path: str,
+        binary: bool = False,
+        encoding: str = "utf-8-sig",
+        newline: Optional[str] = None,
+    ):
+        """
+        Open a source for reading, as text like open() unless binary.
+
+        Raises:
+            FileNotFoundError: If the file, or the member of its archive, is missing
+        """
+        archive, member = split_member(path)
+        if member is not None:
+            import zipfile
+
+            if archive not in self._archives:
+                self._archives[archive] = self._stack.enter_context(
+                    zipfile.ZipFile(archive)
+                )
+            try:
+                stream = self._archives[archive].open(member)
+            except KeyError:
+                raise FileNotFoundError(
+                    errno.ENOENT, f"No {member} in {os.path.basename(archive)}", path
+                ) from None
+        elif path.lower().endswith(GZIP_SUFFIX):
+            import gzip
+
+            stream = gzip.open(path, "rb")
+        else:
+            stream = open(path, "rb")
+        if not binary:
+            stream = io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+        return self._stack.enter_context(stream)
+
+    def close(self):
+        self._stack.close()
+        self._archives = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@contextlib.contextmanager
+def open_source(path: str, binary: bool = False, **kwargs):
+    """Open one source with a SourceOpener of its own (see SourceOpener.open)."""
+    with SourceOpener() as opener:
+        yield opener.open(path, binary, **kwargs)
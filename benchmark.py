@@ -0,0 +1,408 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import yaml
+
+from catalog import ProductCatalog
+from cc_payout import extract_order_amounts_from_payout_csv
+from diagnostics import Diagnostics
+from gst_batch import DEFAULT_BATCH_THRESHOLD
+from parallel import call_captured
+from pp_payout import extract_order_amounts_from_paypal_csv
+from synthetic_inputs import generate_inputs
+from woo_csv_to_tally_xml import (
+    load_product_prices,
+    load_sku_mapping,
+    load_tally_products,
+    read_woo_csv,
+    write_tally_xml,
+)
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Size of the export converted before timing runs that have nothing to do.
+STARTUP_LINE_ITEMS = 1000
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Startup timings and how they are printed.
+STARTUP_LABELS = {
+    "interpreter_seconds": "python -c pass",
+    "import_seconds": "import converter",
+    "first_run_seconds": "first run",
+    "up_to_date_seconds": "run, nothing to do",
+}
+
+# Stages in pipeline order; woo needs the catalog and xml needs woo.
+STAGES = ["catalog", "paypal", "ccavenue", "woo", "xml"]
+STAGE_DEPENDENCIES = {"woo": "catalog", "xml": "woo"}
+
+
+def load_catalog(config):
+    catalog = ProductCatalog(
+        load_sku_mapping(config["sku_mapping_file"]),
+        load_tally_products(config["tally_products_file"]),
+        load_product_prices(config["product_prices_file"]),
+    )
+    return catalog.compile()
+
+
+def merge_payouts(paypal_result, ccavenue_amounts):
+    """Combine payouts the way fx_payout does: PayPal wins, refunds dropped."""
+    paypal_amounts, refunded_orders, _ = paypal_result
+    payout_amounts = dict(ccavenue_amounts)
+    payout_amounts.update(paypal_amounts)
+    for order_id in refunded_orders:
+        payout_amounts.pop(order_id, None)
+    return payout_amounts
+
+
+def measure(func, *args, trace_memory=False):
+    """
+    Run func(*args) with its console output suppressed.
+
+    Returns:
+        (result, stats) where stats holds the wall time in seconds and, with
+        trace_memory, the peak memory the call allocated on top of what was
+        already allocated, in MB
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result, _ = call_captured(func, *args)
+    stats = {"seconds": round(time.perf_counter() - started, 4)}
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        stats["peak_mb"] = round(peak / 2**20, 2)
+    return result, stats
+
+
+def run_pipeline(config, paths, output_folder, trace_memory=False, selected=STAGES):
+    """
+    Run the selected stages of a conversion on one set of inputs.
+
+    Payout stages that are not selected count as finding no payouts.
+
+    Returns:
+        (stage stats keyed by stage name, number of vouchers written)
+    """
+    stages = {}
+
+    def stage(name, func, *args):
+        result, stages[name] = measure(func, *args, trace_memory=trace_memory)
+        return result
+
+    if "catalog" in selected:
+        catalog = stage("catalog", load_catalog, config)
+    paypal_result = ({}, set(), [])
+    if "paypal" in selected:
+        paypal_result = stage(
+            "paypal", extract_order_amounts_from_paypal_csv, paths["paypal"]
+        )
+    ccavenue_amounts = {}
+    if "ccavenue" in selected:
+        ccavenue_amounts = stage(
+            "ccavenue", extract_order_amounts_from_payout_csv, paths["ccavenue"]
+        )
+    if "woo" not in selected:
+        return stages, 0
+    payout_amounts = merge_payouts(paypal_result, ccavenue_amounts)
+    sales_data, _ = stage(
+        "woo",
+        read_woo_csv,
+        os.path.dirname(paths["woo"]),
+        os.path.basename(paths["woo"]),
+        catalog,
+        payout_amounts,
+        None,
+        "decimal",
+        DEFAULT_BATCH_THRESHOLD,
+        Diagnostics(),
+    )
+    output_filename = os.path.join(output_folder, "benchmark.xml")
+    if "xml" not in selected:
+        return stages, 0
+    vouchers = stage(
+        "xml", write_tally_xml, output_filename, sales_data, catalog.ledgers
+    )
+    return stages, vouchers
+
+
+def count_rows(csv_path):
+    """Return the number of rows after the header of a CSV."""
+    with open(csv_path, "r", newline="", encoding="utf-8-sig") as f:
+        return sum(1 for row in csv.reader(f) if row) - 1
+
+
+def benchmark_size(
+    config,
+    line_items,
+    data_folder,
+    seed=0,
+    trace_memory=True,
+    selected=STAGES,
+    wide=False,
+):
+    """
+    Generate (or reuse) inputs with line_items line items and benchmark them.
+
+    The woo stage also reports the export rows it decoded per second; with
+    wide the export has every column of a full "All Export".
+    """
+    name = f"Synthetic-{line_items}-{seed}" + ("-wide" if wide else "")
+    paths = {
+        "woo": os.path.join(data_folder, f"Orders-Export-{name}.csv"),
+        "paypal": os.path.join(data_folder, f"Download-{name}.CSV"),
+        "ccavenue": os.path.join(data_folder, f"PayoutTransactionSummary-{name}.csv"),
+    }
+    generate_seconds = None
+    if not all(os.path.exists(path) for path in paths.values()):
+        sku_mapping = load_sku_mapping(config["sku_mapping_file"])
+        started = time.perf_counter()
+        paths = generate_inputs(data_folder, line_items, sku_mapping, seed, name, wide)
+        generate_seconds = round(time.perf_counter() - started, 2)
+    with tempfile.TemporaryDirectory() as output_folder:
+        stages, vouchers = run_pipeline(config, paths, output_folder, selected=selected)
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                memory_stages, _ = run_pipeline(
+                    config, paths, output_folder, True, selected
+                )
+            finally:
+                tracemalloc.stop()
+            for stage_name, stats in memory_stages.items():
+                stages[stage_name]["peak_mb"] = stats["peak_mb"]
+    woo_rows = count_rows(paths["woo"])
+    if "woo" in stages and stages["woo"]["seconds"]:
+        stages["woo"]["rows_per_second"] = round(woo_rows / stages["woo"]["seconds"])
+    return {
+        "line_items": line_items,
+        "woo_rows": woo_rows,
+        "vouchers": vouchers,
+        "input_bytes": {
+            kind: os.path.getsize(path) for kind, path in sorted(paths.items())
+        },
+        "generate_seconds": generate_seconds,
+        "stages": stages,
+    }
+
+
+def time_command(arguments, repeats):
+    """Return the median wall time in seconds of running arguments repeats times."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run(arguments, check=True, stdout=subprocess.DEVNULL, cwd=SCRIPT_DIR)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings), 4)
+
+
+def benchmark_startup(config, data_folder, repeats, seed=0):
+    """
+    Time the converter's startup in fresh processes: the bare interpreter,
+    importing the converter, and a whole run that finds every export up to
+    date, after a first run has converted a small synthetic export.
+
+    Returns:
+        Dict of median seconds for each
+    """
+    sku_mapping = load_sku_mapping(config["sku_mapping_file"])
+    generate_inputs(data_folder, STARTUP_LINE_ITEMS, sku_mapping, seed, "Startup")
+    run_config = dict(
+        config,
+        data_folder=data_folder,
+        cache_folder=os.path.join(data_folder, "cache"),
+    )
+    for key in ("tally_products_file", "sku_mapping_file", "product_prices_file"):
+        run_config[key] = os.path.abspath(config[key])
+    config_file = os.path.join(data_folder, "config.yaml")
+    with open(config_file, "w", encoding="utf-8") as f:
+        yaml.safe_dump(run_config, f)
+    converter = [sys.executable, "woo_csv_to_tally_xml.py", "-c", config_file]
+    first_run = time_command(converter, 1)
+    return {
+        "interpreter_seconds": time_command([sys.executable, "-c", "pass"], repeats),
+        "import_seconds": time_command(
+            [sys.executable, "-c", "import woo_csv_to_tally_xml"], repeats
+        ),
+        "first_run_seconds": first_run,
+        "up_to_date_seconds": time_command(converter, repeats),
+    }
+
+
+def print_startup(startup):
+    print("\nStartup (median of fresh processes)")
+    for key, label in STARTUP_LABELS.items():
+        print(f"  {label:<24} {startup[key]:>10.3f}s")
+
+
+def print_run(run):
+    print(f"\n{run['line_items']:,} line items, {run['vouchers']:,} vouchers")
+    print(f"  {'stage':<10} {'seconds':>10} {'peak MB':>10} {'rows/s':>10}")
+    for stage_name, stats in run["stages"].items():
+        peak = stats.get("peak_mb")
+        peak_text = f"{peak:>10.2f}" if peak is not None else f"{'-':>10}"
+        rate = stats.get("rows_per_second")
+        rate_text = f"{rate:>10,}" if rate is not None else f"{'-':>10}"
+        print(f"  {stage_name:<10} {stats['seconds']:>10.3f} {peak_text} {rate_text}")
+
+
+def print_comparison(previous, current):
+    """Print the time and peak memory of each stage against an earlier results file."""
+    previous_runs = {run["line_items"]: run for run in previous.get("runs", [])}
+    print(f"\nCompared with {previous.get('created', 'previous run')}:")
+    old_startup = previous.get("startup") or {}
+    for key, label in STARTUP_LABELS.items():
+        seconds = (current.get("startup") or {}).get(key)
+        old_seconds = old_startup.get(key)
+        if seconds is not None and old_seconds:
+            print(
+                f"  {label:<24} {old_seconds:>9.3f}s -> {seconds:>9.3f}s  "
+                f"({seconds / old_seconds:.2f}x)"
+            )
+    for run in current["runs"]:
+        old_run = previous_runs.get(run["line_items"])
+        if not old_run:
+            continue
+        print(f"  {run['line_items']:,} line items")
+        for stage_name, stats in run["stages"].items():
+            old_stats = old_run["stages"].get(stage_name)
+            if not old_stats or not old_stats["seconds"]:
+                continue
+            ratio = stats["seconds"] / old_stats["seconds"]
+            line = (
+                f"    {stage_name:<10} {old_stats['seconds']:>9.3f}s -> "
+                f"{stats['seconds']:>9.3f}s  ({ratio:.2f}x)"
+            )
+            if "peak_mb" in stats and "peak_mb" in old_stats:
+                line += (
+                    f"  {old_stats['peak_mb']:>9.2f} MB -> {stats['peak_mb']:>9.2f} MB"
+                )
+            if "rows_per_second" in stats and "rows_per_second" in old_stats:
+                line += (
+                    f"  {old_stats['rows_per_second']:>9,} -> "
+                    f"{stats['rows_per_second']:>9,} rows/s"
+                )
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark each conversion stage on synthetic inputs"
+    )
+    parser.add_argument(
+        "-c", "--config", default="config.yaml", help="Config with the product files"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Line item counts to benchmark",
+    )
+    parser.add_argument(
+        "--data-folder",
+        help="Keep generated inputs here and reuse them on later runs "
+        "(default: a temporary folder)",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="Stages to run (the stages they depend on are added), e.g. --stages ccavenue "
+        "to measure the payout parser alone",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for inputs")
+    parser.add_argument(
+        "--wide-export",
+        action="store_true",
+        help='Benchmark exports with every column of a full "All Export" '
+        "(the converter reads 15 of them)",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip the second, memory-traced pass over each size",
+    )
+    parser.add_argument(
+        "--startup-runs",
+        type=int,
+        default=5,
+        metavar="N",
+        help="Time startup as the median of N fresh processes (default: 5, 0 to skip)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="benchmark-results.json",
+        help="JSON file to write the results to",
+    )
+    parser.add_argument(
+        "--compare", metavar="JSON", help="Earlier results file to compare against"
+    )
+    args = parser.parse_args()
+    selected = set(args.stages)
+    for stage_name in reversed(STAGES):
+        if stage_name in selected and stage_name in STAGE_DEPENDENCIES:
+            selected.add(STAGE_DEPENDENCIES[stage_name])
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    for key in ("tally_products_file", "sku_mapping_file", "product_prices_file"):
+        if not os.path.exists(config[key]):
+            print(f"Error: {key} '{config[key]}' not found!")
+            return
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "wide_export": args.wide_export,
+        "startup": None,
+        "runs": [],
+    }
+    if args.startup_runs > 0:
+        print("Benchmarking startup...")
+        with tempfile.TemporaryDirectory() as startup_folder:
+            results["startup"] = benchmark_startup(
+                config, startup_folder, args.startup_runs, args.seed
+            )
+        print_startup(results["startup"])
+    with tempfile.TemporaryDirectory() as temp_folder:
+        data_folder = args.data_folder or temp_folder
+        os.makedirs(data_folder, exist_ok=True)
+        for line_items in args.sizes:
+            print(f"Benchmarking {line_items:,} line items...")
+            run = benchmark_size(
+                config,
+                line_items,
+                data_folder,
+                args.seed,
+                not args.no_memory,
+                selected,
+                args.wide_export,
+            )
+            results["runs"].append(run)
+            print_run(run)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
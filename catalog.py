@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from ledger import LedgerRegistry
+
+
+@dataclass(frozen=True, slots=True)
+class SkuComponent:
+    name: str
+    gst_rate: Decimal
+    godown_name: str
+    domestic_ledger: str
+    export_ledger: str
+    normal_price: Optional[Decimal]
+
+
+@dataclass(frozen=True, slots=True)
+class SkuEntry:
+    """
+    A WooCommerce SKU resolved against tally_products and product prices.
+
+    For bundles (more than one mapped Tally name) total_normal_price is the
+    sum of the distinct component prices, and each component's share of the item cost
+    is normal_price * (item cost / total_normal_price). Components missing
+    from tally_products are left out, and a bundle with missing prices has no
+    components, matching how rows were handled before compilation.
+    """
+
+    sku: str
+    components: Tuple[SkuComponent, ...]
+    total_normal_price: Optional[Decimal]
+
+
+class ProductCatalog:
+    """
+    The three product files plus the SKU table compiled from them at startup.
+
+    compile() resolves every SKU once and prints each mapping problem once,
+    instead of the row loop re-resolving (and re-reporting) them per row. It
+    also builds the LedgerRegistry of the catalog's GST rates, which supplies
+    every ledger name used in the vouchers.
+    """
+
+    def __init__(
+        self,
+        sku_mapping: Dict[str, List[str]],
+        tally_products: Dict[str, Dict],
+        product_prices: Dict[str, Decimal],
+    ):
+        self.sku_mapping = sku_mapping
+        self.tally_products = tally_products
+        self.product_prices = product_prices
+        self.skus: Dict[str, SkuEntry] = {}
+        self.ledgers = LedgerRegistry()
+
+    def compile(self) -> "ProductCatalog":
+        self.ledgers = LedgerRegistry(
+            gst_rates={product["gst_rate"] for product in self.tally_products.values()},
+            ledger_products=[
+                name
+                for name, product in self.tally_products.items()
+                if not product["godown_name"]
+            ],
+        )
+        problem_count = 0
+        for sku, tally_names in self.sku_mapping.items():
+            entry, problems = self._compile_sku(sku.strip(), tally_names)
+            self.skus[sku.strip()] = entry
+            for problem in problems:
+                print(problem)
+            problem_count += len(problems)
+        if problem_count:
+            print(
+                f"Found {problem_count} problems in the product files, "
+                "affected items will be left out of the vouchers"
+            )
+        return self
+
+    def _compile_sku(self, sku, tally_names) -> Tuple[SkuEntry, List[str]]:
+        problems = []
+        missing_products = [
+            name for name in tally_names if name not in self.tally_products
+        ]
+        for name in missing_products:
+            problems.append(
+                f"Warning: Tally product '{name}' for SKU '{sku}' not found in tally_products"
+            )
+        total_normal_price = None
+        is_bundle = len(tally_names) > 1
+        if is_bundle:
+            missing_prices = [
+                name for name in tally_names if name not in self.product_prices
+            ]
+            if missing_prices:
+                problems.append(
+                    f"Error: Missing prices for products: {', '.join(missing_prices)}. "
+                    f"SKU '{sku}' requires prices for all mapped Tally products."
+                )
+                return SkuEntry(sku, (), None), problems
+            total_normal_price = sum(
+                self.product_prices[name] for name in dict.fromkeys(tally_names)
+            )
+        components = []
+        for name in tally_names:
+            if name in missing_products:
+                continue
+            product = self.tally_products[name]
+            components.append(
+                SkuComponent(
+                    name=name,
+                    gst_rate=product["gst_rate"],
+                    godown_name=product["godown_name"],
+                    domestic_ledger=self.ledgers.sales_ledger(
+                        product["gst_rate"], True
+                    ),
+                    export_ledger=self.ledgers.sales_ledger(Decimal("0.0"), False),
+                    normal_price=self.product_prices[name] if is_bundle else None,
+                )
+            )
+        return SkuEntry(sku, tuple(components), total_normal_price), problems
+
+    def get(self, sku: str) -> Optional[SkuEntry]:
+        return self.skus.get(sku) if sku else None
@@ -1,43 +1,112 @@
+import contextlib
 import csv
-import glob
-import io
+import itertools
+import mmap
 import os
-import yaml
 from decimal import Decimal, InvalidOperation
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import profiling
+from archives import SourceOpener, is_compressed, source_size, split_member
+from parallel import call_captured, create_executor, map_captured
+from parse_cache import cached_parse
+from settings import ccavenue_files
 
-def extract_order_amounts_from_payout_csv(csv_file_path: str) -> Dict[str, Decimal]:
+# Header of the transaction section, which follows the summary preamble
+TRANSACTION_HEADER = b"Transaction Type,Order ID"
+
+
+def _decoded_lines(payout_map: mmap.mmap, start: int) -> Iterator[str]:
+    """Yield the lines of a mapped file from offset start, decoded one at a time."""
+    payout_map.seek(start)
+    for line in iter(payout_map.readline, b""):
+        yield line.decode("utf-8")
+
+
+def _streamed_lines(stream) -> Optional[Iterator[str]]:
+    """
+    Return the decoded lines of a binary stream from the transaction header
+    on, reading it only once, or None if it has no transaction section.
+    """
+    for line in stream:
+        start = line.find(TRANSACTION_HEADER)
+        if start != -1:
+            rest = (line.decode("utf-8") for line in stream)
+            return itertools.chain([line[start:].decode("utf-8")], rest)
+    return None
+
+
+def _add_transactions(
+    lines: Iterator[str],
+    csv_file_path: str,
+    order_amounts: Dict[str, Decimal],
+):
+    transaction_reader = csv.DictReader(lines)
+    row_count = 0
+    for row in transaction_reader:
+        row_count += 1
+        try:
+            order_id_field = row.get("Order ID", "").strip()
+            amount_str = row.get("Amount", "").strip()
+            if not order_id_field or not amount_str:
+                continue
+            if "_" in order_id_field:
+                woo_order_id = order_id_field.split("_")[0]
+            else:
+                woo_order_id = order_id_field
+            amount = Decimal(amount_str.replace(",", ""))
+            order_amounts[woo_order_id] = amount
+        except (InvalidOperation, ValueError) as e:
+            print(
+                f"Error processing transaction row for order {order_id_field} in {csv_file_path}: {e}"
+            )
+            continue
+    profiling.count("rows", row_count)
+
+
+def extract_order_amounts_from_payout_csv(
+    csv_file_path: str, opener: Optional[SourceOpener] = None
+) -> Dict[str, Decimal]:
+    """
+    Read the order amounts from the transaction section of a payout summary.
+
+    The file is memory-mapped and rows are decoded one line at a time from
+    the transaction header on, so neither the file nor its transaction
+    section is ever copied into a string as a whole. A summary in a .zip or
+    .gz cannot be mapped; it is decompressed as a stream instead, with
+    opener when given so its archive is not opened again.
+
+    Returns:
+        Dictionary of amounts by WooCommerce Order ID (the part of the
+        CCAvenue Order ID before any "_" suffix)
+    """
     order_amounts = {}
     try:
-        with open(csv_file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        transaction_start = content.find("Transaction Type,Order ID")
-        if transaction_start == -1:
-            print(f"Warning: Could not find transaction section in {csv_file_path}")
-            return order_amounts
-        transaction_section = content[transaction_start:].strip()
-        if not transaction_section:
-            print(f"Warning: Transaction section is empty in {csv_file_path}")
-            return order_amounts
-        transaction_reader = csv.DictReader(io.StringIO(transaction_section))
-        for row in transaction_reader:
-            try:
-                order_id_field = row.get("Order ID", "").strip()
-                amount_str = row.get("Amount", "").strip()
-                if not order_id_field or not amount_str:
-                    continue
-                if "_" in order_id_field:
-                    woo_order_id = order_id_field.split("_")[0]
-                else:
-                    woo_order_id = order_id_field
-                amount = Decimal(amount_str.replace(",", ""))
-                order_amounts[woo_order_id] = amount
-            except (InvalidOperation, ValueError) as e:
-                print(
-                    f"Error processing transaction row for order {order_id_field} in {csv_file_path}: {e}"
-                )
-                continue
+        if is_compressed(csv_file_path):
+            with contextlib.ExitStack() as stack:
+                if opener is None:
+                    opener = stack.enter_context(SourceOpener())
+                stream = opener.open(csv_file_path, binary=True)
+                lines = _streamed_lines(stream)
+                if lines is not None:
+                    _add_transactions(lines, csv_file_path, order_amounts)
+                    return order_amounts
+        else:
+            with open(csv_file_path, "rb") as f:
+                # An empty file cannot be mapped, and has no transactions anyway
+                if os.fstat(f.fileno()).st_size:
+                    with mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as payout_map:
+                        transaction_start = payout_map.find(TRANSACTION_HEADER)
+                        if transaction_start != -1:
+                            _add_transactions(
+                                _decoded_lines(payout_map, transaction_start),
+                                csv_file_path,
+                                order_amounts,
+                            )
+                            return order_amounts
+        print(f"Warning: Could not find transaction section in {csv_file_path}")
     except FileNotFoundError:
         print(f"Error: Payout CSV file '{csv_file_path}' not found!")
     except Exception as e:
@@ -45,63 +114,152 @@ def extract_order_amounts_from_payout_csv(csv_file_path: str) -> Dict[str, Decim
     return order_amounts
 
 
+def find_ccavenue_csv_files(config: Dict) -> List[str]:
+    """
+    List the CCAvenue payout CSV files in the configured folder, sorted by path.
+
+    Args:
+        config: Configuration returned by settings.load_config
+
+    Returns:
+        Sorted list of file paths (empty if there are none)
+    """
+    payout_prefix = config.get("payout_prefix")
+    if not payout_prefix:
+        print("Warning: 'payout_prefix' must be specified in config")
+        return []
+    csv_files = ccavenue_files(config)
+    if not csv_files:
+        print(
+            f"No payout CSV files found with '{payout_prefix}' prefix in {config['data_folder']}"
+        )
+    return csv_files
+
+
+def _load_payout_file(
+    csv_file: str, cache_dir: Optional[str] = None, opener=None
+) -> Dict[str, Decimal]:
+    print(f"\nProcessing {os.path.basename(csv_file)}...")
+    with profiling.stage(
+        "ccavenue", os.path.basename(csv_file), bytes_read=source_size(csv_file)
+    ) as counters:
+        order_amounts = cached_parse(
+            cache_dir,
+            "ccavenue",
+            extract_order_amounts_from_payout_csv,
+            csv_file,
+            opener,
+        )
+        counters["orders"] = len(order_amounts)
+    return order_amounts
+
+
+def _load_payout_group(
+    csv_files: List[str], cache_dir: Optional[str] = None
+) -> List[Tuple[Dict[str, Decimal], str]]:
+    """Parse the summaries of one archive (or one plain file) with the archive opened once."""
+    with SourceOpener() as opener:
+        return [
+            call_captured(_load_payout_file, csv_file, cache_dir, opener)
+            for csv_file in csv_files
+        ]
+
+
+def _file_results(group_results):
+    for file_results, _ in group_results:
+        yield from file_results
+
+
+def load_ccavenue_files(
+    csv_files: List[str], executor=None, cache_dir: Optional[str] = None
+) -> Iterator[Tuple[Dict[str, Decimal], str]]:
+    """
+    Start parsing csv_files, on executor's workers when one is given.
+
+    The summaries in one .zip are parsed by the same task, which reads the
+    archive in one pass. Results are reused from cache_dir for files
+    unchanged since the last run.
+
+    Returns:
+        Iterator of (order amounts, console output) in csv_files order, to be
+        passed to merge_ccavenue_results
+    """
+    groups = [
+        list(group)
+        for _, group in itertools.groupby(
+            csv_files, key=lambda csv_file: split_member(csv_file)[0]
+        )
+    ]
+    return _file_results(
+        map_captured(_load_payout_group, groups, executor, (cache_dir,))
+    )
+
+
+def merge_ccavenue_results(csv_files: List[str], file_results) -> Dict[str, Decimal]:
+    """
+    Merge per-file payout amounts in csv_files order; later files win on duplicates.
+
+    Args:
+        csv_files: Files that were parsed
+        file_results: Iterator returned by load_ccavenue_files
+
+    Returns:
+        Dictionary of amounts by WooCommerce Order ID
+    """
+    print(f"Found {len(csv_files)} payout CSV files to process:")
+    for csv_file in csv_files:
+        print(f"  - {os.path.basename(csv_file)}")
+    all_order_amounts = {}
+    total_orders = 0
+    for file_amounts, output in file_results:
+        print(output, end="")
+        duplicates = set(all_order_amounts.keys()) & set(file_amounts.keys())
+        if duplicates:
+            print(f"Warning: Found duplicate order IDs: {duplicates}")
+            for order_id in duplicates:
+                if all_order_amounts[order_id] != file_amounts[order_id]:
+                    print(
+                        f"  Order {order_id}: {all_order_amounts[order_id]} vs {file_amounts[order_id]}"
+                    )
+        all_order_amounts.update(file_amounts)
+        total_orders += len(file_amounts)
+        print(f"  Loaded {len(file_amounts)} orders from this file")
+    print(
+        f"\nTotal: Loaded amounts for {len(all_order_amounts)} unique orders from {len(csv_files)} files"
+    )
+    return all_order_amounts
+
+
 def load_all_ccavenue_order_amounts(
-    config_file: str = "config.yaml",
+    config: Dict,
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
 ) -> Dict[str, Decimal]:
     """
     Load order amounts from all payout CSV files in the configured folder.
 
+    Files are parsed in parallel worker processes when there is more than one.
+
     Args:
-        config_file: Path to configuration file
+        config: Configuration returned by settings.load_config
+        max_workers: Upper bound on worker processes (default: CPU count)
+        cache_dir: Folder for cached parse results, or None to disable caching
 
     Returns:
         Dictionary of amounts by WooCommerce Order ID (merged from all files)
     """
     try:
-        with open(config_file, "r") as f:
-            config = yaml.safe_load(f)
-        data_folder = config.get("data_folder")
-        payout_prefix = config.get("payout_prefix")
-        if not data_folder or not payout_prefix:
-            print(
-                "Warning: 'data_folder' and 'payout_prefix' must be specified in config"
-            )
-            return {}
-        if data_folder.startswith("~"):
-            data_folder = os.path.expanduser(data_folder)
-        if not os.path.exists(data_folder):
-            print(f"Error: Data folder '{data_folder}' does not exist!")
-            return {}
-        csv_file_pattern = os.path.join(data_folder, f"{payout_prefix}*.csv")
-        csv_files = glob.glob(csv_file_pattern)
+        csv_files = find_ccavenue_csv_files(config)
         if not csv_files:
-            print(
-                f"No payout CSV files found with '{payout_prefix}' prefix in {data_folder}"
-            )
             return {}
-        print(f"Found {len(csv_files)} payout CSV files to process:")
-        for csv_file in csv_files:
-            print(f"  - {os.path.basename(csv_file)}")
-        all_order_amounts = {}
-        total_orders = 0
-        for csv_file in csv_files:
-            print(f"\nProcessing {os.path.basename(csv_file)}...")
-            file_amounts = extract_order_amounts_from_payout_csv(csv_file)
-            duplicates = set(all_order_amounts.keys()) & set(file_amounts.keys())
-            if duplicates:
-                print(f"Warning: Found duplicate order IDs: {duplicates}")
-                for order_id in duplicates:
-                    if all_order_amounts[order_id] != file_amounts[order_id]:
-                        print(
-                            f"  Order {order_id}: {all_order_amounts[order_id]} vs {file_amounts[order_id]}"
-                        )
-            all_order_amounts.update(file_amounts)
-            total_orders += len(file_amounts)
-            print(f"  Loaded {len(file_amounts)} orders from this file")
-        print(
-            f"\nTotal: Loaded amounts for {len(all_order_amounts)} unique orders from {len(csv_files)} files"
-        )
-        return all_order_amounts
+        executor = create_executor(len(csv_files), max_workers)
+        try:
+            return merge_ccavenue_results(
+                csv_files, load_ccavenue_files(csv_files, executor, cache_dir)
+            )
+        finally:
+            if executor:
+                executor.shutdown()
     except Exception as e:
         print(f"Error loading order amounts from config: {e}")
         return {}
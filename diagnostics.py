@@ -0,0 +1,115 @@
+import json
+import os
+
+# How much of each issue is printed while an export is converted:
+#   summary - nothing until the summary table at the end
+#   first   - the first occurrence of each kind and key, then the table
+#   all     - every occurrence, as earlier versions printed them, then the table
+LEVELS = ("summary", "first", "all")
+DEFAULT_LEVEL = "summary"
+
+# Longest summary table printed; the sidecar file always has every issue.
+MAX_SUMMARY_ROWS = 40
+
+DIAGNOSTICS_SUFFIX = ".diagnostics.jsonl"
+
+
+def diagnostics_path_for(output_filename):
+    """Return the sidecar file that lists the issues behind an XML output."""
+    return os.path.splitext(output_filename)[0] + DIAGNOSTICS_SUFFIX
+
+
+class Diagnostics:
+    """
+    Collect the issues found while converting an export.
+
+    Each issue has a kind (e.g. "unmapped_sku") and a key within that kind
+    (the SKU, field name or currency), and is counted per kind and key so one
+    table can be printed at the end instead of a line per row. Every
+    occurrence is kept, with its order ID and message, for the sidecar file.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL):
+        self.level = level
+        self.occurrences = []
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.occurrences)
+
+    def report(self, kind, key, message, order_id=None, detail=None):
+        """
+        Record one occurrence of an issue.
+
+        Args:
+            kind: Issue kind, the first column of the summary
+            key: What the issue is about within its kind, e.g. the SKU
+            message: Human readable description, printed at level "all" (and
+                "first" for the first occurrence of kind and key)
+            order_id: Order the issue was found in, if any
+            detail: Extra text printed after message at level "all" only,
+                like the row data of a row that could not be processed
+        """
+        counts_key = (kind, key)
+        first = counts_key not in self.counts
+        if first:
+            self.counts[counts_key] = {"count": 0, "orders": []}
+        counts = self.counts[counts_key]
+        counts["count"] += 1
+        orders = counts["orders"]
+        if order_id is not None and len(orders) < 3 and order_id not in orders:
+            orders.append(order_id)
+        occurrence = {
+            "kind": kind,
+            "key": key,
+            "order_id": order_id,
+            "message": message,
+        }
+        if detail is not None:
+            occurrence["detail"] = detail
+        self.occurrences.append(occurrence)
+        if self.level == "all":
+            print(message)
+            if detail is not None:
+                print(detail)
+        elif self.level == "first" and first:
+            print(message)
+
+    def print_summary(self, title="Diagnostics"):
+        """Print one line per kind and key with its count and example orders."""
+        if not self.counts:
+            return
+        rows = sorted(
+            self.counts.items(), key=lambda item: (item[0][0], -item[1]["count"])
+        )
+        print(f"\n{title}: {len(self.occurrences)} issues")
+        print(f"  {'Kind':<16} {'Key':<24} {'Count':>7}  Orders")
+        for (kind, key), counts in rows[:MAX_SUMMARY_ROWS]:
+            orders = ", ".join(str(order_id) for order_id in counts["orders"])
+            if counts["count"] > len(counts["orders"]) and orders:
+                orders += ", ..."
+            print(f"  {kind:<16} {str(key):<24} {counts['count']:>7}  {orders}")
+        if len(rows) > MAX_SUMMARY_ROWS:
+            print(
+                f"  ... and {len(rows) - MAX_SUMMARY_ROWS} more, see the sidecar file"
+            )
+
+    def save(self, output_filename):
+        """
+        Write every occurrence to the sidecar of output_filename as JSON lines.
+
+        A sidecar left by an earlier run is removed when there is nothing to
+        write, so it always describes the latest conversion.
+
+        Returns:
+            Path of the sidecar file, or None if none was written
+        """
+        sidecar = diagnostics_path_for(output_filename)
+        if not self.occurrences:
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+            return None
+        with open(sidecar, "w", encoding="utf-8") as f:
+            for occurrence in self.occurrences:
+                f.write(json.dumps(occurrence, default=str) + "\n")
+        return sidecar
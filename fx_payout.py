@@ -1,14 +1,74 @@
-from typing import Dict
+from typing import Dict, Optional
 from decimal import Decimal
-from pp_payout import load_all_paypal_order_amounts
-from cc_payout import load_all_ccavenue_order_amounts
+import profiling
+from parallel import create_executor
+from pp_payout import find_paypal_csv_files, load_paypal_files, merge_paypal_results
+from cc_payout import (
+    find_ccavenue_csv_files,
+    load_ccavenue_files,
+    merge_ccavenue_results,
+)
 
 
 def load_all_order_amounts_from_config(
-    config_file: str = "config.yaml",
+    config: Dict,
+    max_workers: Optional[int] = None,
+    cache_dir: Optional[str] = None,
 ) -> Dict[str, Decimal]:
-    paypal_order_amounts = load_all_paypal_order_amounts(config_file)[0]
-    ccavenue_order_amounts = load_all_ccavenue_order_amounts(config_file)
+    """
+    Load the PayPal and CCAvenue payout amounts of the files config names.
+    The PayPal files are reconciled together in one pass while the CCAvenue
+    files are parsed, concurrently in one process pool. CCAvenue results are
+    merged in path order and PayPal wins when both sources have an order.
+    Files unchanged since the last run are read from cache_dir instead of
+    being parsed again. While profiling, the load is recorded as the
+    "payouts" stage around the per-file stages.
+    """
+    try:
+        paypal_files = find_paypal_csv_files(config)
+    except Exception as e:
+        print(f"Error loading PayPal order amounts from config: {e}")
+        paypal_files = []
+    try:
+        ccavenue_files = find_ccavenue_csv_files(config)
+    except Exception as e:
+        print(f"Error loading order amounts from config: {e}")
+        ccavenue_files = []
+    paypal_order_amounts = {}
+    ccavenue_order_amounts = {}
+    with profiling.stage("payouts") as counters:
+        executor = create_executor(
+            (1 if paypal_files else 0) + len(ccavenue_files), max_workers
+        )
+        try:
+            paypal_results = load_paypal_files(paypal_files, executor, cache_dir)
+            ccavenue_results = load_ccavenue_files(ccavenue_files, executor, cache_dir)
+            if paypal_files:
+                try:
+                    paypal_order_amounts = merge_paypal_results(
+                        paypal_files, paypal_results
+                    )[0]
+                except Exception as e:
+                    print(f"Error loading PayPal order amounts from config: {e}")
+            if ccavenue_files:
+                try:
+                    ccavenue_order_amounts = merge_ccavenue_results(
+                        ccavenue_files, ccavenue_results
+                    )
+                except Exception as e:
+                    print(f"Error loading order amounts from config: {e}")
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+        counters["orders"] = len(paypal_order_amounts) + len(ccavenue_order_amounts)
+    return combine_order_amounts(paypal_order_amounts, ccavenue_order_amounts)
+
+
+def combine_order_amounts(
+    paypal_order_amounts: Dict[str, Decimal],
+    ccavenue_order_amounts: Dict[str, Decimal],
+) -> Dict[str, Decimal]:
+    """Merge the payout amounts of both sources; PayPal wins on duplicates."""
     all_order_amounts = {}
     all_order_amounts.update(paypal_order_amounts)
     duplicates = set(all_order_amounts.keys()) & set(ccavenue_order_amounts.keys())
@@ -0,0 +1,164 @@
+from decimal import Decimal
+from typing import List, Optional
+
+from paise import from_paise
+
+# NumPy is an optional extra (see pyproject.toml). It is imported by the
+# first batch pass rather than at startup, which it would slow down by more
+# than everything else the converter imports.
+_numpy = None
+
+# Line items in an export at which the batch pass replaces the per-item one.
+DEFAULT_BATCH_THRESHOLD = 5000
+
+# Keeps every intermediate product of the vectorized pass inside int64.
+_INT64_SAFE = 2**61
+
+
+def _load_numpy():
+    """Return the numpy module, or None when it is not installed."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def _whole_paise(value: Decimal) -> Optional[int]:
+    """Return value in paise if it is a non-negative whole number of paise."""
+    if value.is_signed() or not value.is_finite():
+        return None
+    numerator, denominator = value.as_integer_ratio()
+    if 100 % denominator:
+        return None
+    return numerator * (100 // denominator)
+
+
+class GstBatch:
+    """
+    Collect the line items of an export and compute their GST amounts at once.
+
+    add() records a line item with the inputs of compute_gst_amounts, and
+    run() fills in base_rate, base_amount, cgst_amount and sgst_amount for
+    all of them. Items whose converted cost is a whole number of paise and
+    that are not bundle components become columns of int paise (cost,
+    quantity, and 1 + GST rate as a scaled integer) computed in one pass,
+    with NumPy when it is installed and plain integer arithmetic otherwise.
+    For those, integer ROUND_HALF_UP division gives exactly the Decimal result
+    (see paise.compute_gst_paise). Every other item, and every item when
+    there are fewer than threshold of them, goes through compute_amounts.
+    """
+
+    def __init__(self, compute_amounts, threshold=DEFAULT_BATCH_THRESHOLD):
+        self.compute_amounts = compute_amounts
+        self.threshold = threshold
+        self.items = []
+        self.inputs = []
+        self._rate_cache = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(
+        self, item, converted_item_cost, normal_price, total_normal_price, gst_rate
+    ):
+        self.items.append(item)
+        self.inputs.append(
+            (converted_item_cost, normal_price, total_normal_price, gst_rate)
+        )
+
+    def _scaled_rate(self, gst_rate):
+        """Return (D, 10**k) with 1 + gst_rate == D / 10**k, or None."""
+        if gst_rate not in self._rate_cache:
+            numerator, denominator = (Decimal("1") + gst_rate).as_integer_ratio()
+            scale = 1
+            while scale % denominator and scale < 10**6:
+                scale *= 10
+            scaled = None
+            if scale % denominator == 0:
+                scaled = (numerator * (scale // denominator), scale)
+            self._rate_cache[gst_rate] = scaled
+        return self._rate_cache[gst_rate]
+
+    def run(self):
+        """Compute and assign the amounts of every added line item."""
+        if len(self.items) < self.threshold:
+            for item, inputs in zip(self.items, self.inputs):
+                self._assign(item, self.compute_amounts(*inputs, item.quantity))
+            return
+        columns = {"index": [], "cost": [], "quantity": [], "rate": [], "scale": []}
+        for index, (item, inputs) in enumerate(zip(self.items, self.inputs)):
+            converted_item_cost, _, total_normal_price, gst_rate = inputs
+            cost = _whole_paise(converted_item_cost)
+            scaled_rate = self._scaled_rate(gst_rate) if gst_rate > 0 else (1, 1)
+            if (
+                cost is None
+                or item.quantity < 0
+                or total_normal_price is not None
+                or scaled_rate is None
+                or cost * scaled_rate[1] * 2 >= _INT64_SAFE
+                or cost * item.quantity * 2 >= _INT64_SAFE
+            ):
+                self._assign(item, self.compute_amounts(*inputs, item.quantity))
+                continue
+            columns["index"].append(index)
+            columns["cost"].append(cost)
+            columns["quantity"].append(item.quantity)
+            columns["rate"].append(scaled_rate[0])
+            columns["scale"].append(scaled_rate[1])
+        if not columns["index"]:
+            return
+        np = _load_numpy()
+        if np is not None:
+            results = _compute_numpy(np, columns)
+        else:
+            results = _compute_python(columns)
+        # Exports repeat the same few prices, so each distinct amount is
+        # converted back to a Decimal only once.
+        decimals = {}
+        for index, amounts in zip(columns["index"], results):
+            converted = []
+            for amount in amounts:
+                if amount not in decimals:
+                    decimals[amount] = from_paise(int(amount))
+                converted.append(decimals[amount])
+            self._assign(self.items[index], converted)
+
+    @staticmethod
+    def _assign(item, amounts):
+        base_rate, total_base, _, cgst_amount, sgst_amount = amounts
+        item.base_rate = base_rate
+        item.base_amount = total_base
+        item.cgst_amount = cgst_amount
+        item.sgst_amount = sgst_amount
+
+
+def _compute_numpy(np, columns) -> List:
+    cost = np.array(columns["cost"], dtype=np.int64)
+    quantity = np.array(columns["quantity"], dtype=np.int64)
+    rate = np.array(columns["rate"], dtype=np.int64)
+    scale = np.array(columns["scale"], dtype=np.int64)
+    # Costs are non-negative, so ROUND_HALF_UP is floor((2n + d) / 2d).
+    numerator = cost * scale
+    base_rate = (2 * numerator + rate) // (2 * rate)
+    total_base = base_rate * quantity
+    total_gst = (cost - base_rate) * quantity
+    half_gst = (total_gst + 1) // 2
+    return np.stack(
+        [base_rate, total_base, total_gst, half_gst, half_gst], axis=1
+    ).tolist()
+
+
+def _compute_python(columns) -> List:
+    results = []
+    for cost, quantity, rate, scale in zip(
+        columns["cost"], columns["quantity"], columns["rate"], columns["scale"]
+    ):
+        base_rate = (2 * cost * scale + rate) // (2 * rate)
+        total_gst = (cost - base_rate) * quantity
+        half_gst = (total_gst + 1) // 2
+        results.append((base_rate, base_rate * quantity, total_gst, half_gst, half_gst))
+    return results
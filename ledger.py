@@ -38,3 +38,76 @@ def get_party_ledger(country):
         return "Online Shop Domestic"
     else:
         return "ONLINE SHOP INTERNATIONAL"
+
+
+SHIPPING_LEDGER = "Packing and Transport Charges Collected"
+DONATION_LEDGER = "Pad for Pad scheme"
+ROUNDING_LEDGER = "Rounding Off"
+
+
+class LedgerRegistry:
+    """
+    Every ledger name a run can post to, built once from the catalog.
+
+    The sales, CGST and SGST ledgers of each distinct GST rate and the two
+    party ledgers are computed up front, so each line item and voucher looks
+    its ledgers up instead of formatting the names again. Every lookup for
+    the same ledger returns the same string object. Rates that were not
+    registered are computed on first use and kept.
+    """
+
+    def __init__(self, gst_rates=(), ledger_products=()):
+        self._export_sales = get_sales_ledger(Decimal("0"), False)
+        self._domestic_party = get_party_ledger("IN")
+        self._international_party = get_party_ledger(None)
+        self._sales_ledgers = {}
+        self._gst_ledgers = {}
+        self._ledger_products = set(ledger_products)
+        for gst_rate in gst_rates:
+            self._register(gst_rate)
+
+    def _register(self, gst_rate):
+        self._sales_ledgers[gst_rate] = get_sales_ledger(gst_rate, True)
+        self._gst_ledgers[gst_rate] = get_gst_ledgers(gst_rate, True)
+
+    def sales_ledger(self, gst_rate, is_domestic):
+        if not is_domestic:
+            return self._export_sales
+        if gst_rate not in self._sales_ledgers:
+            self._register(gst_rate)
+        return self._sales_ledgers[gst_rate]
+
+    def gst_ledgers(self, gst_rate, is_domestic):
+        """Same as get_gst_ledgers. The returned dict is shared, do not modify it."""
+        if not is_domestic:
+            return None
+        if gst_rate not in self._gst_ledgers:
+            self._register(gst_rate)
+        return self._gst_ledgers[gst_rate]
+
+    def party_ledger(self, country):
+        if country == "IN":
+            return self._domestic_party
+        return self._international_party
+
+    def ledger_names(self):
+        """
+        Return the sorted names of every ledger the vouchers can refer to.
+
+        Includes the fixed shipping, donation and rounding ledgers and the
+        products without a godown, which are posted as ledgers of their own.
+        """
+        names = {
+            self._export_sales,
+            self._domestic_party,
+            self._international_party,
+            SHIPPING_LEDGER,
+            DONATION_LEDGER,
+            ROUNDING_LEDGER,
+        }
+        names.update(self._sales_ledgers.values())
+        for gst_ledgers in self._gst_ledgers.values():
+            if gst_ledgers:
+                names.update(gst_ledgers.values())
+        names.update(self._ledger_products)
+        return sorted(names)
@@ -0,0 +1,596 @@
+import argparse
+import contextlib
+import csv
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from archives import source_name
+from records import LineItem, Order
+
+# Bump whenever the schema changes; a store written by another version is
+# rejected instead of being read with the wrong columns.
+STORE_VERSION = 1
+
+# Orders inserted per executemany call while an export is recorded, so
+# streamed exports are written in batches without being held in memory.
+INSERT_BATCH_SIZE = 1000
+
+# Amounts are stored as TEXT so they read back as the exact Decimal that was
+# written; dates are ISO 8601 text, which sorts and compares chronologically.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    id INTEGER PRIMARY KEY,
+    csv_file TEXT NOT NULL UNIQUE,
+    xml_file TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    export_id INTEGER NOT NULL REFERENCES exports(id),
+    position INTEGER NOT NULL,
+    order_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    original_amount TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    conversion_ratio TEXT NOT NULL,
+    shipping_cost TEXT NOT NULL,
+    donation_amount TEXT NOT NULL,
+    narration TEXT NOT NULL,
+    party_ledger TEXT NOT NULL,
+    is_domestic INTEGER NOT NULL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_export ON orders(export_id, position);
+CREATE INDEX IF NOT EXISTS orders_order_id ON orders(order_id);
+CREATE INDEX IF NOT EXISTS orders_date ON orders(date);
+CREATE INDEX IF NOT EXISTS orders_currency ON orders(currency, date);
+CREATE TABLE IF NOT EXISTS line_items (
+    order_row INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    base_rate TEXT NOT NULL,
+    base_amount TEXT NOT NULL,
+    gst_rate TEXT NOT NULL,
+    cgst_amount TEXT NOT NULL,
+    sgst_amount TEXT NOT NULL,
+    ledger_name TEXT NOT NULL,
+    godown_name TEXT NOT NULL,
+    original_item_cost TEXT NOT NULL,
+    converted_item_cost TEXT NOT NULL,
+    PRIMARY KEY (order_row, position)
+);
+CREATE TABLE IF NOT EXISTS payouts (
+    order_id TEXT PRIMARY KEY,
+    inr_amount TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+"""
+
+ORDER_FIELDS = (
+    "position, order_id, date, amount, original_amount, currency,"
+    " conversion_ratio, shipping_cost, donation_amount, narration, party_ledger,"
+    " is_domestic, fingerprint"
+)
+ORDER_COLUMNS = f"export_id, {ORDER_FIELDS}"
+LINE_ITEM_FIELDS = (
+    "position, name, quantity, base_rate, base_amount, gst_rate, cgst_amount,"
+    " sgst_amount, ledger_name, godown_name, original_item_cost,"
+    " converted_item_cost"
+)
+LINE_ITEM_COLUMNS = f"order_row, {LINE_ITEM_FIELDS}"
+
+
+def store_path_for(config, data_folder):
+    """
+    Return the store file configured by order_store, or None if there is none.
+
+    A relative path is taken from the data folder.
+    """
+    store = config.get("order_store")
+    if not store:
+        return None
+    return os.path.join(data_folder, os.path.expanduser(store))
+
+
+@contextlib.contextmanager
+def export_recorder(config, csv_file, xml_file):
+    """
+    Yield an ExportRecorder for csv_file, or None when no order store is
+    configured.
+
+    A store that cannot be opened or written is reported as a warning, so
+    the conversion itself goes on. The recorder is rolled back unless the
+    caller commits it.
+
+    Args:
+        config: Loaded configuration, with data_folder and order_store
+        csv_file: WooCommerce export the orders come from
+        xml_file: XML the orders were written to
+    """
+    store_path = store_path_for(config, config["data_folder"])
+    if store_path is None:
+        yield None
+        return
+    store_name = os.path.basename(store_path)
+    store = None
+    try:
+        store = OrderStore(store_path)
+        recorder = store.begin_export(source_name(csv_file), os.path.basename(xml_file))
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Warning: Could not open {store_name}: {e}")
+        if store is not None:
+            store.close()
+        yield None
+        return
+    try:
+        yield recorder
+    except sqlite3.Error as e:
+        print(f"Warning: Could not record {csv_file} in {store_name}: {e}")
+    finally:
+        recorder.close()
+        store.close()
+    if recorder.committed:
+        print(f"Recorded {recorder.count} orders in {store_name}.")
+        if recorder.missing_count:
+            print(
+                f"Warning: {recorder.missing_count} orders of {csv_file} are not in"
+                f" {store_name}, they are recorded on the next run"
+            )
+
+
+def recorded_fingerprints(config, csv_file):
+    """
+    Return the fingerprint of each order of csv_file in the order store, or
+    None when no order store is configured or it cannot be read.
+
+    An update compares these with the fingerprints of the export's orders to
+    find the orders the store is missing or holds an older version of.
+    """
+    store_path = store_path_for(config, config["data_folder"])
+    if store_path is None:
+        return None
+    if not os.path.exists(store_path):
+        return {}
+    try:
+        with OrderStore(store_path) as store:
+            return store.fingerprints(source_name(csv_file))
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Warning: Could not read {os.path.basename(store_path)}: {e}")
+        return None
+
+
+def save_payouts(config, payout_amounts):
+    """Record payout_amounts in the order store, if one is configured."""
+    store_path = store_path_for(config, config["data_folder"])
+    if store_path is None:
+        return
+    try:
+        with OrderStore(store_path) as store:
+            store.record_payouts(payout_amounts)
+    except (sqlite3.Error, ValueError) as e:
+        print(
+            f"Warning: Could not record payouts in {os.path.basename(store_path)}: {e}"
+        )
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class OrderStore:
+    """
+    Optional SQLite copy of every converted order, line item and payout.
+
+    Each conversion records the orders it wrote to an XML under the name of
+    its export, so the XML can be written again from the store and orders
+    of any month can be looked up by order ID, date or currency without
+    reading the exports again. Several processes may record exports at the
+    same time (--jobs); SQLite serializes their transactions.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Transactions are begun explicitly, see ExportRecorder
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, STORE_VERSION):
+            self.connection.close()
+            raise ValueError(
+                f"{os.path.basename(path)} was written by store version {version},"
+                f" expected {STORE_VERSION}"
+            )
+        if version == 0:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.executescript(
+                f"BEGIN IMMEDIATE; {SCHEMA}; PRAGMA user_version = {STORE_VERSION};"
+                " COMMIT;"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record_payouts(self, payout_amounts: Dict[str, Decimal]):
+        """Record the INR payout of each order, replacing earlier amounts."""
+        recorded_at = _now()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO payouts VALUES (?, ?, ?)",
+                (
+                    (order_id, str(amount), recorded_at)
+                    for order_id, amount in payout_amounts.items()
+                ),
+            )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def begin_export(self, csv_file: str, xml_file: str) -> "ExportRecorder":
+        """Start recording the orders of csv_file; see ExportRecorder."""
+        return ExportRecorder(self.connection, csv_file, xml_file)
+
+    def exports(self) -> List[Dict]:
+        """Return every recorded export with its XML name and order count."""
+        rows = self.connection.execute(
+            "SELECT csv_file, xml_file, recorded_at,"
+            " (SELECT COUNT(*) FROM orders WHERE export_id = exports.id)"
+            " FROM exports ORDER BY csv_file"
+        )
+        return [
+            {
+                "csv_file": csv_file,
+                "xml_file": xml_file,
+                "recorded_at": recorded_at,
+                "orders": order_count,
+            }
+            for csv_file, xml_file, recorded_at, order_count in rows
+        ]
+
+    def fingerprints(self, csv_file: str) -> Dict[str, Optional[str]]:
+        """Return the fingerprint of each stored order of csv_file by order ID."""
+        return dict(
+            self.connection.execute(
+                "SELECT order_id, fingerprint FROM orders"
+                " WHERE export_id = (SELECT id FROM exports WHERE csv_file = ?)",
+                (csv_file,),
+            )
+        )
+
+    def load_orders(
+        self,
+        csv_file: Optional[str] = None,
+        order_id: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        currency: Optional[str] = None,
+    ) -> Iterator[Order]:
+        """
+        Yield the stored orders that match every filter given, with their
+        line items.
+
+        Orders of one export come back in the order they were written to its
+        XML; a query across exports is ordered by date.
+
+        Args:
+            csv_file: Export the orders were recorded from
+            order_id: WooCommerce order ID
+            start: First date to include, as YYYY-MM-DD
+            end: Last date to include, as YYYY-MM-DD
+            currency: Order currency, e.g. USD
+        """
+        conditions = []
+        parameters = []
+        if csv_file is not None:
+            conditions.append("export_id = (SELECT id FROM exports WHERE csv_file = ?)")
+            parameters.append(csv_file)
+        if order_id is not None:
+            conditions.append("order_id = ?")
+            parameters.append(order_id)
+        if start is not None:
+            conditions.append("date >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("date < date(?, '+1 day')")
+            parameters.append(end)
+        if currency is not None:
+            conditions.append("currency = ?")
+            parameters.append(currency)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        ordering = "position" if csv_file is not None else "date, export_id, position"
+        # A second cursor reads the line items while the first one is open
+        orders = self.connection.execute(
+            f"SELECT id, {ORDER_COLUMNS} FROM orders {where} ORDER BY {ordering}",
+            parameters,
+        )
+        for row in orders:
+            order = Order(
+                date=datetime.fromisoformat(row[4]),
+                amount=Decimal(row[5]),
+                original_amount=Decimal(row[6]),
+                order_currency=row[7],
+                conversion_ratio=Decimal(row[8]),
+                shipping_cost=Decimal(row[9]),
+                donation_amount=Decimal(row[10]),
+                voucher_number=row[3],
+                narration=row[11],
+                party_ledger=row[12],
+                is_domestic=bool(row[13]),
+                fingerprint=row[14],
+            )
+            for item in self.connection.execute(
+                f"SELECT {LINE_ITEM_COLUMNS} FROM line_items"
+                " WHERE order_row = ? ORDER BY position",
+                (row[0],),
+            ):
+                order.products.append(
+                    LineItem(
+                        name=item[2],
+                        quantity=item[3],
+                        base_rate=Decimal(item[4]),
+                        base_amount=Decimal(item[5]),
+                        gst_rate=Decimal(item[6]),
+                        cgst_amount=Decimal(item[7]),
+                        sgst_amount=Decimal(item[8]),
+                        ledger_name=item[9],
+                        godown_name=item[10],
+                        original_item_cost=Decimal(item[11]),
+                        converted_item_cost=Decimal(item[12]),
+                    )
+                )
+            yield order
+
+
+class ExportRecorder:
+    """
+    Record the orders of one export in a single transaction.
+
+    Like ManifestWriter, orders are added as their vouchers are written and
+    nothing is visible in the store until commit(). Until then they are
+    staged in temporary tables of this connection, INSERT_BATCH_SIZE orders
+    at a time, so the store is only locked for the short copy at commit and
+    other processes can record their exports meanwhile. A full conversion
+    replaces whatever was recorded for the export before.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, csv_file: str, xml_file: str):
+        self.connection = connection
+        self.csv_file = csv_file
+        self.xml_file = xml_file
+        self.count = 0
+        self.missing_count = 0
+        self.committed = False
+        self._pending = []
+        self._replace_all = True
+        self._order_ids = None
+        self.connection.executescript(
+            "CREATE TEMP TABLE IF NOT EXISTS staged_orders"
+            " AS SELECT * FROM main.orders LIMIT 0;"
+            "CREATE TEMP TABLE IF NOT EXISTS staged_line_items"
+            " AS SELECT * FROM main.line_items LIMIT 0;"
+            "DELETE FROM staged_orders; DELETE FROM staged_line_items;"
+        )
+
+    def add(self, order: Order):
+        self._pending.append(order)
+        if len(self._pending) >= INSERT_BATCH_SIZE:
+            self._flush()
+
+    def add_all(self, orders: Iterable[Order]):
+        for order in orders:
+            self.add(order)
+
+    def replace(self, orders: Iterable[Order], order_ids: List[str]):
+        """
+        Record an update of the export instead of a full conversion.
+
+        orders replace the stored orders with the same IDs, and order_ids, in
+        this order, become the export's orders; any other stored order of
+        the export is dropped. After commit, missing_count is the number of
+        order_ids that were neither recorded before nor in orders.
+        """
+        self._replace_all = False
+        self._order_ids = list(order_ids)
+        self.add_all(orders)
+
+    def _flush(self):
+        order_rows = []
+        item_rows = []
+        for order in self._pending:
+            self.count += 1
+            order_rows.append(
+                (
+                    self.count,
+                    0,
+                    self.count - 1,
+                    order.voucher_number,
+                    order.date.isoformat(sep=" "),
+                    str(order.amount),
+                    str(order.original_amount),
+                    order.order_currency,
+                    str(order.conversion_ratio),
+                    str(order.shipping_cost),
+                    str(order.donation_amount),
+                    order.narration,
+                    order.party_ledger,
+                    int(order.is_domestic),
+                    order.fingerprint,
+                )
+            )
+            for position, item in enumerate(order.products):
+                item_rows.append(
+                    (
+                        self.count,
+                        position,
+                        item.name,
+                        item.quantity,
+                        str(item.base_rate),
+                        str(item.base_amount),
+                        str(item.gst_rate),
+                        str(item.cgst_amount),
+                        str(item.sgst_amount),
+                        item.ledger_name,
+                        item.godown_name,
+                        str(item.original_item_cost),
+                        str(item.converted_item_cost),
+                    )
+                )
+        self._pending = []
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            f"INSERT INTO staged_orders (id, {ORDER_COLUMNS})"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            order_rows,
+        )
+        self.connection.executemany(
+            f"INSERT INTO staged_line_items ({LINE_ITEM_COLUMNS})"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            item_rows,
+        )
+        self.connection.execute("COMMIT")
+
+    def commit(self):
+        """Copy the staged orders into the store in one transaction."""
+        self._flush()
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO exports (csv_file, xml_file, recorded_at)"
+                " VALUES (?, ?, ?) ON CONFLICT (csv_file) DO UPDATE SET"
+                " xml_file = excluded.xml_file, recorded_at = excluded.recorded_at",
+                (self.csv_file, self.xml_file, _now()),
+            )
+            export_id = connection.execute(
+                "SELECT id FROM exports WHERE csv_file = ?", (self.csv_file,)
+            ).fetchone()[0]
+            if self._replace_all:
+                connection.execute(
+                    "DELETE FROM orders WHERE export_id = ?", (export_id,)
+                )
+            else:
+                connection.execute(
+                    "DELETE FROM orders WHERE export_id = ?"
+                    " AND order_id IN (SELECT order_id FROM staged_orders)",
+                    (export_id,),
+                )
+            # Staged orders are numbered from 1; move them past the stored ones
+            first_row = connection.execute("SELECT MAX(id) FROM orders").fetchone()[0]
+            offset = first_row or 0
+            connection.execute(
+                f"INSERT INTO orders (id, {ORDER_COLUMNS})"
+                f" SELECT id + ?, ?, {ORDER_FIELDS}"
+                " FROM staged_orders",
+                (offset, export_id),
+            )
+            connection.execute(
+                f"INSERT INTO line_items ({LINE_ITEM_COLUMNS})"
+                f" SELECT order_row + ?, {LINE_ITEM_FIELDS}"
+                " FROM staged_line_items",
+                (offset,),
+            )
+            if self._order_ids is not None:
+                self._arrange(export_id)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self.committed = True
+
+    def _arrange(self, export_id):
+        positions = {
+            order_id: position for position, order_id in enumerate(self._order_ids)
+        }
+        stored = self.connection.execute(
+            "SELECT id, order_id FROM orders WHERE export_id = ?", (export_id,)
+        ).fetchall()
+        self.connection.executemany(
+            "DELETE FROM orders WHERE id = ?",
+            ((row_id,) for row_id, order_id in stored if order_id not in positions),
+        )
+        self.connection.executemany(
+            "UPDATE orders SET position = ? WHERE id = ?",
+            (
+                (positions[order_id], row_id)
+                for row_id, order_id in stored
+                if order_id in positions
+            ),
+        )
+        stored_ids = {order_id for _, order_id in stored}
+        self.missing_count = len(positions.keys() - stored_ids)
+
+    def close(self):
+        """Drop whatever was staged and not committed."""
+        self._pending = []
+        self.connection.executescript(
+            "DELETE FROM staged_orders; DELETE FROM staged_line_items;"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Look up orders recorded in a gst-tally order store"
+    )
+    parser.add_argument("store", help="Order store file (order_store in the config)")
+    parser.add_argument("--export", help="Only orders of this WooCommerce export file")
+    parser.add_argument("--order", help="Only the order with this ID")
+    parser.add_argument("--from", dest="start", metavar="YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", metavar="YYYY-MM-DD")
+    parser.add_argument("--currency", help="Only orders in this currency, e.g. USD")
+    args = parser.parse_args()
+    if not os.path.exists(args.store):
+        parser.error(f"order store '{args.store}' not found")
+    with OrderStore(args.store) as store:
+        filters = (args.export, args.order, args.start, args.end, args.currency)
+        if all(value is None for value in filters):
+            for export in store.exports():
+                print(
+                    f"{export['csv_file']} -> {export['xml_file']}:"
+                    f" {export['orders']} orders, recorded {export['recorded_at']}"
+                )
+            return
+        writer = csv.writer(sys.stdout)
+        writer.writerow(
+            [
+                "order_id",
+                "date",
+                "currency",
+                "original_amount",
+                "inr_amount",
+                "conversion_ratio",
+                "cgst_amount",
+                "sgst_amount",
+                "line_items",
+            ]
+        )
+        for order in store.load_orders(*filters):
+            writer.writerow(
+                [
+                    order.voucher_number,
+                    order.date.isoformat(sep=" "),
+                    order.order_currency,
+                    order.original_amount,
+                    order.amount,
+                    order.conversion_ratio,
+                    sum((item.cgst_amount for item in order.products), Decimal("0")),
+                    sum((item.sgst_amount for item in order.products), Decimal("0")),
+                    len(order.products),
+                ]
+            )
+
+
+if __name__ == "__main__":
+    main()
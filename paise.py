@@ -0,0 +1,191 @@
+from decimal import Decimal, DefaultContext
+from typing import Dict, Tuple
+
+# Integer fixed-point versions of the GST and voucher arithmetic.
+#
+# Money is carried as int paise. Intermediate values that are not whole paise
+# (FX converted costs, bundle shares, division by 1 + GST rate) are carried as
+# (coefficient, exponent) pairs and rounded to PRECISION significant digits,
+# half-even, after every operation exactly like the default Decimal context.
+# Rounding to paise is ROUND_HALF_UP. Both engines therefore produce the same
+# base, CGST, SGST and Rounding Off amounts.
+
+PRECISION = DefaultContext.prec
+
+# Above this many paise the fast path's exactness argument no longer holds
+# and the emulated Decimal path is used instead.
+FAST_PATH_LIMIT = 10**15
+
+_rate_cache: Dict[Decimal, Tuple[int, int]] = {}
+
+
+def to_fixed(value: Decimal) -> Tuple[int, int]:
+    """Return (coefficient, exponent) with value == coefficient * 10**exponent."""
+    exponent = value.as_tuple().exponent
+    return int(value.scaleb(-exponent)), exponent
+
+
+def from_paise(paise: int) -> Decimal:
+    """Return paise as a Decimal rupee amount with two decimal places."""
+    return Decimal(paise).scaleb(-2)
+
+
+def to_paise(value: Decimal) -> int:
+    """Round value to whole paise, ROUND_HALF_UP."""
+    return _quantize(*to_fixed(value))
+
+
+def _round(coefficient: int, exponent: int) -> Tuple[int, int]:
+    magnitude = abs(coefficient)
+    excess = len(str(magnitude)) - PRECISION
+    if excess <= 0:
+        return coefficient, exponent
+    scale = 10**excess
+    magnitude, remainder = divmod(magnitude, scale)
+    half = scale // 2
+    if remainder > half or (remainder == half and magnitude & 1):
+        magnitude += 1
+    return (magnitude if coefficient >= 0 else -magnitude), exponent + excess
+
+
+def _mul(a: Tuple[int, int], b: Tuple[int, int]) -> Tuple[int, int]:
+    return _round(a[0] * b[0], a[1] + b[1])
+
+
+def _sub(a: Tuple[int, int], b: Tuple[int, int]) -> Tuple[int, int]:
+    exponent = min(a[1], b[1])
+    coefficient = a[0] * 10 ** (a[1] - exponent) - b[0] * 10 ** (b[1] - exponent)
+    return _round(coefficient, exponent)
+
+
+def _div(a: Tuple[int, int], b: Tuple[int, int]) -> Tuple[int, int]:
+    numerator, denominator = abs(a[0]), abs(b[0])
+    if numerator == 0:
+        return 0, 0
+    # Scale the numerator so the quotient has at least PRECISION + 1 digits,
+    # then round once using the remainder as a sticky bit.
+    shift = max(0, PRECISION + 1 + len(str(denominator)) - len(str(numerator)))
+    quotient, remainder = divmod(numerator * 10**shift, denominator)
+    exponent = a[1] - b[1] - shift
+    excess = len(str(quotient)) - PRECISION
+    scale = 10**excess
+    quotient, dropped = divmod(quotient, scale)
+    half = scale // 2
+    if dropped > half or (dropped == half and (remainder or quotient & 1)):
+        quotient += 1
+    if (a[0] < 0) != (b[0] < 0):
+        quotient = -quotient
+    return quotient, exponent + excess
+
+
+def _quantize(coefficient: int, exponent: int) -> int:
+    """Round coefficient * 10**exponent rupees to paise, ROUND_HALF_UP."""
+    if exponent >= -2:
+        return coefficient * 10 ** (exponent + 2)
+    return _divide_half_up(coefficient, 10 ** (-2 - exponent))
+
+
+def _divide_half_up(numerator: int, denominator: int) -> int:
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def _one_plus_rate(gst_rate: Decimal) -> Tuple[int, int]:
+    if gst_rate not in _rate_cache:
+        _rate_cache[gst_rate] = to_fixed(Decimal("1") + gst_rate)
+    return _rate_cache[gst_rate]
+
+
+def compute_gst_paise(
+    converted_item_cost: Decimal,
+    normal_price,
+    total_normal_price,
+    gst_rate: Decimal,
+    quantity: int,
+) -> Tuple[int, int, int, int, int]:
+    """
+    Integer paise version of compute_gst_amounts.
+
+    Returns:
+        (base_rate, total_base, total_gst, cgst_amount, sgst_amount) in paise
+    """
+    cost = to_fixed(converted_item_cost)
+    if total_normal_price is not None:
+        share = _div(cost, to_fixed(total_normal_price))
+        cost = _mul(to_fixed(normal_price), share)
+    if gst_rate <= 0:
+        base_rate = _quantize(*cost)
+        return base_rate, base_rate * quantity, 0, 0, 0
+    one_plus_rate = _one_plus_rate(gst_rate)
+    cost_paise = cost[0] * 10 ** (cost[1] + 2) if cost[1] >= -2 else None
+    if (
+        cost_paise is not None
+        and abs(cost_paise) < FAST_PATH_LIMIT
+        and one_plus_rate[0] < 10**6
+        and one_plus_rate[1] <= 0
+    ):
+        # Whole-paise cost: the exact quotient is either a terminating
+        # half-paisa tie or far enough from one that Decimal's rounding to
+        # PRECISION digits cannot move it across, so plain integer division
+        # gives the same paise.
+        base_rate = _divide_half_up(
+            cost_paise * 10 ** -one_plus_rate[1], one_plus_rate[0]
+        )
+        total_gst = (cost_paise - base_rate) * quantity
+    else:
+        base_rate = _quantize(*_div(cost, one_plus_rate))
+        total_gst = _quantize(*_mul(_sub(cost, (base_rate, -2)), (quantity, 0)))
+    half_gst = _divide_half_up(total_gst, 2)
+    return base_rate, base_rate * quantity, total_gst, half_gst, half_gst
+
+
+def voucher_amounts_paise(sale) -> Dict:
+    """Integer paise version of voucher_amounts."""
+    sale_amount = to_paise(sale.amount)
+    total_entries_value = 0
+    shipping_amount = None
+    donation_amount = None
+    if sale.shipping_cost > 0:
+        shipping_amount = to_paise(sale.shipping_cost)
+        total_entries_value += shipping_amount
+    if sale.donation_amount > 0:
+        donation_amount = to_paise(sale.donation_amount)
+        total_entries_value += donation_amount
+    products = []
+    for product in sale.products:
+        base_rate = to_paise(product.base_rate)
+        base_amount = to_paise(product.base_amount)
+        products.append((from_paise(base_rate), from_paise(base_amount)))
+        total_entries_value += base_amount
+    gst_entries = []
+    if sale.is_domestic:
+        gst_rates_used = {}
+        for product in sale.products:
+            if product.gst_rate > 0:
+                amounts = gst_rates_used.setdefault(product.gst_rate, [0, 0])
+                amounts[0] += to_paise(product.cgst_amount)
+                amounts[1] += to_paise(product.sgst_amount)
+        for gst_rate, (cgst_amount, sgst_amount) in gst_rates_used.items():
+            gst_entries.append(
+                (
+                    gst_rate,
+                    from_paise(cgst_amount) if cgst_amount > 0 else None,
+                    from_paise(sgst_amount) if sgst_amount > 0 else None,
+                )
+            )
+            total_entries_value += max(cgst_amount, 0) + max(sgst_amount, 0)
+    rounding_diff = sale_amount - total_entries_value
+    return {
+        "sale_amount": from_paise(sale_amount),
+        "shipping_amount": (
+            from_paise(shipping_amount) if shipping_amount is not None else None
+        ),
+        "donation_amount": (
+            from_paise(donation_amount) if donation_amount is not None else None
+        ),
+        "products": products,
+        "gst": gst_entries,
+        "rounding_off": from_paise(rounding_diff) if abs(rounding_diff) >= 1 else None,
+    }
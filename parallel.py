@@ -0,0 +1,52 @@
+import contextlib
+import io
+import os
+
+import profiling
+
+
+def call_captured(func, *args):
+    """
+    Call func(*args) and return (result, everything it printed).
+
+    Lets worker processes run in parallel while the parent prints each
+    worker's console output as one block, in a deterministic order.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = func(*args)
+    return result, output.getvalue()
+
+
+def map_captured(func, items, executor=None, args=()):
+    """
+    Map func(item, *args) over items, returning an iterator of (result, output)
+    in input order.
+
+    With an executor every call is submitted straight away, so work for
+    several maps can be queued before any result is consumed. Without one the
+    calls run lazily, one per item, as the iterator is consumed. Stages a
+    worker records while profiling are merged into this process's profile as
+    its result is consumed.
+    """
+    if executor is None:
+        return (call_captured(func, item, *args) for item in items)
+    task = profiling.worker_task(func)
+    futures = [executor.submit(call_captured, task, item, *args) for item in items]
+    return _collected(future.result() for future in futures)
+
+
+def _collected(results):
+    for result, output in results:
+        yield profiling.collect(result), output
+
+
+def create_executor(task_count, max_workers=None):
+    """Return a process pool sized for task_count tasks, or None if one worker is enough."""
+    workers = min(max_workers or os.cpu_count() or 1, task_count)
+    if workers <= 1:
+        return None
+    # Imported here: most runs never start a pool, and the import is slow
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=workers)
@@ -0,0 +1,107 @@
+import logging
+import os
+import pickle
+
+from archives import source_digest, source_stat
+from parallel import call_captured
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a cached parser changes what it returns or prints, so entries
+# written by older code are ignored.
+CACHE_VERSION = 4
+
+CACHE_FOLDER_NAME = ".gst-tally-cache"
+
+
+def default_cache_dir(data_folder):
+    return os.path.join(data_folder, CACHE_FOLDER_NAME)
+
+
+def _entry_path(cache_dir, kind, file_paths):
+    import hashlib
+
+    joined_paths = "\n".join(os.path.abspath(path) for path in file_paths)
+    path_hash = hashlib.sha256(joined_paths.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{kind}-{path_hash[:32]}.pickle")
+
+
+def _read_entry_key(entry_path):
+    try:
+        with open(entry_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug("Ignoring unreadable cache entry %s: %s", entry_path, e)
+        return None
+
+
+def _read_entry_value(entry_path):
+    with open(entry_path, "rb") as f:
+        pickle.load(f)
+        return pickle.load(f)
+
+
+def _write_entry(entry_path, key, value):
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    temp_path = f"{entry_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def cached_parse(cache_dir, kind, parse, file_path, *args):
+    """
+    Return parse(file_path, *args), reusing the result of an earlier run when
+    the file is unchanged.
+
+    Each file has one entry under cache_dir, keyed by the cache version, the
+    file's absolute path, size, mtime and SHA-256 of its content (for a
+    member of a .zip: the archive's size and mtime and the member's CRC-32,
+    see archives.source_digest). Any change
+    to the key is a miss and overwrites the entry, so stale results are never
+    returned and the cache holds one entry per input file. Whatever parse
+    printed is stored too and replayed on a hit, so the console output is the
+    same either way. A list of files parsed together shares one entry, keyed
+    by all of them.
+
+    Args:
+        cache_dir: Cache folder, or None to always call parse
+        kind: Short name of the parser, part of the entry file name
+        parse: Parser function taking file_path as its first argument
+        file_path: Input file, or list of input files
+    """
+    if cache_dir is None:
+        return parse(file_path, *args)
+    file_paths = [file_path] if isinstance(file_path, str) else list(file_path)
+    key = (CACHE_VERSION, kind)
+    try:
+        for path in file_paths:
+            stat = source_stat(path)
+            key += (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return parse(file_path, *args)
+    entry_path = _entry_path(cache_dir, kind, file_paths)
+    stored_key = _read_entry_key(entry_path)
+    key += tuple(source_digest(path) for path in file_paths)
+    if stored_key == key:
+        try:
+            result, output = _read_entry_value(entry_path)
+            logger.debug("Cache hit for %s (%s)", file_path, kind)
+            print(output, end="")
+            return result
+        except Exception as e:
+            logger.debug("Ignoring unreadable cache entry %s: %s", entry_path, e)
+    result, output = call_captured(parse, file_path, *args)
+    print(output, end="")
+    try:
+        _write_entry(entry_path, key, (result, output))
+    except Exception as e:
+        print(f"Warning: Could not write cache entry for {file_path}: {e}")
+    return result
@@ -1,18 +1,340 @@
 import csv
-import glob
+import heapq
 import logging
 import os
-import yaml
+import re
+from datetime import datetime, timedelta, timezone, tzinfo
 from decimal import Decimal, InvalidOperation
-from typing import Dict, List, Set, Tuple
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import profiling
+from archives import SourceOpener, source_size
+from parallel import map_captured
+from records import PayPalOrderDetail, PayPalPayment
+from parse_cache import cached_parse
+from settings import load_config, paypal_files
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 
 
+class PayPalReconciler:
+    """
+    Reconcile PayPal transactions, fed in file order, into INR order amounts.
+
+    Foreign currency payments are held per currency until a withdrawal and its
+    matching currency conversion reveal the exchange rate. Order details are
+    indexed by order ID, so conversions and reversals only touch the details
+    of the orders involved and a whole download is reconciled in linear time.
+    """
+
+    def __init__(self):
+        self.order_amounts: Dict[str, Decimal] = {}
+        self.refunded_orders: Set[str] = set()
+        self.order_details: List[PayPalOrderDetail] = []
+        self._pending_payments: Dict[str, List[PayPalPayment]] = {}
+        self._details_by_order: Dict[str, List[PayPalOrderDetail]] = {}
+        self._unconverted_details: Dict[str, List[PayPalOrderDetail]] = {}
+        self._pending_withdrawal = None
+
+    @property
+    def unprocessed_count(self) -> int:
+        """Number of foreign currency payments not yet withdrawn."""
+        return sum(len(payments) for payments in self._pending_payments.values())
+
+    def results(self) -> Tuple[Dict[str, Decimal], Set[str], List[PayPalOrderDetail]]:
+        return self.order_amounts, self.refunded_orders, self.order_details
+
+    def process_row(self, row: Dict[str, str]):
+        transaction_type = row.get("Type", "").strip()
+        currency = row.get("Currency", "").strip()
+        status = row.get("Status", "").strip()
+        if status == "Pending":
+            return
+        if transaction_type == "Express Checkout Payment" and status == "Completed":
+            self._add_payment(row, currency)
+        elif transaction_type == "User Initiated Withdrawal" and currency == "INR":
+            self._add_withdrawal(row)
+        elif (
+            transaction_type == "General Currency Conversion"
+            and self._pending_withdrawal
+        ):
+            self._convert(row, currency)
+        elif transaction_type == "Payment Reversal":
+            self._reverse(row)
+
+    def _add_payment(self, row: Dict[str, str], currency: str):
+        custom_number = row.get("Custom Number", "").strip()
+        transaction_id = row.get("Transaction ID", "").strip()
+        if not custom_number:
+            return
+        order_id = custom_number
+        try:
+            gross_amount = Decimal(row.get("Gross", "0").replace(",", ""))
+            if gross_amount > 0 and currency != "INR":
+                self._pending_payments.setdefault(currency, []).append(
+                    PayPalPayment(
+                        order_id=order_id,
+                        gross_amount=gross_amount,
+                        transaction_id=transaction_id,
+                        date=row.get("Date", ""),
+                        currency=currency,
+                    )
+                )
+                detail = PayPalOrderDetail(
+                    order_id=order_id,
+                    currency=currency,
+                    gross_amount=str(gross_amount),
+                    inr_amount="Pending",
+                    transaction_id=transaction_id,
+                    date=row.get("Date", ""),
+                    status="Pending Conversion",
+                )
+                self.order_details.append(detail)
+                self._details_by_order.setdefault(order_id, []).append(detail)
+                self._unconverted_details.setdefault(order_id, []).append(detail)
+        except (InvalidOperation, ValueError) as e:
+            print(f"Error parsing amount for order {order_id}: {e}")
+
+    def _add_withdrawal(self, row: Dict[str, str]):
+        try:
+            inr_amount = abs(Decimal(row.get("Gross", "0").replace(",", "")))
+            if inr_amount > 0:
+                self._pending_withdrawal = {
+                    "inr_amount": inr_amount,
+                    "transaction_id": row.get("Transaction ID", ""),
+                }
+        except (InvalidOperation, ValueError) as e:
+            print(f"Error parsing withdrawal amount: {e}")
+
+    def _convert(self, row: Dict[str, str], currency: str):
+        try:
+            amount = Decimal(row.get("Gross", "0").replace(",", ""))
+            reference_txn = row.get("Reference Txn ID", "")
+            if (
+                amount < 0
+                and currency != "INR"
+                and reference_txn == self._pending_withdrawal["transaction_id"]
+            ):
+                foreign_amount = abs(amount)
+                exchange_rate = self._pending_withdrawal["inr_amount"] / foreign_amount
+                if currency in self._pending_payments:
+                    for payment in self._pending_payments[currency]:
+                        inr_total = payment.gross_amount * exchange_rate
+                        inr_amount = inr_total.quantize(Decimal("0.01"))
+                        self.order_amounts[payment.order_id] = inr_amount
+                        for detail in self._unconverted_details.pop(
+                            payment.order_id, []
+                        ):
+                            detail.inr_amount = str(inr_amount)
+                            detail.status = "Converted"
+                            detail.exchange_rate = str(exchange_rate)
+                    self._pending_payments[currency] = []
+                self._pending_withdrawal = None
+        except (InvalidOperation, ValueError) as e:
+            print(f"Error processing currency conversion: {e}")
+
+    def _reverse(self, row: Dict[str, str]):
+        custom_number = row.get("Custom Number", "").strip()
+        if not custom_number:
+            return
+        order_id = custom_number
+        self.refunded_orders.add(order_id)
+        self.order_amounts.pop(order_id, None)
+        self._unconverted_details.pop(order_id, None)
+        for detail in self._details_by_order.get(order_id, []):
+            detail.status = "Refunded"
+
+
+# UTC offsets in minutes of the zone abbreviations PayPal writes in the
+# TimeZone column. Other zones are read as GMT+05:30 or an IANA name.
+ZONE_OFFSETS = {
+    "GMT": 0,
+    "UTC": 0,
+    "IST": 330,
+    "SGT": 480,
+    "HKT": 480,
+    "JST": 540,
+    "AEST": 600,
+    "AEDT": 660,
+    "BST": 60,
+    "CET": 60,
+    "CEST": 120,
+    "EST": -300,
+    "EDT": -240,
+    "CST": -360,
+    "CDT": -300,
+    "MST": -420,
+    "MDT": -360,
+    "PST": -480,
+    "PDT": -420,
+}
+
+_GMT_OFFSET = re.compile(r"(?:GMT|UTC)([+-])(\d{1,2})(?::?(\d{2}))?")
+
+_zones: Dict[str, tzinfo] = {}
+
+
+class TransactionDateError(ValueError):
+    """A PayPal row whose date, time or time zone cannot be read."""
+
+
+def _zone(name: str) -> tzinfo:
+    zone = _zones.get(name)
+    if zone is not None:
+        return zone
+    match = _GMT_OFFSET.fullmatch(name)
+    if name in ZONE_OFFSETS:
+        zone = timezone(timedelta(minutes=ZONE_OFFSETS[name]))
+    elif match:
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        zone = timezone(-offset if sign == "-" else offset)
+    else:
+        try:
+            from zoneinfo import ZoneInfo
+
+            zone = ZoneInfo(name)
+        except (ImportError, ValueError, KeyError):
+            raise TransactionDateError(f"Unknown TimeZone '{name}'") from None
+    _zones[name] = zone
+    return zone
+
+
+def transaction_key(row: Dict[str, str]) -> Optional[datetime]:
+    """
+    Return when the transaction of a PayPal row happened, in UTC, or None
+    for a row without a date.
+
+    Date is read as DD/MM/YYYY and Time as HH:MM or HH:MM:SS, as downloads
+    of Indian PayPal accounts write them, in the zone of the TimeZone column.
+
+    Raises:
+        TransactionDateError: If the date, time or zone is in any other
+            format, as the row could not be put in transaction order
+    """
+    date = (row.get("Date") or "").strip()
+    if not date:
+        return None
+    time = (row.get("Time") or "").strip()
+    try:
+        day, month, year = date.split("/")
+        clock = [int(part) for part in time.split(":")]
+        if len(year) != 4 or len(clock) not in (2, 3):
+            raise ValueError
+        local = datetime(int(year), int(month), int(day), *clock)
+    except ValueError:
+        raise TransactionDateError(
+            f"Date '{date} {time}' of transaction"
+            f" {row.get('Transaction ID') or '(no ID)'} is not DD/MM/YYYY HH:MM:SS"
+        ) from None
+    zone = _zone((row.get("TimeZone") or "").strip())
+    return local - zone.utcoffset(local)
+
+
+def _keyed_rows(rows: Iterable[Dict[str, str]]) -> Iterator[Tuple[datetime, Dict]]:
+    # A row without a date keeps its place after the row before it
+    key = datetime.min
+    for row in rows:
+        key = transaction_key(row) or key
+        yield key, row
+
+
+class MergedPayPalRows:
+    """
+    The rows of several PayPal downloads as one stream in transaction order.
+
+    Downloads list transactions oldest first, so the files are merged lazily
+    (heapq.merge) on the UTC time of each row (see transaction_key) and only
+    one row per file is held at a time. Rows with the same timestamp keep
+    their file order, and files earlier in the list go first, so a
+    withdrawal is still followed by its currency conversions.
+
+    A transaction in more than one download (overlapping date ranges) is
+    passed on once. Transactions are matched by Transaction ID and Status,
+    so a payment that was Pending in an older download and Completed in a
+    newer one is still seen as completed. Copies of a transaction share its
+    timestamp, so IDs are only remembered until the stream moves past it.
+    """
+
+    def __init__(self, readers: List[Iterable[Dict[str, str]]]):
+        self.readers = readers
+        self.row_count = 0
+        self.duplicate_count = 0
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        seen = {}
+        latest = None
+        keyed_readers = [_keyed_rows(reader) for reader in self.readers]
+        for key, row in heapq.merge(*keyed_readers, key=itemgetter(0)):
+            self.row_count += 1
+            transaction_id = (row.get("Transaction ID") or "").strip()
+            if transaction_id:
+                seen_key = (transaction_id, (row.get("Status") or "").strip())
+                if seen_key in seen:
+                    self.duplicate_count += 1
+                    continue
+                if latest is None or key > latest:
+                    latest = key
+                    seen = {
+                        old_key: old_time
+                        for old_key, old_time in seen.items()
+                        if old_time >= key
+                    }
+                seen[seen_key] = key
+            yield row
+
+
+def reconcile_paypal_csv_files(
+    csv_file_paths: List[str],
+) -> Tuple[Dict[str, Decimal], Set[str], List[PayPalOrderDetail]]:
+    """
+    Reconcile several PayPal downloads together in one pass.
+
+    The files are streamed through MergedPayPalRows into a single
+    PayPalReconciler, so a withdrawal in one download settles the pending
+    payments of another and overlapping downloads are counted once. Memory
+    grows with the pending payments and results, not with the files.
+    Downloads in a .zip or .gz are decompressed as they are streamed, each
+    archive opened once.
+
+    Returns:
+        Same as extract_order_amounts_from_paypal_csv
+    """
+    reconciler = PayPalReconciler()
+    merged = MergedPayPalRows([])
+    try:
+        with SourceOpener() as opener:
+            for csv_file_path in csv_file_paths:
+                f = opener.open(csv_file_path)
+                reader = csv.DictReader(f)
+                logger.debug("Headers in %s: %s", csv_file_path, reader.fieldnames)
+                merged.readers.append(reader)
+            for row in merged:
+                reconciler.process_row(row)
+            profiling.count("rows", merged.row_count)
+    except FileNotFoundError as e:
+        print(f"Error: PayPal CSV file '{e.filename}' not found!")
+    except TransactionDateError as e:
+        # Amounts reconciled out of order could be converted at the wrong rate
+        print(f"Error: {e}, no PayPal amounts were loaded")
+        return {}, set(), []
+    except Exception as e:
+        print(f"Error reading PayPal CSV file: {e}")
+    if merged.duplicate_count:
+        print(
+            f"  Skipped {merged.duplicate_count} transactions found in more than one file"
+        )
+    unprocessed_count = reconciler.unprocessed_count
+    if unprocessed_count > 0:
+        print(f"  Found {unprocessed_count} payments not yet withdrawn")
+    return reconciler.results()
+
+
 def extract_order_amounts_from_paypal_csv(
     csv_file_path: str,
-) -> Tuple[Dict[str, Decimal], Set[str], List[Dict]]:
+) -> Tuple[Dict[str, Decimal], Set[str], List[PayPalOrderDetail]]:
     """
     Extract WooCommerce order IDs and their INR totals from PayPal CSV, with details for verification.
 
@@ -27,214 +349,132 @@ def extract_order_amounts_from_paypal_csv(
         Tuple of (order_amounts, refunded_orders, order_details)
         - order_amounts: Dictionary mapping order_id to INR amount
         - refunded_orders: Set of order IDs that have been refunded/reversed
-        - order_details: List of dictionaries with order details for verification
+        - order_details: List of PayPalOrderDetail records for verification
     """
+    return reconcile_paypal_csv_files([csv_file_path])
+
+
+def find_paypal_csv_files(config: Dict) -> List[str]:
+    """
+    List the PayPal CSV files in the configured folder, sorted by path.
+
+    Args:
+        config: Configuration returned by settings.load_config
+
+    Returns:
+        Sorted list of file paths (empty if there are none)
+    """
+    csv_files = paypal_files(config)
+    if not csv_files:
+        paypal_prefix = config.get("paypal_prefix", "Download")
+        print(
+            f"No PayPal CSV files found with '{paypal_prefix}' prefix in {config['data_folder']}"
+        )
+    return csv_files
+
+
+def _load_paypal_files(
+    csv_files: List[str], cache_dir: Optional[str] = None
+) -> Tuple[Dict[str, Decimal], Set[str], List[PayPalOrderDetail]]:
+    names = ", ".join(os.path.basename(csv_file) for csv_file in csv_files)
+    print(f"\nProcessing {names} in transaction order...")
+    with profiling.stage(
+        "paypal",
+        names,
+        bytes_read=sum(source_size(csv_file) for csv_file in csv_files),
+    ) as counters:
+        results = cached_parse(
+            cache_dir, "paypal", reconcile_paypal_csv_files, csv_files
+        )
+        counters["orders"] = len(results[0])
+    return results
+
+
+def load_paypal_files(
+    csv_files: List[str], executor=None, cache_dir: Optional[str] = None
+) -> Iterator[Tuple[Tuple[Dict[str, Decimal], Set[str], List[PayPalOrderDetail]], str]]:
+    """
+    Start reconciling csv_files together, on one of executor's workers when
+    one is given.
+
+    The result is reused from cache_dir while none of the files has changed
+    since the last run.
+
+    Returns:
+        Iterator of (results, console output), with nothing for no files, to
+        be passed to merge_paypal_results
+    """
+    batches = [csv_files] if csv_files else []
+    return map_captured(_load_paypal_files, batches, executor, (cache_dir,))
+
+
+def merge_paypal_results(
+    csv_files: List[str], file_results
+) -> Tuple[Dict[str, Decimal], List[PayPalOrderDetail]]:
+    """
+    Print and return the results of reconciling csv_files.
+
+    Args:
+        csv_files: Files that were reconciled
+        file_results: Iterator returned by load_paypal_files
+
+    Returns:
+        Tuple of (order_amounts, order_details)
+    """
+    print(f"Found {len(csv_files)} PayPal CSV files to process:")
+    for csv_file in csv_files:
+        print(f"  - {os.path.basename(csv_file)}")
     order_amounts = {}
-    pending_payments = {}
     refunded_orders = set()
     order_details = []
-    pending_withdrawal = None
-    try:
-        with open(csv_file_path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            logger.debug("Headers in %s: %s", csv_file_path, reader.fieldnames)
-            for row in reader:
-                transaction_type = row.get("Type", "").strip()
-                currency = row.get("Currency", "").strip()
-                status = row.get("Status", "").strip()
-                if status == "Pending":
-                    continue
-                if (
-                    transaction_type == "Express Checkout Payment"
-                    and status == "Completed"
-                ):
-                    custom_number = row.get("Custom Number", "").strip()
-                    transaction_id = row.get("Transaction ID", "").strip()
-                    if custom_number:
-                        order_id = custom_number
-                        try:
-                            gross_amount = Decimal(
-                                row.get("Gross", "0").replace(",", "")
-                            )
-                            if gross_amount > 0 and currency != "INR":
-                                if currency not in pending_payments:
-                                    pending_payments[currency] = []
-                                payment_info = {
-                                    "order_id": order_id,
-                                    "gross_amount": gross_amount,
-                                    "transaction_id": transaction_id,
-                                    "date": row.get("Date", ""),
-                                    "currency": currency,
-                                }
-                                pending_payments[currency].append(payment_info)
-                                order_details.append(
-                                    {
-                                        "order_id": order_id,
-                                        "currency": currency,
-                                        "gross_amount": str(gross_amount),
-                                        "inr_amount": "Pending",
-                                        "transaction_id": transaction_id,
-                                        "date": row.get("Date", ""),
-                                        "status": "Pending Conversion",
-                                    }
-                                )
-                        except (InvalidOperation, ValueError) as e:
-                            print(f"Error parsing amount for order {order_id}: {e}")
-                elif (
-                    transaction_type == "User Initiated Withdrawal"
-                    and currency == "INR"
-                ):
-                    try:
-                        inr_amount = abs(
-                            Decimal(row.get("Gross", "0").replace(",", ""))
-                        )
-                        if inr_amount > 0:
-                            pending_withdrawal = {
-                                "inr_amount": inr_amount,
-                                "transaction_id": row.get("Transaction ID", ""),
-                            }
-                    except (InvalidOperation, ValueError) as e:
-                        print(f"Error parsing withdrawal amount: {e}")
-                elif (
-                    transaction_type == "General Currency Conversion"
-                    and pending_withdrawal
-                ):
-                    try:
-                        amount = Decimal(row.get("Gross", "0").replace(",", ""))
-                        reference_txn = row.get("Reference Txn ID", "")
-                        if (
-                            amount < 0
-                            and currency != "INR"
-                            and reference_txn == pending_withdrawal["transaction_id"]
-                        ):
-                            foreign_amount = abs(amount)
-                            exchange_rate = (
-                                pending_withdrawal["inr_amount"] / foreign_amount
-                            )
-                            if currency in pending_payments:
-                                for payment in pending_payments[currency]:
-                                    inr_total = payment["gross_amount"] * exchange_rate
-                                    order_amounts[payment["order_id"]] = (
-                                        inr_total.quantize(Decimal("0.01"))
-                                    )
-                                    for detail in order_details:
-                                        if (
-                                            detail["order_id"] == payment["order_id"]
-                                            and detail["status"] == "Pending Conversion"
-                                        ):
-                                            detail["inr_amount"] = str(
-                                                inr_total.quantize(Decimal("0.01"))
-                                            )
-                                            detail["status"] = "Converted"
-                                            detail["exchange_rate"] = str(exchange_rate)
-                                pending_payments[currency] = []
-                            pending_withdrawal = None
-                    except (InvalidOperation, ValueError) as e:
-                        print(f"Error processing currency conversion: {e}")
-                elif transaction_type == "Payment Reversal":
-                    custom_number = row.get("Custom Number", "").strip()
-                    if custom_number:
-                        order_id = custom_number
-                        refunded_orders.add(order_id)
-                        if order_id in order_amounts:
-                            del order_amounts[order_id]
-                        for detail in order_details:
-                            if detail["order_id"] == order_id:
-                                detail["status"] = "Refunded"
-    except FileNotFoundError:
-        print(f"Error: PayPal CSV file '{csv_file_path}' not found!")
-    except Exception as e:
-        print(f"Error reading PayPal CSV file: {e}")
-    unprocessed_count = sum(len(payments) for payments in pending_payments.values())
-    if unprocessed_count > 0:
-        print(f"  Found {unprocessed_count} payments not yet withdrawn")
-    return order_amounts, refunded_orders, order_details
+    for (order_amounts, refunded_orders, order_details), output in file_results:
+        print(output, end="")
+    print(
+        f"\nTotal: Loaded amounts for {len(order_amounts)} unique orders from {len(csv_files)} files"
+    )
+    if refunded_orders:
+        print(f"Total refunded orders: {len(refunded_orders)}")
+    return order_amounts, order_details
 
 
 def load_all_paypal_order_amounts(
-    config_file: str = "config.yaml",
-) -> Tuple[Dict[str, Decimal], List[Dict]]:
+    config: Dict,
+    cache_dir: Optional[str] = None,
+) -> Tuple[Dict[str, Decimal], List[PayPalOrderDetail]]:
     """
     Load order amounts from all PayPal CSV files in the configured folder.
 
+    The files are reconciled together in one pass, in transaction order
+    (see reconcile_paypal_csv_files).
+
     Args:
-        config_file: Path to configuration file
+        config: Configuration returned by settings.load_config
+        cache_dir: Folder for cached parse results, or None to disable caching
 
     Returns:
         Tuple of (order_amounts, order_details)
         - order_amounts: Dictionary of order_id -> INR amount (merged from all files)
-        - order_details: List of dictionaries with detailed order info for verification
+        - order_details: List of PayPalOrderDetail records for verification
     """
     try:
-        with open(config_file, "r") as f:
-            config = yaml.safe_load(f)
-        data_folder = config.get("data_folder")
-        paypal_prefix = config.get("paypal_prefix", "Download")
-        if not data_folder:
-            print("Warning: 'data_folder' must be specified in config")
-            return {}, []
-        if data_folder.startswith("~"):
-            data_folder = os.path.expanduser(data_folder)
-        if not os.path.exists(data_folder):
-            print(f"Error: Data folder '{data_folder}' does not exist!")
-            return {}, []
-        csv_file_pattern = os.path.join(
-            data_folder, f"{paypal_prefix}*.CSV"
-        )  # Note: uppercase .CSV
-        csv_files = glob.glob(csv_file_pattern)
-        csv_file_pattern_lower = os.path.join(data_folder, f"{paypal_prefix}*.csv")
-        csv_files.extend(glob.glob(csv_file_pattern_lower))
-        csv_files = list(set(csv_files))
+        csv_files = find_paypal_csv_files(config)
         if not csv_files:
-            print(
-                f"No PayPal CSV files found with '{paypal_prefix}' prefix in {data_folder}"
-            )
             return {}, []
-        print(f"Found {len(csv_files)} PayPal CSV files to process:")
-        for csv_file in csv_files:
-            print(f"  - {os.path.basename(csv_file)}")
-        all_order_amounts = {}
-        all_refunded_orders = set()
-        all_order_details = []
-        total_orders = 0
-        for csv_file in csv_files:
-            print(f"\nProcessing {os.path.basename(csv_file)}...")
-            file_amounts, file_refunds, file_details = (
-                extract_order_amounts_from_paypal_csv(csv_file)
-            )
-            duplicates = set(all_order_amounts.keys()) & set(file_amounts.keys())
-            if duplicates:
-                print(f"Warning: Found duplicate order IDs: {duplicates}")
-                for order_id in duplicates:
-                    if all_order_amounts[order_id] != file_amounts[order_id]:
-                        print(
-                            f"  Order {order_id}: {all_order_amounts[order_id]} vs {file_amounts[order_id]}"
-                        )
-            all_order_amounts.update(file_amounts)
-            all_refunded_orders.update(file_refunds)
-            all_order_details.extend(file_details)
-            total_orders += len(file_amounts)
-            print(f"  Loaded {len(file_amounts)} orders from this file")
-            if file_refunds:
-                print(f"  Found {len(file_refunds)} refunded orders")
-        print(
-            f"\nTotal: Loaded amounts for {len(all_order_amounts)} unique orders from {len(csv_files)} files"
+        return merge_paypal_results(
+            csv_files, load_paypal_files(csv_files, cache_dir=cache_dir)
         )
-        if all_refunded_orders:
-            print(f"Total refunded orders: {len(all_refunded_orders)}")
-        return all_order_amounts, all_order_details
     except Exception as e:
         print(f"Error loading PayPal order amounts from config: {e}")
         return {}, []
 
 
-def save_order_details(data_folder: str, order_details: List[Dict]):
+def save_order_details(data_folder: str, order_details: List[PayPalOrderDetail]):
     """
     Save order details to a CSV file for manual cross-checking.
 
     Args:
         data_folder: Path to the data folder
-        order_details: List of dictionaries containing order details
+        order_details: List of PayPalOrderDetail records
     """
     if not order_details:
         print("No order details to save.")
@@ -255,7 +495,7 @@ def save_order_details(data_folder: str, order_details: List[Dict]):
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
             for detail in order_details:
-                row = {field: detail.get(field, "") for field in fieldnames}
+                row = {field: getattr(detail, field) for field in fieldnames}
                 writer.writerow(row)
         print(f"Saved {len(order_details)} order details to {output_file}")
     except Exception as e:
@@ -266,9 +506,8 @@ if __name__ == "__main__":
     import sys
 
     if len(sys.argv) > 1:
-        csv_file = sys.argv[1]
-        order_amounts, refunded, order_details = extract_order_amounts_from_paypal_csv(
-            csv_file
+        order_amounts, refunded, order_details = reconcile_paypal_csv_files(
+            sys.argv[1:]
         )
         print("\nOrder amounts summary:")
         total_inr = sum(order_amounts.values())
@@ -279,14 +518,12 @@ if __name__ == "__main__":
         if order_details:
             print(f"Order details collected: {len(order_details)}")
     else:
-        order_amounts, order_details = load_all_paypal_order_amounts()
+        config = load_config()
+        if config is None:
+            sys.exit(1)
+        order_amounts, order_details = load_all_paypal_order_amounts(config)
         if order_amounts:
             total_inr = sum(order_amounts.values())
             print(f"\nTotal INR value across all files: {total_inr:,.2f}")
         if order_details:
-            with open("config.yaml", "r") as f:
-                config = yaml.safe_load(f)
-            data_folder = config.get("data_folder")
-            if data_folder and data_folder.startswith("~"):
-                data_folder = os.path.expanduser(data_folder)
-            save_order_details(data_folder, order_details)
+            save_order_details(config["data_folder"], order_details)
@@ -0,0 +1,202 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+COUNTERS = ("rows", "orders", "bytes_read", "bytes_written")
+
+# Profile of the running process, or None while profiling is off. Stages are
+# only recorded while a profile is active, so the hooks in the loaders cost
+# next to nothing in normal runs.
+_current = None
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    if sys.platform == "darwin":
+        return round(peak / 2**20, 1)
+    return round(peak / 2**10, 1)
+
+
+def _with_rates(record):
+    seconds = record["wall_seconds"]
+    for counter in ("rows", "orders"):
+        rate = record[counter] / seconds if seconds and record[counter] else None
+        record[f"{counter}_per_second"] = round(rate, 1) if rate else None
+    return record
+
+
+class RunProfile:
+    """
+    Wall time, CPU time, counters and peak memory for each stage of a run.
+
+    Stages are recorded in the order they finish. Stages run in worker
+    processes are recorded there and merged in by collect(), so their CPU
+    time and peak memory are those of the worker.
+    """
+
+    def __init__(self):
+        self.created = datetime.now().isoformat(timespec="seconds")
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.stages = []
+        self._open = []
+
+    def add(self, counter, amount):
+        if self._open:
+            self._open[-1][counter] += amount
+
+    @contextlib.contextmanager
+    def stage(self, name, file=None, **counters):
+        record = dict.fromkeys(COUNTERS, 0)
+        record.update(counters)
+        self._open.append(record)
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            self._open.remove(record)
+            wall_seconds = time.perf_counter() - started_wall
+            cpu_seconds = time.process_time() - started_cpu
+            entry = {"stage": name}
+            if file is not None:
+                entry["file"] = file
+            entry["wall_seconds"] = round(wall_seconds, 4)
+            entry["cpu_seconds"] = round(cpu_seconds, 4)
+            for counter in COUNTERS:
+                entry[counter] = record[counter]
+            entry["peak_rss_mb"] = peak_rss_mb()
+            entry["pid"] = os.getpid()
+            self.stages.append(_with_rates(entry))
+
+    def totals(self):
+        """Sum the stages by name, in the order each name first finished."""
+        totals = {}
+        for entry in self.stages:
+            total = totals.setdefault(
+                entry["stage"],
+                {"count": 0, "wall_seconds": 0, "cpu_seconds": 0}
+                | dict.fromkeys(COUNTERS, 0),
+            )
+            total["count"] += 1
+            for key in ("wall_seconds", "cpu_seconds") + COUNTERS:
+                total[key] += entry[key]
+        for total in totals.values():
+            total["wall_seconds"] = round(total["wall_seconds"], 4)
+            total["cpu_seconds"] = round(total["cpu_seconds"], 4)
+            _with_rates(total)
+        return totals
+
+    def report(self):
+        return {
+            "created": self.created,
+            "command": sys.argv,
+            "python": sys.version.split()[0],
+            "wall_seconds": round(time.perf_counter() - self.started_wall, 4),
+            "cpu_seconds": round(time.process_time() - self.started_cpu, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "totals": self.totals(),
+            "stages": self.stages,
+        }
+
+
+def start():
+    """Start recording stages in this process and return the new profile."""
+    global _current
+    _current = RunProfile()
+    return _current
+
+
+def stop():
+    """Stop recording and return the profile that was active, if any."""
+    global _current
+    profile, _current = _current, None
+    return profile
+
+
+def stage(name, file=None, **counters):
+    """
+    Time a stage of the run, e.g. ``with stage("xml", file) as counters:``.
+
+    The yielded dict holds the rows, orders, bytes_read and bytes_written
+    counters, preset from counters; add to it inside the block, or call
+    count() from code that does not see the dict. When profiling is off the
+    dict is thrown away.
+    """
+    if _current is None:
+        return contextlib.nullcontext(dict.fromkeys(COUNTERS, 0))
+    return _current.stage(name, file, **counters)
+
+
+def count(counter, amount):
+    """Add amount to a counter of the innermost open stage, if profiling."""
+    if _current is not None:
+        _current.add(counter, amount)
+
+
+def call_profiled(func, *args):
+    """
+    Call func(*args) with a fresh profile and return (result, its stages).
+
+    Runs in a worker process so the stages it records can be sent back.
+    """
+    global _current
+    previous = _current
+    _current = RunProfile()
+    try:
+        return func(*args), _current.stages
+    finally:
+        _current = previous
+
+
+def worker_task(func):
+    """
+    Return the callable to submit to a worker pool in place of func.
+
+    While profiling, that is a picklable wrapper which also returns the
+    stages recorded in the worker; pass its result through collect().
+    """
+    if _current is None:
+        return func
+    return functools.partial(call_profiled, func)
+
+
+def collect(result):
+    """Merge the stages returned by a worker_task and return func's result."""
+    if _current is None:
+        return result
+    result, stages = result
+    _current.stages.extend(stages)
+    return result
+
+
+def write_report(profile, output_file):
+    """Write profile as a JSON report and print the per-stage totals."""
+    report = profile.report()
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n{'Stage':<12} {'Count':>6} {'Wall s':>9} {'CPU s':>9} {'Rows/s':>11}")
+    for name, total in report["totals"].items():
+        rate = total["rows_per_second"]
+        rate_text = f"{rate:>11,.0f}" if rate else f"{'-':>11}"
+        print(
+            f"{name:<12} {total['count']:>6} {total['wall_seconds']:>9.3f}"
+            f" {total['cpu_seconds']:>9.3f} {rate_text}"
+        )
+    print(
+        f"Total {report['wall_seconds']:.3f}s wall, {report['cpu_seconds']:.3f}s CPU"
+        f" in this process. Profile report written to {output_file}"
+    )
@@ -0,0 +1,74 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# Orders between two progress events from a loop, so a listener sees steady
+# progress without being called for every order.
+ORDER_STEP = 200
+
+# Callback that receives ProgressEvents, or None while nobody listens (the
+# command line). Like profiling, the hooks cost next to nothing then.
+_listener = None
+_cancel_event = None
+
+
+class ConversionCancelled(BaseException):
+    """
+    Raised at the next progress hook once a conversion has been cancelled.
+
+    Derived from BaseException, like KeyboardInterrupt, so the loaders'
+    "except Exception" error handling does not swallow it, while their
+    finally blocks still remove half-written files.
+    """
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """
+    Where a conversion is: stage is "payouts", "export" (file is the export
+    about to be converted, done/total count exports), "woo" (orders read),
+    "xml" (vouchers written) or "done". total is None when not known yet.
+    """
+
+    stage: str
+    file: Optional[str] = None
+    done: int = 0
+    total: Optional[int] = None
+
+
+def listen(
+    listener: Callable[[ProgressEvent], None],
+    cancel_event: Optional[threading.Event] = None,
+) -> threading.Event:
+    """
+    Send progress events to listener until stop() is called.
+
+    Returns:
+        cancel_event (a new one if not given), to set() from any thread to
+        cancel the conversion
+    """
+    global _listener, _cancel_event
+    _listener = listener
+    _cancel_event = cancel_event or threading.Event()
+    return _cancel_event
+
+
+def stop():
+    global _listener, _cancel_event
+    _listener = None
+    _cancel_event = None
+
+
+def report(stage: str, file: Optional[str] = None, done=0, total=None):
+    """Send a progress event, raising ConversionCancelled if cancelled."""
+    if _listener is None:
+        return
+    if _cancel_event.is_set():
+        raise ConversionCancelled()
+    _listener(ProgressEvent(stage, file, done, total))
+
+
+def tick(stage: str, file: Optional[str], done: int, total=None):
+    """report() every ORDER_STEP orders of a loop."""
+    if _listener is not None and done % ORDER_STEP == 0:
+        report(stage, file, done, total)
@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional
+
+# Slotted records for the per-order data of large exports. A slotted
+# instance has no per-object __dict__, which is where most of the memory of
+# the equivalent dicts went.
+
+
+@dataclass(slots=True)
+class LineItem:
+    name: str
+    quantity: int
+    base_rate: Decimal
+    base_amount: Decimal
+    gst_rate: Decimal
+    cgst_amount: Decimal
+    sgst_amount: Decimal
+    ledger_name: str
+    godown_name: str
+    original_item_cost: Decimal
+    converted_item_cost: Decimal
+
+
+@dataclass(slots=True)
+class Order:
+    date: datetime
+    amount: Decimal
+    original_amount: Decimal
+    order_currency: str
+    conversion_ratio: Decimal
+    shipping_cost: Decimal
+    donation_amount: Decimal
+    voucher_number: str
+    narration: str
+    party_ledger: str
+    is_domestic: bool
+    products: List[LineItem] = field(default_factory=list)
+    fingerprint: Optional[str] = None
+
+
+@dataclass(slots=True)
+class PayPalPayment:
+    """A foreign currency PayPal payment waiting for its withdrawal."""
+
+    order_id: str
+    gross_amount: Decimal
+    transaction_id: str
+    date: str
+    currency: str
+
+
+@dataclass(slots=True)
+class PayPalOrderDetail:
+    """One row of paypal_orders_summary.csv."""
+
+    order_id: str
+    currency: str
+    gross_amount: str
+    inr_amount: str
+    transaction_id: str
+    date: str
+    status: str
+    exchange_rate: str = ""
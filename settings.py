@@ -0,0 +1,125 @@
+import os
+from typing import Dict, List, Optional
+
+from archives import list_sources
+from diagnostics import DEFAULT_LEVEL, LEVELS
+from gst_batch import DEFAULT_BATCH_THRESHOLD
+
+# Keys of woo_csv_to_tally_xml.MONEY_ENGINES, named here so validating the
+# config does not import the converter.
+MONEY_ENGINE_NAMES = ("decimal", "paise")
+
+REQUIRED_FIELDS = [
+    "woo_prefix",
+    "tally_prefix",
+    "data_folder",
+    "tally_products_file",
+    "sku_mapping_file",
+    "product_prices_file",
+]
+
+
+def load_config(config_file: str = "config.yaml") -> Optional[Dict]:
+    """
+    Parse and validate config_file once for the whole run.
+
+    The returned dict is what every loader is given instead of the path:
+    data_folder is an existing absolute path and config_file is the absolute
+    path of the file itself.
+
+    Returns:
+        The configuration, or None (after printing why) if it is invalid
+    """
+    if not os.path.exists(config_file):
+        print(f"Error: Configuration file '{config_file}' not found!")
+        return None
+    try:
+        import yaml
+
+        with open(config_file, "r") as f:
+            config = yaml.safe_load(f)
+        missing_fields = [field for field in REQUIRED_FIELDS if field not in config]
+        if missing_fields:
+            print(
+                f"Error: Missing required configuration fields: {', '.join(missing_fields)}"
+            )
+            return None
+        if config["data_folder"].startswith("~"):
+            config["data_folder"] = os.path.expanduser(config["data_folder"])
+        if not os.path.isabs(config["data_folder"]):
+            print(
+                f"Error: data_folder '{config['data_folder']}' must be an absolute path!"
+            )
+            return None
+        if not os.path.exists(config["data_folder"]):
+            print(f"Error: Data folder '{config['data_folder']}' does not exist!")
+            return None
+        batch_threshold = config.get("gst_batch_threshold", DEFAULT_BATCH_THRESHOLD)
+        if not isinstance(batch_threshold, int) or batch_threshold < 0:
+            print("Error: gst_batch_threshold must be a whole number of line items")
+            return None
+        shard_size = config.get("shard_size", 0)
+        if not isinstance(shard_size, int) or shard_size < 0:
+            print("Error: shard_size must be a whole number of vouchers")
+            return None
+        for key in ("push_batch_size", "push_concurrency"):
+            value = config.get(key, 1)
+            if not isinstance(value, int) or value < 1:
+                print(f"Error: {key} must be a whole number of at least 1")
+                return None
+        if not isinstance(config.get("tally_url", ""), str):
+            print("Error: tally_url must be an address such as http://localhost:9000")
+            return None
+        if config.get("diagnostics", DEFAULT_LEVEL) not in LEVELS:
+            print(f"Error: diagnostics must be one of {', '.join(LEVELS)}")
+            return None
+        if config.get("money_engine", "decimal") not in MONEY_ENGINE_NAMES:
+            print(
+                f"Error: money_engine must be one of {', '.join(sorted(MONEY_ENGINE_NAMES))}"
+            )
+            return None
+        config["config_file"] = os.path.abspath(config_file)
+        return config
+    except Exception as e:
+        print(f"Error loading configuration: {e}")
+        return None
+
+
+def export_files(config: Dict) -> List[str]:
+    """
+    List the WooCommerce exports in the data folder, sorted by path.
+
+    Like the payout files, exports may be gzipped or inside a .zip (see
+    archives.list_sources).
+    """
+    return list_sources(config["data_folder"], config["woo_prefix"])
+
+
+def paypal_files(config: Dict) -> List[str]:
+    """List the PayPal downloads in the data folder, sorted by path."""
+    prefix = config.get("paypal_prefix", "Download")
+    # PayPal names its downloads .CSV; accept .csv too
+    return list_sources(config["data_folder"], prefix, (".CSV", ".csv"))
+
+
+def ccavenue_files(config: Dict) -> List[str]:
+    """List the CCAvenue payout summaries in the data folder, sorted by path."""
+    payout_prefix = config.get("payout_prefix")
+    if not payout_prefix:
+        return []
+    return list_sources(config["data_folder"], payout_prefix)
+
+
+def source_files(config: Dict) -> List[str]:
+    """
+    Return every file besides the export that the vouchers are computed
+    from: the config itself, the product files and the payout files.
+    """
+    return [
+        config["config_file"],
+        config["tally_products_file"],
+        config["sku_mapping_file"],
+        config["product_prices_file"],
+        *paypal_files(config),
+        *ccavenue_files(config),
+    ]
@@ -0,0 +1,456 @@
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+# Column layout of the "Order by SKU" All Export template
+WOO_COLUMNS = [
+    "Order ID",
+    "Order Status",
+    "Order Date",
+    "Order Total",
+    "Order Currency",
+    "Billing First Name",
+    "Billing Last Name",
+    "Billing Phone",
+    "Billing Email Address",
+    "Shipping Country",
+    "SKU",
+    "Quantity",
+    "Item Cost",
+    "Shipping Cost",
+    "Total Fee Amount",
+    "Fee Amount (per surcharge)",
+]
+
+# More of the columns a full "All Export" writes, none of which the converter
+# reads; written with wide=True so exports are as wide as the real ones
+ALL_EXPORT_COLUMNS = [
+    "Order Number",
+    "Paid Date",
+    "Completed Date",
+    "Modified Date",
+    "Customer Note",
+    "Customer User ID",
+    "Customer Username",
+    "Billing Company",
+    "Billing Address 1",
+    "Billing Address 2",
+    "Billing City",
+    "Billing State",
+    "Billing Postcode",
+    "Billing Country",
+    "Shipping First Name",
+    "Shipping Last Name",
+    "Shipping Company",
+    "Shipping Address 1",
+    "Shipping Address 2",
+    "Shipping City",
+    "Shipping State",
+    "Shipping Postcode",
+    "Shipping Phone",
+    "Shipping Method Title",
+    "Payment Method",
+    "Payment Method Title",
+    "Transaction ID",
+    "Cart Discount Amount",
+    "Order Subtotal Amount",
+    "Order Shipping Amount",
+    "Order Refund Amount",
+    "Order Total Tax Amount",
+    "Coupon Code",
+    "Discount Amount",
+    "Item #",
+    "Product Name",
+    "Product Variation",
+    "Item Name",
+    "Item Tax",
+    "Item Tax Rate",
+    "Product Categories",
+    "Product Tags",
+    "Order Line Subtotal",
+    "Order Line Total",
+    "Order Line Tax",
+    "Stock",
+    "Weight",
+    "Fee Name",
+    "Customer IP Address",
+    "Customer User Agent",
+]
+
+# Columns of a PayPal "Balance affecting" activity download
+PAYPAL_COLUMNS = [
+    "Date",
+    "Time",
+    "TimeZone",
+    "Name",
+    "Type",
+    "Status",
+    "Currency",
+    "Gross",
+    "Fee",
+    "Net",
+    "From Email Address",
+    "To Email Address",
+    "Transaction ID",
+    "Reference Txn ID",
+    "Custom Number",
+    "Balance",
+]
+
+CCAVENUE_COLUMNS = [
+    "Transaction Type",
+    "Order ID",
+    "Reference No",
+    "Order Date",
+    "Currency",
+    "Amount",
+    "Fee",
+    "Tax",
+    "Payout Amount",
+]
+
+# Approximate INR rates used to price foreign orders and PayPal withdrawals
+INR_RATES = {"USD": Decimal("83.37"), "EUR": Decimal("90.12"), "GBP": Decimal("105.4")}
+
+FIRST_NAMES = ["Anita", "Bhavna", "Chitra", "Deepa", "Esha", "Farah", "Gita", ""]
+LAST_NAMES = ["Iyer", "Menon", "Rao", "Shah", "Smith", "Müller", ""]
+FOREIGN_COUNTRIES = ["US", "DE", "GB", "FR", "AU", "CA"]
+
+
+def _pick_sku(rng: random.Random, single_skus: List[str], bundle_skus: List[str]):
+    if bundle_skus and rng.random() < 0.15:
+        return rng.choice(bundle_skus)
+    return rng.choice(single_skus)
+
+
+def generate_woo_export(
+    path: str,
+    line_items: int,
+    sku_mapping: Dict[str, List[str]],
+    rng: random.Random,
+    start: datetime = datetime(2025, 6, 1),
+    wide: bool = False,
+) -> List[Dict]:
+    """
+    Write a WooCommerce export with at least line_items item rows.
+
+    Orders have one to six line items on consecutive rows, a mix of statuses,
+    INR and foreign currencies, shipping and Pad for Pad donations, bundle
+    SKUs, and the odd unmapped SKU and blank fee. With wide, every row also
+    fills the ALL_EXPORT_COLUMNS, without changing the orders.
+
+    Returns:
+        The completed foreign currency orders, as dicts with order_id,
+        currency, total and date, for the payout generators
+    """
+    skus = sorted(sku_mapping)
+    single_skus = [sku for sku in skus if len(sku_mapping[sku]) == 1] or skus
+    bundle_skus = [sku for sku in skus if len(sku_mapping[sku]) > 1]
+    extra_columns = ALL_EXPORT_COLUMNS if wide else []
+    foreign_orders = []
+    written = 0
+    order_id = 100000
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(WOO_COLUMNS + extra_columns)
+        while written < line_items:
+            order_id += 1
+            status = "wc-completed" if rng.random() < 0.9 else "wc-cancelled"
+            currency = "INR" if rng.random() < 0.8 else rng.choice(list(INR_RATES))
+            if currency == "INR":
+                country = "IN" if rng.random() < 0.97 else rng.choice(FOREIGN_COUNTRIES)
+            else:
+                country = rng.choice(FOREIGN_COUNTRIES)
+            date = start + timedelta(seconds=rng.randrange(30 * 24 * 3600))
+            items = []
+            for _ in range(rng.choice([1, 1, 1, 2, 2, 3, 4, 6])):
+                sku = _pick_sku(rng, single_skus, bundle_skus)
+                if rng.random() < 0.002:
+                    sku = "UNMAPPED-SKU"
+                if currency == "INR":
+                    cost = Decimal(rng.randrange(5000, 300000)) / 100
+                else:
+                    cost = Decimal(rng.randrange(300, 9000)) / 100
+                items.append((sku, rng.choice([1, 1, 1, 2, 3, 5]), cost))
+            shipping = rng.choice(
+                [Decimal("0"), Decimal("0"), Decimal("80"), Decimal("120.50")]
+            )
+            fee = rng.choice(["0", "0", "50", "100", "1,000", ""])
+            total = sum(quantity * cost for _, quantity, cost in items) + shipping
+            total += Decimal(fee.replace(",", "") or "0")
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = rng.choice(LAST_NAMES)
+            extra = [f"{column} of {order_id}" for column in extra_columns]
+            for sku, quantity, cost in items:
+                writer.writerow(
+                    [
+                        order_id,
+                        status,
+                        date.strftime("%Y-%m-%d %H:%M:%S"),
+                        total,
+                        currency,
+                        first_name,
+                        last_name,
+                        rng.choice(["98765 43210", ""]),
+                        f"customer{order_id}@example.com",
+                        country,
+                        sku,
+                        quantity,
+                        cost,
+                        shipping,
+                        fee,
+                        fee,
+                        *extra,
+                    ]
+                )
+            written += len(items)
+            if status == "wc-completed" and currency != "INR":
+                foreign_orders.append(
+                    {
+                        "order_id": str(order_id),
+                        "currency": currency,
+                        "total": total,
+                        "date": date,
+                    }
+                )
+    return foreign_orders
+
+
+def generate_paypal_download(
+    path: str, payments: List[Dict], rng: random.Random
+) -> int:
+    """
+    Write a PayPal download for the given foreign orders.
+
+    Payments are followed, every few orders, by an INR withdrawal and the
+    matching currency conversions. Some payments are reversed, and a few
+    pending and INR rows are mixed in.
+
+    Returns:
+        Number of transaction rows written
+    """
+    transaction_count = 0
+    rows_written = 0
+
+    def transaction_id():
+        nonlocal transaction_count
+        transaction_count += 1
+        return f"{transaction_count:017X}"
+
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(PAYPAL_COLUMNS)
+
+        def write(date, transaction_type, status, currency, gross, **fields):
+            nonlocal rows_written
+            writer.writerow(
+                [
+                    date.strftime("%d/%m/%Y"),
+                    date.strftime("%H:%M:%S"),
+                    "Asia/Kolkata",
+                    fields.get("name", ""),
+                    transaction_type,
+                    status,
+                    currency,
+                    f"{gross:,.2f}",
+                    "0.00",
+                    f"{gross:,.2f}",
+                    "",
+                    "",
+                    fields.get("txn") or transaction_id(),
+                    fields.get("reference", ""),
+                    fields.get("custom", ""),
+                    "0.00",
+                ]
+            )
+            rows_written += 1
+
+        pending = {}
+        for index, payment in enumerate(payments):
+            date = payment["date"]
+            currency = payment["currency"]
+            write(
+                date,
+                "Express Checkout Payment",
+                "Completed",
+                currency,
+                payment["total"],
+                name="Customer",
+                custom=payment["order_id"],
+            )
+            pending[currency] = pending.get(currency, Decimal("0")) + payment["total"]
+            if rng.random() < 0.03:
+                write(
+                    date + timedelta(days=1),
+                    "Payment Reversal",
+                    "Completed",
+                    currency,
+                    -payment["total"],
+                    custom=payment["order_id"],
+                )
+            if rng.random() < 0.01:
+                write(date, "Express Checkout Payment", "Pending", currency, 10)
+            if index % 8 == 7 or index == len(payments) - 1:
+                for pending_currency, amount in pending.items():
+                    withdrawal_date = date + timedelta(hours=2)
+                    rate = INR_RATES[pending_currency] * Decimal(
+                        rng.uniform(0.97, 1.01)
+                    ).quantize(Decimal("0.0001"))
+                    inr_amount = (amount * rate).quantize(Decimal("0.01"))
+                    withdrawal_id = transaction_id()
+                    write(
+                        withdrawal_date,
+                        "User Initiated Withdrawal",
+                        "Completed",
+                        "INR",
+                        -inr_amount,
+                        txn=withdrawal_id,
+                    )
+                    write(
+                        withdrawal_date,
+                        "General Currency Conversion",
+                        "Completed",
+                        pending_currency,
+                        -amount,
+                        reference=withdrawal_id,
+                    )
+                    write(
+                        withdrawal_date,
+                        "General Currency Conversion",
+                        "Completed",
+                        "INR",
+                        inr_amount,
+                        reference=withdrawal_id,
+                    )
+                pending = {}
+    return rows_written
+
+
+def generate_ccavenue_payout(path: str, payouts: List[Dict], rng: random.Random) -> int:
+    """
+    Write a CCAvenue payout transaction summary for the given foreign orders.
+
+    The file starts with the summary preamble CCAvenue puts above the
+    transaction section. Order IDs sometimes carry the "_<attempt>" suffix
+    and amounts use thousands separators, as in real exports.
+
+    Returns:
+        Number of transaction rows written
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        f.write("Payout Transaction Summary\n")
+        f.write("Merchant Name,Eco Femme\n")
+        f.write(f"Payout Count,{len(payouts)}\n")
+        f.write("Settlement Currency,INR\n\n")
+        writer = csv.writer(f)
+        writer.writerow(CCAVENUE_COLUMNS)
+        for payout in payouts:
+            order_field = payout["order_id"]
+            if rng.random() < 0.3:
+                order_field = f"{order_field}_{rng.randint(1, 3)}"
+            amount = (payout["total"] * INR_RATES[payout["currency"]]).quantize(
+                Decimal("0.01")
+            )
+            fee = (amount * Decimal("0.03")).quantize(Decimal("0.01"))
+            writer.writerow(
+                [
+                    "SALE",
+                    order_field,
+                    rng.randrange(10**11, 10**12),
+                    payout["date"].strftime("%d/%m/%Y"),
+                    "INR",
+                    f"{amount:,.2f}",
+                    f"{fee:,.2f}",
+                    "0.00",
+                    f"{amount - fee:,.2f}",
+                ]
+            )
+    return len(payouts)
+
+
+def generate_inputs(
+    data_folder: str,
+    line_items: int,
+    sku_mapping: Dict[str, List[str]],
+    seed: int = 0,
+    name: Optional[str] = None,
+    wide: bool = False,
+) -> Dict[str, str]:
+    """
+    Write a synthetic WooCommerce export with matching PayPal and CCAvenue
+    files into data_folder, named like the real ones.
+
+    Roughly half of the foreign orders are paid through PayPal and most of
+    the rest through CCAvenue; the remainder have no payout, as happens when
+    a payout is delayed. wide is passed on to generate_woo_export.
+
+    Returns:
+        Dict with the woo, paypal and ccavenue file paths
+    """
+    rng = random.Random(seed)
+    name = name or f"Synthetic-{line_items}"
+    os.makedirs(data_folder, exist_ok=True)
+    paths = {
+        "woo": os.path.join(data_folder, f"Orders-Export-{name}.csv"),
+        "paypal": os.path.join(data_folder, f"Download-{name}.CSV"),
+        "ccavenue": os.path.join(data_folder, f"PayoutTransactionSummary-{name}.csv"),
+    }
+    foreign_orders = generate_woo_export(
+        paths["woo"], line_items, sku_mapping, rng, wide=wide
+    )
+    paypal_orders = []
+    ccavenue_orders = []
+    for order in foreign_orders:
+        draw = rng.random()
+        if draw < 0.5:
+            paypal_orders.append(order)
+        elif draw < 0.95:
+            ccavenue_orders.append(order)
+    paypal_orders.sort(key=lambda order: order["date"])
+    generate_paypal_download(paths["paypal"], paypal_orders, rng)
+    generate_ccavenue_payout(paths["ccavenue"], ccavenue_orders, rng)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write synthetic WooCommerce, PayPal and CCAvenue input files"
+    )
+    parser.add_argument("data_folder", help="Folder to write the files into")
+    parser.add_argument(
+        "-n",
+        "--line-items",
+        type=int,
+        default=10000,
+        help="Number of WooCommerce line items to generate",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--wide",
+        action="store_true",
+        help='Fill every column of a full "All Export", not just the ones converted',
+    )
+    parser.add_argument(
+        "--sku-mapping",
+        default="woo_sku_to_tally.json",
+        help="SKU mapping whose SKUs are used in the export",
+    )
+    args = parser.parse_args()
+    from woo_csv_to_tally_xml import load_sku_mapping
+
+    sku_mapping = load_sku_mapping(args.sku_mapping)
+    if not sku_mapping:
+        return
+    paths = generate_inputs(
+        args.data_folder, args.line_items, sku_mapping, args.seed, wide=args.wide
+    )
+    for kind, path in paths.items():
+        print(f"Wrote {kind} input {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import contextlib
+import logging
+import multiprocessing
 import os
 import sys
-import subprocess
+import threading
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -9,7 +13,95 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QPushButton,
 )
-from PyQt5.QtWidgets import QLabel, QTextEdit
+from PyQt5.QtWidgets import QLabel, QPlainTextEdit, QProgressBar
+
+import progress
+from woo_csv_to_tally_xml import build_parser, convert_exports
+
+# Lines kept in the log view; older lines are dropped as new ones arrive.
+MAX_LOG_LINES = 5000
+
+# How often the log view takes the lines printed since the last update.
+LOG_FLUSH_MS = 100
+
+
+class LogBuffer:
+    """
+    File-like object the conversion prints to from the worker thread.
+
+    Complete lines are collected under a lock and handed to the window in
+    batches by take_lines(), instead of redrawing the log for every line.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = []
+        self._partial = ""
+
+    def write(self, text):
+        with self._lock:
+            *lines, self._partial = (self._partial + text).split("\n")
+            self._lines.extend(lines)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def take_lines(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            if self._partial:
+                lines.append(self._partial)
+                self._partial = ""
+        return lines
+
+
+class ConversionWorker(QThread):
+    """
+    Run convert_exports in this process, on a thread of its own.
+
+    Everything the conversion prints, logs or writes to stderr goes to the
+    log buffer. Exports are converted one after the other (--jobs 1), as
+    progress events and Cancel only reach this process. Payout files are
+    still parsed on a process pool, so Cancel takes effect once they are
+    loaded.
+    """
+
+    progress_event = pyqtSignal(object)
+    conversion_finished = pyqtSignal(str)
+
+    def __init__(self, config_path, log_buffer):
+        super().__init__()
+        self.config_path = config_path
+        self.log_buffer = log_buffer
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        args = build_parser().parse_args(["--config", self.config_path, "--jobs", "1"])
+        # The converter's logging handler holds the stderr it was created with
+        log_handler = logging.StreamHandler(self.log_buffer)
+        log_handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        logging.getLogger().addHandler(log_handler)
+        # Signals emitted here are delivered on the GUI thread
+        progress.listen(self.progress_event.emit, self.cancel_event)
+        try:
+            with (
+                contextlib.redirect_stdout(self.log_buffer),
+                contextlib.redirect_stderr(self.log_buffer),
+            ):
+                convert_exports(args)
+            result = "Conversion completed successfully!"
+        except progress.ConversionCancelled:
+            result = "Conversion cancelled. Files already converted are kept."
+        except Exception as e:
+            result = f"Conversion failed with errors: {e}"
+        finally:
+            progress.stop()
+            logging.getLogger().removeHandler(log_handler)
+        self.conversion_finished.emit(result)
 
 
 class TallyLauncherGUI(QMainWindow):
@@ -19,6 +111,8 @@ class TallyLauncherGUI(QMainWindow):
         self.setMinimumSize(600, 400)
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.config_path = "config.yaml"
+        self.worker = None
+        self.log_buffer = LogBuffer()
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
@@ -26,25 +120,69 @@ class TallyLauncherGUI(QMainWindow):
         title_label.setStyleSheet("font-size: 16pt; font-weight: bold;")
         main_layout.addWidget(title_label)
         main_layout.addSpacing(20)
-        self.status_text = QTextEdit()
+        self.status_text = QPlainTextEdit()
         self.status_text.setReadOnly(True)
+        self.status_text.setMaximumBlockCount(MAX_LOG_LINES)
         main_layout.addWidget(self.status_text)
+        self.stage_label = QLabel("")
+        main_layout.addWidget(self.stage_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        main_layout.addWidget(self.progress_bar)
         button_layout = QHBoxLayout()
         button_layout.addStretch()
         self.quit_button = QPushButton("Quit")
         self.quit_button.clicked.connect(self.close)
         button_layout.addWidget(self.quit_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        button_layout.addWidget(self.cancel_button)
         self.convert_button = QPushButton("Convert")
         self.convert_button.setStyleSheet("background-color: #4CAF50; color: white;")
         self.convert_button.clicked.connect(self.run_conversion)
         button_layout.addWidget(self.convert_button)
         main_layout.addLayout(button_layout)
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.export_name = None
+        self.export_count = ""
 
     def log(self, message):
-        self.status_text.append(message)
+        self.status_text.appendPlainText(message)
         scrollbar = self.status_text.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
-        QApplication.processEvents()
+
+    def flush_log(self):
+        lines = self.log_buffer.take_lines()
+        if lines:
+            self.log("\n".join(lines))
+
+    def show_progress(self, event):
+        if event.stage == "payouts":
+            self.stage_label.setText("Loading payout data...")
+        elif event.stage == "export":
+            self.export_name = event.file
+            self.export_count = f" ({event.done + 1} of {event.total})"
+            self.stage_label.setText(f"Converting {event.file}{self.export_count}")
+        elif event.stage in ("woo", "xml"):
+            action = "Reading orders" if event.stage == "woo" else "Writing vouchers"
+            counts = f"{event.done:,}"
+            if event.total:
+                counts += f" of {event.total:,}"
+            self.stage_label.setText(
+                f"{self.export_name}{self.export_count}: {action}, {counts} orders"
+            )
+        elif event.stage == "done":
+            self.stage_label.setText(f"Finished {event.total} exports")
+        if event.total:
+            self.progress_bar.setRange(0, event.total)
+            self.progress_bar.setValue(event.done)
+        elif event.stage != "done":
+            # Unknown total: show a busy bar
+            self.progress_bar.setRange(0, 0)
 
     def run_conversion(self):
         self.status_text.clear()
@@ -53,27 +191,46 @@ class TallyLauncherGUI(QMainWindow):
             return
         os.chdir(self.script_dir)
         self.log("Starting conversion process...")
-        try:
-            process = subprocess.Popen(
-                ["uv", "run", "woo_csv_to_tally_xml.py", "--config", self.config_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-            )
-            for line in process.stdout:
-                self.log(line.strip())
-            process.wait()
-            if process.returncode == 0:
-                self.log("\nConversion completed successfully!")
-            else:
-                self.log("\nConversion failed with errors.")
-        except Exception as e:
-            self.log(f"Error: {str(e)}")
+        self.stage_label.setText("")
+        self.progress_bar.setRange(0, 0)
+        self.convert_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.worker = ConversionWorker(self.config_path, self.log_buffer)
+        self.worker.progress_event.connect(self.show_progress)
+        self.worker.conversion_finished.connect(self.conversion_finished)
+        self.log_timer.start()
+        self.worker.start()
+
+    def cancel_conversion(self):
+        if self.worker is not None:
+            self.log("Cancelling after the current step...")
+            self.cancel_button.setEnabled(False)
+            self.worker.cancel()
+
+    def conversion_finished(self, result):
+        self.worker.wait()
+        self.worker = None
+        self.log_timer.stop()
+        self.flush_log()
+        self.log(f"\n{result}")
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(
+            1 if result.startswith("Conversion completed") else 0
+        )
+        self.convert_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+        event.accept()
 
 
 def main():
+    # Payout files are parsed in worker processes; start them fresh rather
+    # than forking a process that runs Qt threads.
+    multiprocessing.set_start_method("spawn", force=True)
     app = QApplication(sys.argv)
     window = TallyLauncherGUI()
     window.show()
@@ -0,0 +1,412 @@
+import http.client
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+from xml.sax.saxutils import quoteattr
+
+import profiling
+from settings import export_files, source_files
+from voucher_manifest import VoucherReader, file_stamps, load_manifest
+from woo_csv_to_tally_xml import (
+    TALLY_XML_HEAD,
+    TALLY_XML_TAIL,
+    load_run_config,
+    plan_exports,
+)
+
+DEFAULT_TALLY_URL = "http://localhost:9000"
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 1
+DEFAULT_RETRIES = 3
+
+# Seconds before sending a request again after it got no usable answer,
+# doubled for every further attempt.
+RETRY_DELAY = 0.5
+
+# Seconds to wait for Tally to answer one batch. Tally answers only once the
+# whole batch is imported, which can take a while for a large one.
+REQUEST_TIMEOUT = 300
+
+# Counters in Tally's answer to an import, and those counting rejected vouchers.
+RESPONSE_COUNTERS = (
+    "CREATED",
+    "ALTERED",
+    "DELETED",
+    "COMBINED",
+    "IGNORED",
+    "ERRORS",
+    "CANCELLED",
+    "EXCEPTIONS",
+)
+FAILURE_COUNTERS = ("ERRORS", "CANCELLED", "EXCEPTIONS")
+
+
+class TallyError(Exception):
+    """Raised when Tally cannot be reached or does not answer with an import result."""
+
+
+def push_log_path_for(xml_path: str) -> str:
+    base, _ = os.path.splitext(xml_path)
+    return f"{base}.pushed.jsonl"
+
+
+def load_push_log(log_path: str) -> Dict[str, str]:
+    """Return the output hash of every voucher pushed from an XML, by order ID."""
+    pushed = {}
+    try:
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    pushed[entry["order_id"]] = entry["output"]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(
+            f"Warning: Ignoring unreadable push log {os.path.basename(log_path)}: {e}"
+        )
+    return pushed
+
+
+def with_remote_id(data: bytes, order_id: str) -> bytes:
+    """
+    Return the TALLYMESSAGE bytes of a voucher with a REMOTEID derived from
+    its order ID, so Tally alters the voucher it already has when the same
+    order is pushed again instead of creating a second one.
+    """
+    attribute = quoteattr(f"gst-tally-{order_id}").encode("utf-8")
+    return data.replace(b"<VOUCHER ", b"<VOUCHER REMOTEID=" + attribute + b" ", 1)
+
+
+def parse_import_response(body: bytes) -> Dict:
+    """
+    Return the counters (lowercase, such as "created" and "errors") and the
+    LINEERROR messages ("messages") of Tally's answer to an import.
+
+    Depending on the release, Tally answers with a RESPONSE element or with
+    an ENVELOPE holding the same elements, so they are looked up anywhere.
+
+    Raises:
+        TallyError: If body is not XML or holds no import counters
+    """
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError as e:
+        raise TallyError(f"Unreadable answer from Tally: {e}") from None
+    result = dict.fromkeys((name.lower() for name in RESPONSE_COUNTERS), 0)
+    result["messages"] = []
+    found = False
+    for element in root.iter():
+        text = (element.text or "").strip()
+        if element.tag in RESPONSE_COUNTERS:
+            try:
+                result[element.tag.lower()] = int(text or 0)
+            except ValueError:
+                raise TallyError(f"Invalid {element.tag} in Tally's answer: {text}")
+            found = True
+        elif element.tag == "LINEERROR" and text:
+            result["messages"].append(text)
+    if not found:
+        # Errors such as no company being open come without any counter
+        raise TallyError(
+            "; ".join(result["messages"]) or "Tally did not import anything"
+        )
+    return result
+
+
+def parse_tally_url(url: str) -> Tuple[str, int, str]:
+    """
+    Return (host, port, path) of the address of Tally's XML server.
+
+    Raises:
+        ValueError: If url is not a plain http address
+    """
+    if "://" not in url:
+        url = f"http://{url}"
+    parts = urlsplit(url)
+    if parts.scheme != "http" or not parts.hostname:
+        raise ValueError(
+            f"tally_url must be an http address such as {DEFAULT_TALLY_URL}"
+        )
+    return parts.hostname, parts.port or 80, parts.path or "/"
+
+
+class TallyConnection:
+    """One persistent HTTP connection to Tally's XML server, reopened when it drops."""
+
+    def __init__(self, url: str, timeout: float = REQUEST_TIMEOUT):
+        host, port, self.path = parse_tally_url(url)
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.requests = 0
+
+    def post(self, body: bytes) -> bytes:
+        """Post body and return Tally's answer."""
+        # A connection kept open since the last batch may have been closed by
+        # Tally meanwhile, so a reused connection that drops gets one more try
+        attempts = 2 if self.requests else 1
+        self.requests += 1
+        for attempt in range(attempts):
+            try:
+                self.connection.request(
+                    "POST",
+                    self.path,
+                    body,
+                    headers={"Content-Type": "text/xml; charset=utf-8"},
+                )
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.connection.close()
+                dropped = isinstance(e, (ConnectionResetError, BrokenPipeError))
+                if not dropped or attempt == attempts - 1:
+                    raise TallyError(f"Could not reach Tally: {e}") from None
+        if response.status != 200:
+            raise TallyError(f"Tally answered HTTP {response.status} {response.reason}")
+        return data
+
+    def close(self):
+        self.connection.close()
+
+
+class VoucherPusher:
+    """
+    Post batches of vouchers to Tally and work out which of them it rejected.
+
+    Batches are pushed by up to concurrency threads at once, each keeping
+    its own TallyConnection open for the whole run. Tally only counts the
+    vouchers of a batch it rejected, so a batch with errors is split into
+    twice as many parts as it had errors (halves for one error, one voucher
+    per part when most failed) and the parts are pushed again, until each
+    rejected voucher is alone in its part. Nothing ties Tally's LINEERROR
+    messages to the vouchers of a batch either, so they are only attached
+    to a voucher pushed alone. Every voucher carries a REMOTEID (see
+    with_remote_id), so sending one Tally already imported again only
+    alters it. A request that gets no usable answer at all is sent again up
+    to retries times.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        retries: int = DEFAULT_RETRIES,
+    ):
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self) -> TallyConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = TallyConnection(self.url)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def post(self, body: bytes) -> Dict:
+        """Post one request and return the parsed answer (see parse_import_response)."""
+        for attempt in range(self.retries + 1):
+            try:
+                return parse_import_response(self._connection().post(body))
+            except TallyError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(RETRY_DELAY * 2**attempt)
+
+    def push(self, batch: List[Tuple[Dict, bytes]]) -> Dict:
+        """
+        Push a batch of (manifest record, TALLYMESSAGE bytes).
+
+        Returns:
+            Dict with the records Tally imported ("pushed"), (record, error
+            messages) of those it rejected ("failed"), and the number of
+            requests sent ("requests") and of bytes posted ("bytes")
+
+        Raises:
+            TallyError: If a request still got no usable answer after retrying
+        """
+        body = TALLY_XML_HEAD + b"".join(data for _, data in batch) + TALLY_XML_TAIL
+        result = self.post(body)
+        outcome = {"pushed": [], "failed": [], "requests": 1, "bytes": len(body)}
+        failures = sum(result[name.lower()] for name in FAILURE_COUNTERS)
+        if not failures:
+            outcome["pushed"] = [record for record, _ in batch]
+        elif len(batch) == 1:
+            outcome["failed"] = [
+                (batch[0][0], result["messages"] or ["Rejected by Tally"])
+            ]
+        else:
+            parts = min(len(batch), 2 * failures)
+            bounds = [len(batch) * part // parts for part in range(parts + 1)]
+            for start, end in zip(bounds, bounds[1:]):
+                part_outcome = self.push(batch[start:end])
+                for key in ("pushed", "failed"):
+                    outcome[key].extend(part_outcome[key])
+                for key in ("requests", "bytes"):
+                    outcome[key] += part_outcome[key]
+        return outcome
+
+    def submit(self, batch: List[Tuple[Dict, bytes]]) -> Future:
+        """Push batch in one of the threads; the future's result is that of push."""
+        return self._executor.submit(self.push, batch)
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+def push_export(pusher, xml_path, batch_size):
+    """
+    Push the vouchers of one XML that Tally does not have yet, or has in an
+    older version, and note each imported one in the push log next to it.
+
+    Vouchers are read back through the manifest, so an XML split into shards
+    is pushed the same way.
+
+    Raises:
+        TallyError: If Tally stopped answering; vouchers pushed until then
+            are already in the push log
+    """
+    xml_name = os.path.basename(xml_path)
+    records = load_manifest(xml_path)
+    if records is None:
+        print(
+            f"Skipping {xml_name}: no manifest matches it. Convert it again to push it."
+        )
+        return
+    log_path = push_log_path_for(xml_path)
+    pushed = load_push_log(log_path)
+    pending = [
+        record
+        for record in records.values()
+        if pushed.get(record["order_id"]) != record["output"]
+    ]
+    removed = [order_id for order_id in pushed if order_id not in records]
+    if removed:
+        print(
+            f"Warning: {len(removed)} vouchers pushed earlier are no longer in {xml_name}; "
+            f"delete them in Tally if they should go: {', '.join(removed)}"
+        )
+    if not pending:
+        print(f"All {len(records)} vouchers of {xml_name} are already in Tally.")
+        return
+    batches = [
+        pending[start : start + batch_size]
+        for start in range(0, len(pending), batch_size)
+    ]
+    print(
+        f"Pushing {len(pending)} of {len(records)} vouchers of {xml_name} "
+        f"in {len(batches)} batch{'es' if len(batches) != 1 else ''}..."
+    )
+    totals = dict.fromkeys(("new", "changed", "requests"), 0)
+    failed = []
+    with (
+        profiling.stage("push", xml_name) as counters,
+        VoucherReader(xml_path) as reader,
+        open(log_path, "a", encoding="utf-8") as log,
+    ):
+
+        def collect(outcome):
+            for record in outcome["pushed"]:
+                entry = {"order_id": record["order_id"], "output": record["output"]}
+                log.write(json.dumps(entry) + "\n")
+                totals["changed" if record["order_id"] in pushed else "new"] += 1
+            log.flush()
+            totals["requests"] += outcome["requests"]
+            failed.extend(outcome["failed"])
+            counters["orders"] += len(outcome["pushed"])
+            counters["bytes_written"] += outcome["bytes"]
+
+        in_flight = deque()
+        try:
+            for batch in batches:
+                # Voucher bytes are read here, as only this thread uses reader
+                vouchers = [
+                    (record, with_remote_id(reader.read(record), record["order_id"]))
+                    for record in batch
+                ]
+                in_flight.append(pusher.submit(vouchers))
+                # Keep memory flat: read ahead at most one batch per connection
+                if len(in_flight) >= pusher.concurrency * 2:
+                    collect(in_flight.popleft().result())
+            while in_flight:
+                collect(in_flight.popleft().result())
+        finally:
+            for future in in_flight:
+                future.cancel()
+            print(
+                f"Pushed {totals['new'] + totals['changed']} vouchers ({totals['new']} new, "
+                f"{totals['changed']} changed since the last push) in {totals['requests']} requests."
+            )
+    if failed:
+        print(
+            f"Tally rejected {len(failed)} vouchers; they are pushed again next time:"
+        )
+        for record, messages in failed:
+            print(f"  Order {record['order_id']}: {'; '.join(messages)}")
+
+
+def push_exports(args):
+    """
+    Run the push command: post the vouchers of every converted export to
+    Tally's XML server, skipping those it already has.
+    """
+    config = load_run_config(args)
+    if not config:
+        return
+    url = config.get("tally_url", DEFAULT_TALLY_URL)
+    try:
+        parse_tally_url(url)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    batch_size = config.get("push_batch_size", DEFAULT_BATCH_SIZE)
+    concurrency = config.get("push_concurrency", DEFAULT_CONCURRENCY)
+    csv_files = export_files(config)
+    if not csv_files:
+        print(f"No CSV files found with '{config['woo_prefix']}' prefix.")
+        return
+    conversions = plan_exports(config, csv_files, file_stamps(source_files(config)))
+    print(f"Pushing to Tally at {url} in batches of {batch_size} vouchers...")
+    pusher = VoucherPusher(url, concurrency, args.retries)
+    try:
+        for csv_file, base_name, action, _ in conversions:
+            print(f"\n{os.path.basename(csv_file)}:")
+            if action == "convert":
+                print(f"Skipping: {base_name}.xml has not been converted yet.")
+                continue
+            if action == "skip":
+                print(
+                    f"Skipping: {base_name}.xml has no manifest. Convert it again to push it."
+                )
+                continue
+            if action == "update":
+                print(
+                    f"Warning: {base_name}.xml may be out of date; "
+                    "run convert first to push the latest vouchers"
+                )
+            output_filename = os.path.join(config["data_folder"], f"{base_name}.xml")
+            push_export(pusher, output_filename, batch_size)
+    except TallyError as e:
+        print(f"\nError: Could not push to Tally at {url}: {e}")
+        print(
+            "Check that Tally is running with the company open and that its XML "
+            "server is enabled on that port (Client/Server configuration)."
+        )
+    finally:
+        pusher.close()
@@ -0,0 +1,202 @@
+import argparse
+import random
+import threading
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set
+
+# Port Tally's XML server listens on unless configured otherwise.
+DEFAULT_PORT = 9000
+
+
+def _local_name(tag: str) -> str:
+    # Vouchers are in the TallyDeveloper namespace of their TALLYMESSAGE
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _text(element, name) -> str:
+    found = _children(element, name)
+    return (found[0].text or "").strip() if found else ""
+
+
+class StubTally:
+    """
+    The voucher import of Tally's XML server, kept in memory, for trying the
+    push command without Tally.
+
+    Vouchers are kept by REMOTEID (or voucher number without one), so a
+    voucher imported again alters the one already there, as in Tally. Like
+    Tally, a voucher is rejected with a LINEERROR when its ledger and
+    inventory amounts do not add up to zero, or when it names a ledger not
+    in ledgers (when given). reject_rate rejects that fraction of the
+    vouchers at random, and drop_rate closes the connection without an
+    answer for that fraction of the requests, to exercise retrying.
+    """
+
+    def __init__(
+        self,
+        ledgers: Optional[Set[str]] = None,
+        reject_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.ledgers = ledgers
+        self.reject_rate = reject_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.vouchers = {}
+        self.requests = 0
+        # Tally imports one request at a time
+        self.lock = threading.Lock()
+
+    def drops(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.drop_rate
+
+    def check_voucher(self, voucher) -> Optional[str]:
+        """Return why Tally would reject voucher, or None."""
+        total = Decimal("0")
+        for name in ("LEDGERENTRIES.LIST", "ALLINVENTORYENTRIES.LIST"):
+            for entry in _children(voucher, name):
+                try:
+                    total += Decimal(_text(entry, "AMOUNT") or "0")
+                except InvalidOperation:
+                    return f"Invalid amount: {_text(entry, 'AMOUNT')}"
+        if total != 0:
+            return f"Voucher totals do not match! Difference: {total}"
+        if self.ledgers is not None:
+            for element in voucher.iter():
+                name = _local_name(element.tag)
+                if name in ("LEDGERNAME", "PARTYLEDGERNAME"):
+                    ledger = (element.text or "").strip()
+                    if ledger not in self.ledgers:
+                        return f"Ledger '{ledger}' does not exist!"
+        if self.random.random() < self.reject_rate:
+            return "Rejected at random by the stub"
+        return None
+
+    def import_vouchers(self, body: bytes) -> bytes:
+        """Import the vouchers of one request and return Tally's answer."""
+        try:
+            root = ET.fromstring(body)
+        except ET.ParseError as e:
+            return _response(messages=[f"Could not read the request: {e}"])
+        counts = {"CREATED": 0, "ALTERED": 0, "ERRORS": 0}
+        messages = []
+        with self.lock:
+            self.requests += 1
+            for voucher in root.iter():
+                if _local_name(voucher.tag) != "VOUCHER":
+                    continue
+                key = voucher.get("REMOTEID") or _text(voucher, "VOUCHERNUMBER")
+                error = self.check_voucher(voucher)
+                if error:
+                    counts["ERRORS"] += 1
+                    messages.append(error)
+                    continue
+                counts["ALTERED" if key in self.vouchers else "CREATED"] += 1
+                self.vouchers[key] = voucher
+        print(
+            f"Request {self.requests}: created {counts['CREATED']}, "
+            f"altered {counts['ALTERED']}, errors {counts['ERRORS']} "
+            f"({len(self.vouchers)} vouchers held)"
+        )
+        return _response(counts, messages)
+
+
+def _response(counts=None, messages=()) -> bytes:
+    """Return an import answer in the format of Tally's RESPONSE."""
+    response = ET.Element("RESPONSE")
+    for message in messages:
+        ET.SubElement(response, "LINEERROR").text = message
+    if counts is not None:
+        for name in ("CREATED", "ALTERED", "DELETED", "LASTVCHID", "LASTMID"):
+            ET.SubElement(response, name).text = str(counts.get(name, 0))
+        for name in ("COMBINED", "IGNORED", "ERRORS", "CANCELLED"):
+            ET.SubElement(response, name).text = str(counts.get(name, 0))
+    return ET.tostring(response, encoding="utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, as Tally does
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._answer(b"<RESPONSE>TallyPrime Server is Running</RESPONSE>")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.tally.drops():
+            print("Dropping the connection without an answer")
+            self.close_connection = True
+            return
+        self._answer(self.server.tally.import_vouchers(body))
+
+    def _answer(self, data):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(tally: StubTally, port: int = DEFAULT_PORT, host: str = "localhost"):
+    """Answer import requests for tally on host:port until interrupted."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.tally = tally
+    print(f"Stub Tally listening on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopped with {len(tally.vouchers)} vouchers held.")
+    finally:
+        server.server_close()
+
+
+def load_ledger_names(ledgers_file: str) -> Set[str]:
+    """Read a file written by --export-ledgers, one ledger name per line."""
+    with open(ledgers_file, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in for Tally's XML server that imports vouchers in memory, "
+        "for trying gst-tally push offline"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="Port to listen on"
+    )
+    parser.add_argument(
+        "--ledgers",
+        metavar="FILE",
+        help="Reject vouchers naming a ledger not in FILE (as written by --export-ledgers)",
+    )
+    parser.add_argument(
+        "--reject-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of vouchers to reject at random",
+    )
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests to answer by closing the connection",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for the random rejections")
+    args = parser.parse_args()
+    ledgers = load_ledger_names(args.ledgers) if args.ledgers else None
+    serve(StubTally(ledgers, args.reject_rate, args.drop_rate, args.seed), args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Batch GST amounts against the per-item path, with and without NumPy."""
+
+import os
+import random
+from decimal import Decimal
+
+import pytest
+
+import gst_batch
+from cc_payout import extract_order_amounts_from_payout_csv
+from diagnostics import Diagnostics
+from gst_batch import GstBatch
+from pp_payout import extract_order_amounts_from_paypal_csv
+from records import LineItem
+from synthetic_inputs import generate_inputs
+from woo_csv_to_tally_xml import (
+    compute_gst_amounts,
+    load_catalog,
+    load_sku_mapping,
+    read_woo_csv,
+)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Larger than any export here, so every line item takes the per-item path
+SCALAR_THRESHOLD = 10**9
+
+
+@pytest.fixture(params=["numpy", "python"])
+def batch_engine(request, monkeypatch):
+    """Run the batch pass with NumPy, or with NumPy treated as not installed."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(gst_batch, "_numpy", None)
+    else:
+        monkeypatch.setattr(gst_batch, "_numpy", False)
+    vectorized = []
+    compute = getattr(gst_batch, f"_compute_{request.param}")
+
+    def counted(*args):
+        results = compute(*args)
+        vectorized.append(len(results))
+        return results
+
+    monkeypatch.setattr(gst_batch, f"_compute_{request.param}", counted)
+    return vectorized
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return load_catalog(
+        {
+            "tally_products_file": os.path.join(REPO_DIR, "tally_products.csv"),
+            "sku_mapping_file": os.path.join(REPO_DIR, "woo_sku_to_tally.json"),
+            "product_prices_file": os.path.join(REPO_DIR, "tally_product_prices.csv"),
+        }
+    )
+
+
+def line_amounts(sales_data):
+    return [
+        (
+            sale.voucher_number,
+            [
+                repr(
+                    (
+                        item.base_rate,
+                        item.base_amount,
+                        item.cgst_amount,
+                        item.sgst_amount,
+                    )
+                )
+                for item in sale.products
+            ],
+        )
+        for sale in sales_data
+    ]
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_export_matches_scalar_path(tmp_path, catalog, batch_engine, seed):
+    sku_mapping = load_sku_mapping(os.path.join(REPO_DIR, "woo_sku_to_tally.json"))
+    paths = generate_inputs(str(tmp_path), 4000, sku_mapping, seed)
+    payout_amounts = dict(extract_order_amounts_from_payout_csv(paths["ccavenue"]))
+    payout_amounts.update(extract_order_amounts_from_paypal_csv(paths["paypal"])[0])
+    folder, csv_file = os.path.split(paths["woo"])
+
+    def convert(threshold):
+        sales_data, _ = read_woo_csv(
+            folder,
+            csv_file,
+            catalog,
+            payout_amounts,
+            batch_threshold=threshold,
+            diagnostics=Diagnostics(),
+        )
+        return line_amounts(sales_data)
+
+    expected = convert(SCALAR_THRESHOLD)
+    assert not batch_engine
+    assert convert(0) == expected
+    assert batch_engine and batch_engine[0] > 0
+
+
+def random_item(rng):
+    """Inputs of one line item: bundles, FX costs in fractions of a paisa and ties."""
+    quantity = rng.choice([1, 2, 3, 7, 40])
+    gst_rate = Decimal(rng.choice(["0", "0.05", "0.12", "0.18", "0.28", "0.0375"]))
+    cost = Decimal(rng.randrange(0, 10**7)).scaleb(-2)
+    if rng.random() < 0.3:
+        cost *= Decimal(rng.randrange(1, 10**6)) / Decimal(rng.randrange(1, 10**5))
+    elif rng.random() < 0.2:
+        # A whole paise cost whose base rate is exactly half a paisa over a
+        # whole one: (2m + 1) / 2 paise times 1.12 or 1.28 is whole paise
+        # when 2m + 1 is an odd multiple of 25
+        gst_rate = Decimal(rng.choice(["0.12", "0.28"]))
+        half_paise = Decimal(25 * (2 * rng.randrange(10**5) + 1)) / 2
+        cost = (half_paise * (1 + gst_rate)).scaleb(-2)
+    normal_price = total_normal_price = None
+    if rng.random() < 0.2:
+        normal_price = Decimal(rng.randrange(1, 10**5)).scaleb(-2)
+        total_normal_price = normal_price + Decimal(rng.randrange(0, 10**5)).scaleb(-2)
+    return cost, normal_price, total_normal_price, gst_rate, quantity
+
+
+def test_random_items_match_scalar_path(batch_engine):
+    rng = random.Random(0)
+    batch = GstBatch(compute_gst_amounts, threshold=0)
+    expected = []
+    for _ in range(20000):
+        cost, normal_price, total_normal_price, gst_rate, quantity = random_item(rng)
+        item = LineItem(
+            name="Item",
+            quantity=quantity,
+            base_rate=None,
+            base_amount=None,
+            gst_rate=gst_rate,
+            cgst_amount=None,
+            sgst_amount=None,
+            ledger_name="Sales",
+            godown_name="Main",
+            original_item_cost=cost,
+            converted_item_cost=cost,
+        )
+        batch.add(item, cost, normal_price, total_normal_price, gst_rate)
+        base_rate, total_base, _, cgst_amount, sgst_amount = compute_gst_amounts(
+            cost, normal_price, total_normal_price, gst_rate, quantity
+        )
+        expected.append(repr((base_rate, total_base, cgst_amount, sgst_amount)))
+    batch.run()
+    assert batch_engine and batch_engine[0] > 0
+    assert [
+        repr((item.base_rate, item.base_amount, item.cgst_amount, item.sgst_amount))
+        for item in batch.items
+    ] == expected
@@ -0,0 +1,100 @@
+"""The integer paise engine against the Decimal engine on random orders."""
+
+import random
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from records import LineItem, Order
+from woo_csv_to_tally_xml import MONEY_ENGINES
+
+GST_RATES = ["0", "0.05", "0.12", "0.18", "0.28", "0.025", "0.0375", "0.125"]
+
+
+def random_money(rng, high_paise):
+    return Decimal(rng.randrange(0, high_paise)).scaleb(-2)
+
+
+def random_ratio(rng):
+    """A conversion ratio as build_woo_orders computes it, payout / total."""
+    payout = random_money(rng, 10**8) + Decimal("0.01")
+    total = random_money(rng, 10**6) + Decimal("0.01")
+    return payout / total
+
+
+def random_line_inputs(rng, ratio):
+    """(converted_item_cost, normal_price, total_normal_price, gst_rate, quantity)"""
+    if rng.random() < 0.05:
+        item_cost = random_money(rng, 10**17)
+    else:
+        item_cost = random_money(rng, 10**7)
+    gst_rate = Decimal(rng.choice(GST_RATES))
+    quantity = rng.choice([1, 1, 2, 3, 5, 12, 50])
+    if rng.random() < 0.3:
+        normal_price = random_money(rng, 10**6) + Decimal("0.01")
+        total_normal_price = normal_price + random_money(rng, 10**6)
+    else:
+        normal_price = None
+        total_normal_price = None
+    return item_cost * ratio, normal_price, total_normal_price, gst_rate, quantity
+
+
+def random_order(rng, engine):
+    """A random order with line items computed by engine, and its ratio."""
+    ratio = Decimal("1.0") if rng.random() < 0.5 else random_ratio(rng)
+    compute_amounts = MONEY_ENGINES[engine][0]
+    order = Order(
+        date=datetime(2025, 6, 1),
+        amount=random_money(rng, 10**7) * ratio,
+        original_amount=Decimal("0"),
+        order_currency="INR" if ratio == 1 else "USD",
+        conversion_ratio=ratio,
+        shipping_cost=rng.choice([Decimal("0"), random_money(rng, 50000)]) * ratio,
+        donation_amount=rng.choice([Decimal("0"), random_money(rng, 10**5)]) * ratio,
+        voucher_number="1",
+        narration="",
+        party_ledger="Online Shop Domestic",
+        is_domestic=rng.random() < 0.8,
+    )
+    for _ in range(rng.randint(1, 6)):
+        inputs = random_line_inputs(rng, ratio)
+        base_rate, total_base, _, cgst_amount, sgst_amount = compute_amounts(*inputs)
+        order.products.append(
+            LineItem(
+                name="Item",
+                quantity=inputs[4],
+                base_rate=base_rate,
+                base_amount=total_base,
+                gst_rate=inputs[3],
+                cgst_amount=cgst_amount,
+                sgst_amount=sgst_amount,
+                ledger_name="Sales",
+                godown_name="Main",
+                original_item_cost=inputs[0],
+                converted_item_cost=inputs[0],
+            )
+        )
+    return order
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_line_item_amounts_match(seed):
+    rng = random.Random(seed)
+    decimal_amounts = MONEY_ENGINES["decimal"][0]
+    paise_amounts = MONEY_ENGINES["paise"][0]
+    for _ in range(4000):
+        ratio = Decimal("1.0") if rng.random() < 0.5 else random_ratio(rng)
+        inputs = random_line_inputs(rng, ratio)
+        # Compared as repr so 1.0 and 1.00 do not pass as equal
+        assert repr(paise_amounts(*inputs)) == repr(decimal_amounts(*inputs)), inputs
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_voucher_amounts_match(seed):
+    for index in range(1000):
+        # The same random draws give the same order on both engines
+        decimal_order = random_order(random.Random(f"{seed}-{index}"), "decimal")
+        paise_order = random_order(random.Random(f"{seed}-{index}"), "paise")
+        expected = MONEY_ENGINES["decimal"][1](decimal_order)
+        assert repr(MONEY_ENGINES["paise"][1](paise_order)) == repr(expected)
@@ -0,0 +1,212 @@
+"""PayPalReconciler against the reconciliation loop it replaced."""
+
+import csv
+import dataclasses
+import os
+import random
+from decimal import Decimal, InvalidOperation
+
+import pytest
+
+from pp_payout import (
+    PayPalReconciler,
+    extract_order_amounts_from_paypal_csv,
+    reconcile_paypal_csv_files,
+)
+from synthetic_inputs import generate_inputs
+from woo_csv_to_tally_xml import load_sku_mapping
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def baseline_reconcile(rows):
+    """
+    The reconciliation extract_order_amounts_from_paypal_csv did before
+    PayPalReconciler, scanning every order detail on each conversion and
+    reversal, with details as dicts.
+    """
+    order_amounts = {}
+    pending_payments = {}
+    refunded_orders = set()
+    order_details = []
+    pending_withdrawal = None
+    for row in rows:
+        transaction_type = row.get("Type", "").strip()
+        currency = row.get("Currency", "").strip()
+        status = row.get("Status", "").strip()
+        if status == "Pending":
+            continue
+        if transaction_type == "Express Checkout Payment" and status == "Completed":
+            custom_number = row.get("Custom Number", "").strip()
+            transaction_id = row.get("Transaction ID", "").strip()
+            if custom_number:
+                order_id = custom_number
+                try:
+                    gross_amount = Decimal(row.get("Gross", "0").replace(",", ""))
+                    if gross_amount > 0 and currency != "INR":
+                        pending_payments.setdefault(currency, []).append(
+                            {"order_id": order_id, "gross_amount": gross_amount}
+                        )
+                        order_details.append(
+                            {
+                                "order_id": order_id,
+                                "currency": currency,
+                                "gross_amount": str(gross_amount),
+                                "inr_amount": "Pending",
+                                "transaction_id": transaction_id,
+                                "date": row.get("Date", ""),
+                                "status": "Pending Conversion",
+                            }
+                        )
+                except (InvalidOperation, ValueError):
+                    pass
+        elif transaction_type == "User Initiated Withdrawal" and currency == "INR":
+            try:
+                inr_amount = abs(Decimal(row.get("Gross", "0").replace(",", "")))
+                if inr_amount > 0:
+                    pending_withdrawal = {
+                        "inr_amount": inr_amount,
+                        "transaction_id": row.get("Transaction ID", ""),
+                    }
+            except (InvalidOperation, ValueError):
+                pass
+        elif transaction_type == "General Currency Conversion" and pending_withdrawal:
+            try:
+                amount = Decimal(row.get("Gross", "0").replace(",", ""))
+                reference_txn = row.get("Reference Txn ID", "")
+                if (
+                    amount < 0
+                    and currency != "INR"
+                    and reference_txn == pending_withdrawal["transaction_id"]
+                ):
+                    exchange_rate = pending_withdrawal["inr_amount"] / abs(amount)
+                    if currency in pending_payments:
+                        for payment in pending_payments[currency]:
+                            inr_total = payment["gross_amount"] * exchange_rate
+                            order_amounts[payment["order_id"]] = inr_total.quantize(
+                                Decimal("0.01")
+                            )
+                            for detail in order_details:
+                                if (
+                                    detail["order_id"] == payment["order_id"]
+                                    and detail["status"] == "Pending Conversion"
+                                ):
+                                    detail["inr_amount"] = str(
+                                        inr_total.quantize(Decimal("0.01"))
+                                    )
+                                    detail["status"] = "Converted"
+                                    detail["exchange_rate"] = str(exchange_rate)
+                        pending_payments[currency] = []
+                    pending_withdrawal = None
+            except (InvalidOperation, ValueError):
+                pass
+        elif transaction_type == "Payment Reversal":
+            custom_number = row.get("Custom Number", "").strip()
+            if custom_number:
+                refunded_orders.add(custom_number)
+                order_amounts.pop(custom_number, None)
+                for detail in order_details:
+                    if detail["order_id"] == custom_number:
+                        detail["status"] = "Refunded"
+    return order_amounts, refunded_orders, order_details
+
+
+def as_dicts(details):
+    return [dataclasses.asdict(detail) for detail in details]
+
+
+def baseline_dicts(details):
+    return [
+        dict(detail, exchange_rate=detail.get("exchange_rate", ""))
+        for detail in details
+    ]
+
+
+def generated_download(folder, seed, line_items=3000):
+    sku_mapping = load_sku_mapping(os.path.join(REPO_DIR, "woo_sku_to_tally.json"))
+    return generate_inputs(str(folder), line_items, sku_mapping, seed)["paypal"]
+
+
+def read_rows(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_download_matches_baseline(tmp_path, seed):
+    path = generated_download(tmp_path, seed)
+    amounts, refunded, details = extract_order_amounts_from_paypal_csv(path)
+    expected_amounts, expected_refunded, expected_details = baseline_reconcile(
+        read_rows(path)
+    )
+    assert expected_amounts and expected_refunded
+    assert amounts == expected_amounts
+    assert refunded == expected_refunded
+    assert as_dicts(details) == baseline_dicts(expected_details)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_shuffled_rows_match_baseline(tmp_path, seed):
+    # Out of order rows: reversals before payments, conversions without a
+    # withdrawal, payments of one order on several withdrawals
+    rows = read_rows(generated_download(tmp_path, seed, 1000))
+    rng = random.Random(seed)
+    rows += rng.sample(rows, len(rows) // 10)
+    for start in range(0, len(rows), 40):
+        window = rows[start : start + 40]
+        rng.shuffle(window)
+        rows[start : start + 40] = window
+    reconciler = PayPalReconciler()
+    for row in rows:
+        reconciler.process_row(row)
+    amounts, refunded, details = reconciler.results()
+    expected_amounts, expected_refunded, expected_details = baseline_reconcile(rows)
+    assert amounts == expected_amounts
+    assert refunded == expected_refunded
+    assert as_dicts(details) == baseline_dicts(expected_details)
+
+
+def write_download(path, rows):
+    fieldnames = ["Date", "Time", "TimeZone", "Type", "Status", "Currency", "Gross"]
+    fieldnames += ["Transaction ID", "Reference Txn ID", "Custom Number"]
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(dict(zip(fieldnames, row)) for row in rows)
+    return str(path)
+
+
+def test_downloads_merge_in_utc_order(tmp_path):
+    # The payment is on a later local date than the withdrawal but 90
+    # minutes before it in UTC, so the withdrawal's rate applies to it
+    payments = write_download(
+        tmp_path / "Download1.CSV",
+        [
+            ["02/06/2025", "10:00:00", "IST", "Express Checkout Payment"]
+            + ["Completed", "USD", "100.00", "TX1", "", "5001"],
+        ],
+    )
+    withdrawals = write_download(
+        tmp_path / "Download2.CSV",
+        [
+            ["01/06/2025", "23:00:00", "PDT", "User Initiated Withdrawal"]
+            + ["Completed", "INR", "-8,300.00", "TX2", "", ""],
+            ["01/06/2025", "23:00:00", "America/Los_Angeles"]
+            + ["General Currency Conversion", "Completed", "USD", "-100.00"]
+            + ["TX3", "TX2", ""],
+        ],
+    )
+    amounts, _, _ = reconcile_paypal_csv_files([withdrawals, payments])
+    assert amounts == {"5001": Decimal("8300.00")}
+
+
+def test_unreadable_date_loads_nothing(tmp_path, capsys):
+    path = write_download(
+        tmp_path / "Download.CSV",
+        [
+            ["2025-06-01", "10:00:00", "IST", "Express Checkout Payment"]
+            + ["Completed", "USD", "100.00", "TX1", "", "5001"],
+        ],
+    )
+    assert reconcile_paypal_csv_files([path]) == ({}, set(), [])
+    assert "not DD/MM/YYYY" in capsys.readouterr().out
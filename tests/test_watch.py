@@ -0,0 +1,60 @@
+"""Exports converted by watch are planned as up to date afterwards."""
+
+import os
+
+from settings import export_files, source_files
+from synthetic_inputs import generate_inputs
+from voucher_manifest import file_stamps
+from watch import ExportWatcher
+from woo_csv_to_tally_xml import (
+    build_parser,
+    load_run_config,
+    load_sku_mapping,
+    plan_exports,
+)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_watcher(tmp_path):
+    data_folder = tmp_path / "data"
+    sku_mapping_file = os.path.join(REPO_DIR, "woo_sku_to_tally.json")
+    generate_inputs(str(data_folder), 300, load_sku_mapping(sku_mapping_file))
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        f"data_folder: {data_folder}\n"
+        "woo_prefix: Orders-Export\n"
+        "tally_prefix: sales\n"
+        "payout_prefix: PayoutTransactionSummary\n"
+        "paypal_prefix: Download\n"
+        f"tally_products_file: {os.path.join(REPO_DIR, 'tally_products.csv')}\n"
+        f"sku_mapping_file: {sku_mapping_file}\n"
+        f"product_prices_file: {os.path.join(REPO_DIR, 'tally_product_prices.csv')}\n"
+    )
+    args = build_parser().parse_args(["watch", "--config", str(config_file)])
+    config = load_run_config(args)
+    watcher = ExportWatcher(args, config)
+    assert watcher.start()
+    return watcher, config
+
+
+def planned_actions(config):
+    conversions = plan_exports(
+        config, export_files(config), file_stamps(source_files(config))
+    )
+    return [action for _, _, action, _ in conversions]
+
+
+def test_converted_export_is_current(tmp_path):
+    _, config = start_watcher(tmp_path)
+    assert planned_actions(config) == ["current"]
+
+
+def test_updated_export_is_current(tmp_path):
+    watcher, config = start_watcher(tmp_path)
+    [csv_file] = export_files(config)
+    stat = os.stat(csv_file)
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert planned_actions(config) == ["update"]
+    watcher.handle([os.path.basename(csv_file)])
+    assert planned_actions(config) == ["current"]
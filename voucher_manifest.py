@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from archives import file_digest, source_stat
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the voucher computation changes, so every voucher of an
+# existing XML is recomputed on the next run.
+MANIFEST_VERSION = 2
+
+# Bytes read at a time when looking for the summary line at the end.
+SUMMARY_CHUNK = 4096
+
+
+def manifest_path_for(xml_path: str) -> str:
+    base, _ = os.path.splitext(xml_path)
+    return f"{base}.manifest.jsonl"
+
+
+def shard_path_for(xml_path: str, number: int) -> str:
+    """Return shard number (counted from 1) of an output split into shards."""
+    base, _ = os.path.splitext(xml_path)
+    return f"{base}.part-{number:03d}.xml"
+
+
+def shard_index_path_for(xml_path: str) -> str:
+    """Return the file listing the shards of an output split into shards."""
+    base, _ = os.path.splitext(xml_path)
+    return f"{base}.index.csv"
+
+
+def output_hashes(xml_path: str, summary: Dict) -> List[Tuple[str, str]]:
+    """
+    Return (file, sha256) of each XML a manifest summary describes: its
+    shards when the output was split, otherwise xml_path itself.
+    """
+    if "shards" not in summary:
+        return [(xml_path, summary.get("xml_sha256"))]
+    folder = os.path.dirname(xml_path)
+    return [
+        (os.path.join(folder, shard["xml"]), shard["xml_sha256"])
+        for shard in summary["shards"]
+    ]
+
+
+def order_fingerprint(rows: List[List], payout_amount, catalog, header) -> str:
+    """
+    Fingerprint everything a voucher is computed from.
+
+    Covers the order's completed export rows (read with header, the export's
+    WooHeader), its payout amount and the compiled catalog entry of each SKU
+    on those rows (components, GST rates, godowns, ledgers and prices). A SKU
+    fix therefore only changes the fingerprint of orders that contain that
+    SKU. Rows are fingerprinted as the dicts csv.DictReader reads, so
+    manifests written before rows were read as lists still match.
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    digest.update(repr(MANIFEST_VERSION).encode("utf-8"))
+    digest.update(repr(payout_amount).encode("utf-8"))
+    for row in rows:
+        digest.update(header.items_repr(row).encode("utf-8"))
+        sku = (header.field(row, "SKU", None) or "").strip()
+        digest.update(repr(catalog.get(sku)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_manifest(xml_path: str) -> Optional[Dict[str, Dict]]:
+    """
+    Load the voucher records for xml_path, keyed by order ID, in file order.
+
+    Returns None when there is no manifest, it was written by another
+    MANIFEST_VERSION, or the XML (or one of its shards) no longer matches
+    the hash recorded in it (for example after a manual edit).
+    """
+    path = manifest_path_for(xml_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable manifest {os.path.basename(path)}: {e}")
+        return None
+    if not lines or lines[-1].get("version") != MANIFEST_VERSION:
+        logger.debug("Ignoring manifest %s written by another version", path)
+        return None
+    for output_path, expected_hash in output_hashes(xml_path, lines[-1]):
+        try:
+            xml_hash = file_digest(output_path)
+        except FileNotFoundError:
+            return None
+        if xml_hash != expected_hash:
+            print(
+                f"Warning: {os.path.basename(output_path)} does not match its manifest, recomputing every voucher"
+            )
+            return None
+    return {record["order_id"]: record for record in lines[:-1]}
+
+
+def file_stamps(paths: Iterable[str]) -> Dict[str, Optional[List[int]]]:
+    """
+    Return [size, mtime_ns] of each file (None if missing) by absolute path.
+    A member of a .zip gets the stamp of its archive.
+    """
+    stamps = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        try:
+            stat = source_stat(path)
+            stamps[path] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def _output_stamps(xml_path: str, summary: Dict) -> Dict[str, Optional[List[int]]]:
+    return file_stamps(path for path, _ in output_hashes(xml_path, summary))
+
+
+def _read_summary(f) -> Tuple[int, Dict]:
+    """Return the offset and content of the last line of a manifest opened in binary."""
+    # Start before the newline that ends the summary line
+    end = max(f.seek(0, os.SEEK_END) - 1, 0)
+    start = 0
+    while end > 0:
+        chunk_start = max(0, end - SUMMARY_CHUNK)
+        f.seek(chunk_start)
+        newline = f.read(end - chunk_start).rfind(b"\n")
+        if newline >= 0:
+            start = chunk_start + newline + 1
+            break
+        end = chunk_start
+    f.seek(start)
+    return start, json.loads(f.read())
+
+
+def record_inputs(xml_path: str, inputs: Dict[str, Optional[List[int]]]):
+    """
+    Note in the summary line of xml_path's manifest the file_stamps of the
+    files its vouchers were computed from, and of the XML (or its shards).
+
+    Only the summary line is rewritten, so this is cheap for any size of
+    manifest. Nothing is done when there is no manifest.
+    """
+    try:
+        with open(manifest_path_for(xml_path), "r+b") as f:
+            offset, summary = _read_summary(f)
+            summary["inputs"] = dict(inputs, **_output_stamps(xml_path, summary))
+            f.seek(offset)
+            f.truncate()
+            f.write(json.dumps(summary).encode("utf-8") + b"\n")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(
+            f"Warning: Could not record the inputs of {os.path.basename(xml_path)}: {e}"
+        )
+
+
+def manifest_is_current(xml_path: str, inputs: Dict[str, Optional[List[int]]]) -> bool:
+    """
+    Tell whether xml_path was last brought up to date from exactly these
+    inputs (see record_inputs), so updating it again cannot change it.
+
+    Compares file sizes and modification times only; no file is read but
+    the end of the manifest.
+    """
+    try:
+        with open(manifest_path_for(xml_path), "rb") as f:
+            _, summary = _read_summary(f)
+    except (OSError, ValueError):
+        return False
+    if summary.get("version") != MANIFEST_VERSION:
+        return False
+    return summary.get("inputs") == dict(inputs, **_output_stamps(xml_path, summary))
+
+
+class ManifestWriter:
+    """
+    Write a manifest next to an XML as its vouchers are written.
+
+    One JSON line per voucher (order ID, input fingerprint, hash, byte offset
+    and length of its TALLYMESSAGE in the XML), then a summary line holding
+    the manifest version and the hash of the finished XML. Records are written
+    as they arrive so memory stays flat for large exports. An output split
+    into shards has one manifest for all of them: each record also holds the
+    number of its shard, and the summary lists the shards with their hashes.
+    """
+
+    def __init__(self, xml_path: str):
+        self.path = manifest_path_for(xml_path)
+        self.xml_name = os.path.basename(xml_path)
+        self.temp_path = f"{self.path}.tmp"
+        self.count = 0
+        self._file = open(self.temp_path, "w", encoding="utf-8")
+
+    def add(self, record: Dict):
+        self._file.write(json.dumps(record) + "\n")
+        self.count += 1
+
+    def commit(self, xml_sha256: Optional[str] = None, shards: List[Dict] = None):
+        summary = {"version": MANIFEST_VERSION, "xml": self.xml_name}
+        if shards is None:
+            summary["xml_sha256"] = xml_sha256
+        else:
+            summary["shards"] = shards
+        summary["vouchers"] = self.count
+        self._file.write(json.dumps(summary) + "\n")
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+
+    def close(self):
+        """Close the manifest, discarding it unless it was committed."""
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class VoucherReader:
+    """Read the TALLYMESSAGE bytes of manifest records back from their XML or shard."""
+
+    def __init__(self, xml_path: str):
+        self.xml_path = xml_path
+        self._files = {}
+
+    def read(self, record: Dict) -> bytes:
+        shard = record.get("shard")
+        path = shard_path_for(self.xml_path, shard) if shard else self.xml_path
+        if path not in self._files:
+            self._files[path] = open(path, "rb")
+        f = self._files[path]
+        f.seek(record["offset"])
+        return f.read(record["length"])
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,424 @@
+import csv
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from datetime import datetime
+
+from archives import ZIP_SUFFIX, archive_members, source_exists, source_name
+from cc_payout import find_ccavenue_csv_files, load_ccavenue_files
+from fx_payout import combine_order_amounts
+from order_store import save_payouts
+from pp_payout import load_all_paypal_order_amounts
+from settings import export_files, source_files
+from voucher_manifest import file_stamps, manifest_path_for
+from woo_csv_to_tally_xml import (
+    _convert_in_worker,
+    _init_conversion_worker,
+    cache_dir_for,
+    catalog_files,
+    load_catalog,
+    load_run_config,
+    missing_payout_path,
+    plan_conversion,
+    plan_exports,
+    print_skipped,
+)
+
+# Seconds between folder scans when inotify is not available, and between
+# checks of the product files, which live outside the data folder.
+POLL_INTERVAL = 2.0
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Report the names of files changed in a folder, using Linux inotify."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {folder}")
+
+    def wait(self, timeout):
+        """Return the names changed within timeout seconds (empty if none)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if name:
+                    names.add(os.fsdecode(name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report the names of files changed in a folder by comparing scans."""
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        names = {
+            name
+            for name in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(name) != self.snapshot.get(name)
+        }
+        self.snapshot = snapshot
+        return names
+
+    def close(self):
+        pass
+
+
+def open_watcher(folder, poll=False):
+    """Return an inotify watcher for folder, or a polling one if unavailable."""
+    if not poll:
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError, TypeError) as e:
+            # AttributeError/TypeError: no inotify in this C library (macOS, Windows)
+            print(f"inotify is not available ({e}), polling every {POLL_INTERVAL:g}s")
+    return PollingWatcher(folder)
+
+
+def collect_changes(watcher, debounce, timeout):
+    """
+    Wait up to timeout seconds for a change, then keep collecting until no
+    change has been seen for debounce seconds.
+
+    Returns:
+        Set of changed file names (empty if nothing changed within timeout)
+    """
+    names = watcher.wait(timeout)
+    if not names:
+        return names
+    quiet_since = time.monotonic()
+    while time.monotonic() - quiet_since < debounce:
+        more = watcher.wait(debounce - (time.monotonic() - quiet_since))
+        if more:
+            names |= more
+            quiet_since = time.monotonic()
+    return names
+
+
+def _file_stamps(paths):
+    stamps = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def _export_order_ids(config, csv_file, base_name):
+    """Return the order IDs of an export's XML and missing-payout file."""
+    order_ids = set()
+    data_folder = config["data_folder"]
+    manifest = manifest_path_for(os.path.join(data_folder, f"{base_name}.xml"))
+    try:
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if "order_id" in record:
+                    order_ids.add(record["order_id"])
+    except (OSError, ValueError):
+        pass
+    try:
+        missing_file = missing_payout_path(data_folder, csv_file, config)
+        with open(missing_file, "r", newline="", encoding="utf-8") as f:
+            order_ids.update(row["order_id"] for row in csv.DictReader(f))
+    except (OSError, KeyError, csv.Error):
+        pass
+    return order_ids
+
+
+class ExportWatcher:
+    """
+    Keep the catalog and payout amounts in memory and convert exports as
+    files change in the data folder.
+
+    A new or changed WooCommerce export is converted, or updated when its
+    XML has a manifest. A changed PayPal download reconciles the PayPal
+    downloads again and a changed CCAvenue summary is parsed on its own;
+    only the exports with an order whose payout amount changed are then
+    updated. A changed product file recompiles the catalog and updates every
+    export, which recomputes just the orders whose SKUs changed.
+    """
+
+    def __init__(self, args, config):
+        self.args = args
+        self.config = config
+        self.data_folder = config["data_folder"]
+        self.cache_dir = cache_dir_for(config, args.no_cache)
+        self.catalog = None
+        self.catalog_stamps = {}
+        self.paypal_amounts = {}
+        self.ccavenue_amounts = {}
+        self.payout_amounts = {}
+        self.source_stamps = {}
+
+    def _matches(self, path, prefix_key, default_prefix=None):
+        prefix = self.config.get(prefix_key, default_prefix)
+        return bool(prefix) and source_name(path).startswith(prefix)
+
+    def is_export(self, path):
+        return self._matches(path, "woo_prefix") and source_name(path).endswith(".csv")
+
+    def is_paypal(self, path):
+        return self._matches(path, "paypal_prefix", "Download") and source_name(
+            path
+        ).lower().endswith(".csv")
+
+    def is_ccavenue(self, path):
+        return self._matches(path, "payout_prefix") and source_name(path).endswith(
+            ".csv"
+        )
+
+    def exports(self):
+        return export_files(self.config)
+
+    def sources(self, name):
+        """Return the sources a changed file holds: the members of a .zip, or itself."""
+        path = os.path.join(self.data_folder, name)
+        if not name.lower().endswith(ZIP_SUFFIX):
+            return [path]
+        if not os.path.isfile(path):
+            return []
+        try:
+            return archive_members(path)
+        except OSError as e:
+            print(f"Warning: Skipping unreadable archive {name}: {e}")
+            return []
+
+    def archive_removed(self, names):
+        return any(
+            name.lower().endswith(ZIP_SUFFIX)
+            and not os.path.exists(os.path.join(self.data_folder, name))
+            for name in names
+        )
+
+    def load_catalog(self):
+        """Compile the catalog again; keep the previous one if that fails."""
+        paths = catalog_files(self.config)
+        self.catalog_stamps = _file_stamps(paths)
+        catalog = load_catalog(self.config)
+        if catalog is None:
+            return False
+        self.catalog = catalog
+        return True
+
+    def catalog_changed(self):
+        return _file_stamps(catalog_files(self.config)) != self.catalog_stamps
+
+    def load_paypal(self):
+        self.paypal_amounts = load_all_paypal_order_amounts(
+            self.config, self.cache_dir
+        )[0]
+
+    def load_ccavenue(self, csv_files):
+        """Parse csv_files again and forget the CCAvenue files that are gone."""
+        for csv_file in list(self.ccavenue_amounts):
+            if not source_exists(csv_file):
+                del self.ccavenue_amounts[csv_file]
+        for csv_file, (order_amounts, output) in zip(
+            csv_files, load_ccavenue_files(csv_files, cache_dir=self.cache_dir)
+        ):
+            print(output, end="")
+            self.ccavenue_amounts[csv_file] = order_amounts
+
+    def combine_payouts(self):
+        """
+        Merge the payout indexes, CCAvenue files in path order.
+
+        Returns:
+            Set of order IDs whose payout amount was added, changed or removed
+        """
+        ccavenue_amounts = {}
+        for csv_file in sorted(self.ccavenue_amounts):
+            ccavenue_amounts.update(self.ccavenue_amounts[csv_file])
+        previous = self.payout_amounts
+        self.payout_amounts = combine_order_amounts(
+            self.paypal_amounts, ccavenue_amounts
+        )
+        save_payouts(self.config, self.payout_amounts)
+        return {
+            order_id
+            for order_id in previous.keys() | self.payout_amounts.keys()
+            if previous.get(order_id) != self.payout_amounts.get(order_id)
+        }
+
+    def stamp_sources(self):
+        """
+        Note the file_stamps of the source files before their indexes are
+        loaded again, so a file changed meanwhile is read again next time.
+        The config is only read at startup, so its stamp is kept from then.
+        """
+        stamps = file_stamps(source_files(self.config))
+        config_file = self.config["config_file"]
+        if config_file in self.source_stamps:
+            stamps[config_file] = self.source_stamps[config_file]
+        self.source_stamps = stamps
+
+    def convert(self, csv_file):
+        """
+        Convert or update one export, as a normal run would (plan_exports
+        and _convert_in_worker), recording the inputs it was converted from.
+        """
+        [(_, base_name, action, inputs)] = plan_exports(
+            self.config, [csv_file], self.source_stamps
+        )
+        if action in ("skip", "current"):
+            print_skipped(csv_file, base_name, action)
+            return
+        _init_conversion_worker(
+            self.data_folder,
+            self.catalog,
+            self.payout_amounts,
+            self.config,
+            self.args.stream,
+            self.cache_dir,
+        )
+        _convert_in_worker(csv_file, base_name, action == "update", inputs)
+
+    def affected_exports(self, changed_order_ids):
+        """Return the exports whose XML or missing-payout file has one of the orders."""
+        affected = []
+        for csv_file in self.exports():
+            base_name, action = plan_conversion(self.config, csv_file)
+            if action == "skip":
+                continue
+            if _export_order_ids(self.config, csv_file, base_name) & changed_order_ids:
+                affected.append(csv_file)
+        return affected
+
+    def start(self):
+        """Load everything and bring every export up to date, like a normal run."""
+        self.stamp_sources()
+        if not self.load_catalog():
+            return False
+        print("\nLoading payout data...")
+        self.load_paypal()
+        self.load_ccavenue(find_ccavenue_csv_files(self.config))
+        self.combine_payouts()
+        for csv_file in self.exports():
+            self.convert(csv_file)
+        return True
+
+    def handle(self, names):
+        """
+        Update the indexes the changed files belong to and convert what they
+        affect. A changed .zip stands for every file in it; when one is
+        removed, both payout sources are loaded again.
+        """
+        self.stamp_sources()
+        sources = [source for name in names for source in self.sources(name)]
+        archive_removed = self.archive_removed(names)
+        paypal_changed = archive_removed or any(
+            self.is_paypal(source) for source in sources
+        )
+        ccavenue_files = sorted(
+            source for source in sources if self.is_ccavenue(source)
+        )
+        exports = {source for source in sources if self.is_export(source)}
+        if self.catalog_changed():
+            print("\nProduct files changed, compiling the catalog again...")
+            if self.load_catalog():
+                exports.update(self.exports())
+        if paypal_changed or ccavenue_files:
+            print("\nPayout files changed, loading them again...")
+            if paypal_changed:
+                self.load_paypal()
+            self.load_ccavenue(
+                [csv_file for csv_file in ccavenue_files if source_exists(csv_file)]
+            )
+            changed_order_ids = self.combine_payouts()
+            print(f"Payout amounts changed for {len(changed_order_ids)} orders")
+            exports.update(self.affected_exports(changed_order_ids))
+        for csv_file in sorted(exports):
+            if source_exists(csv_file):
+                self.convert(csv_file)
+
+    def relevant(self, name):
+        if name.lower().endswith(ZIP_SUFFIX):
+            return True
+        path = os.path.join(self.data_folder, name)
+        return self.is_export(path) or self.is_paypal(path) or self.is_ccavenue(path)
+
+
+def watch_exports(args):
+    """
+    Run the watch command: convert everything once, then keep converting as
+    exports and payout files arrive, until interrupted.
+    """
+    config = load_run_config(args)
+    if not config:
+        return
+    watcher = ExportWatcher(args, config)
+    if not watcher.start():
+        return
+    folder_watcher = open_watcher(config["data_folder"], args.poll)
+    print(f"\nWatching {config['data_folder']} for new exports (Ctrl+C to stop)...")
+    try:
+        while True:
+            names = collect_changes(folder_watcher, args.debounce, POLL_INTERVAL)
+            names = {name for name in names if watcher.relevant(name)}
+            if names or watcher.catalog_changed():
+                stamp = datetime.now().strftime("%H:%M:%S")
+                print(
+                    f"\n[{stamp}] Changed: {', '.join(sorted(names)) or 'product files'}"
+                )
+                watcher.handle(names)
+                print(f"\nWatching {config['data_folder']}...")
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        folder_watcher.close()
@@ -1,67 +1,58 @@
 import argparse
 import csv
-import glob
+import io
+import itertools
 import json
 import logging
 import os
-import xml.etree.ElementTree as ET
-import yaml
+import re
 from datetime import datetime
 from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
-from fx_payout import load_all_order_amounts_from_config
 
-from ledger import get_gst_ledgers, get_party_ledger, get_sales_ledger
+from archives import open_source, source_name, source_size
+from catalog import ProductCatalog
+from diagnostics import DEFAULT_LEVEL, LEVELS, Diagnostics
+from ledger import DONATION_LEDGER, ROUNDING_LEDGER, SHIPPING_LEDGER
+import profiling
+import progress
+from parallel import call_captured, create_executor
+from records import LineItem, Order
+from gst_batch import DEFAULT_BATCH_THRESHOLD, GstBatch
+from paise import compute_gst_paise, from_paise, voucher_amounts_paise
+from parse_cache import cached_parse, default_cache_dir
+from settings import export_files, load_config, source_files
+from voucher_manifest import (
+    ManifestWriter,
+    VoucherReader,
+    file_stamps,
+    load_manifest,
+    manifest_is_current,
+    manifest_path_for,
+    order_fingerprint,
+    record_inputs,
+    shard_index_path_for,
+    shard_path_for,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
-def safe_decimal_conversion(value, field_name="field", default="0"):
+def safe_decimal_conversion(
+    value, field_name="field", default="0", diagnostics=None, order_id=None
+):
     if not value or not value.strip():
         return Decimal(default)
     try:
         return Decimal(value.replace(",", ""))
     except (InvalidOperation, ValueError) as e:
-        print(f"Warning: Invalid {field_name} value '{value}', using {default}")
+        message = f"Warning: Invalid {field_name} value '{value}', using {default}"
+        if diagnostics is None:
+            print(message)
+        else:
+            diagnostics.report("invalid_number", field_name, message, order_id)
         return Decimal(default)
 
 
-def load_config(config_file="config.yaml"):
-    if not os.path.exists(config_file):
-        print(f"Error: Configuration file '{config_file}' not found!")
-        return None
-    try:
-        with open(config_file, "r") as f:
-            config = yaml.safe_load(f)
-        required_fields = [
-            "woo_prefix",
-            "tally_prefix",
-            "data_folder",
-            "tally_products_file",
-            "sku_mapping_file",
-            "product_prices_file",
-        ]
-        missing_fields = [field for field in required_fields if field not in config]
-        if missing_fields:
-            print(
-                f"Error: Missing required configuration fields: {', '.join(missing_fields)}"
-            )
-            return None
-        if config["data_folder"].startswith("~"):
-            config["data_folder"] = os.path.expanduser(config["data_folder"])
-        if not os.path.isabs(config["data_folder"]):
-            print(
-                f"Error: data_folder '{config['data_folder']}' must be an absolute path!"
-            )
-            return None
-        if not os.path.exists(config["data_folder"]):
-            print(f"Error: Data folder '{config['data_folder']}' does not exist!")
-            return None
-        return config
-    except Exception as e:
-        print(f"Error loading configuration: {e}")
-        return None
-
-
 def load_tally_products(tally_products_file):
     tally_products = {}
     try:
@@ -144,219 +135,527 @@ def load_sku_mapping(sku_mapping_file):
         return {}
 
 
-def get_tally_products_by_sku(sku, sku_mapping):
-    if sku and sku.strip() in sku_mapping:
-        return sku_mapping[sku.strip()]
+def round_decimal(value):
+    return value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def compute_gst_amounts(
+    converted_item_cost, normal_price, total_normal_price, gst_rate, quantity
+):
+    """
+    Split a line item's cost into base and GST amounts, rounded to paise.
+
+    For bundle components (total_normal_price set) the component's share of
+    the item cost is normal_price * (cost / total_normal_price).
+
+    Returns:
+        (base_rate, total_base, total_gst, cgst_amount, sgst_amount)
+    """
+    if total_normal_price is not None:
+        discount_ratio = converted_item_cost / total_normal_price
+        product_base_cost = normal_price * discount_ratio
     else:
-        print(f"Warning: SKU '{sku}' not found in mapping")
-        return []
+        product_base_cost = converted_item_cost
+    base_rate = round_decimal(
+        product_base_cost / (Decimal("1") + gst_rate)
+        if gst_rate > Decimal("0")
+        else product_base_cost
+    )
+    total_base = round_decimal(base_rate * Decimal(str(quantity)))
+    total_gst = round_decimal(
+        (product_base_cost - base_rate) * Decimal(str(quantity))
+        if gst_rate > Decimal("0")
+        else Decimal("0.0")
+    )
+    cgst_amount = round_decimal(
+        total_gst / Decimal("2") if gst_rate > Decimal("0") else Decimal("0.0")
+    )
+    sgst_amount = round_decimal(
+        total_gst / Decimal("2") if gst_rate > Decimal("0") else Decimal("0.0")
+    )
+    return base_rate, total_base, total_gst, cgst_amount, sgst_amount
 
 
-def round_decimal(value):
-    return value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+def compute_gst_amounts_paise(
+    converted_item_cost, normal_price, total_normal_price, gst_rate, quantity
+):
+    """compute_gst_amounts on the integer paise engine, returned as Decimals."""
+    return tuple(
+        from_paise(amount)
+        for amount in compute_gst_paise(
+            converted_item_cost, normal_price, total_normal_price, gst_rate, quantity
+        )
+    )
 
 
-def read_woo_csv(
-    data_folder, csv_file, sku_mapping, tally_products, product_prices, payout_amounts
+# How "All Export" writes Order Date, e.g. 2025-06-13 13:39:35
+ORDER_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+_ORDER_DATE = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)", re.ASCII)
+
+
+def parse_order_date(text):
+    """
+    Return datetime.strptime(text, ORDER_DATE_FORMAT), reading dates written
+    exactly that way without strptime. Anything else, including dates that
+    do not exist, is left to strptime and fails as it does.
+    """
+    match = _ORDER_DATE.fullmatch(text) if isinstance(text, str) else None
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return datetime.strptime(text, ORDER_DATE_FORMAT)
+
+
+def decode_woo_csv(file_path):
+    """Read an export into (fieldnames, rows), each row a list of strings."""
+    with open_source(file_path, newline="") as f:
+        reader = csv.reader(f)
+        fieldnames = next(reader, None)
+        return fieldnames, [row for row in reader if row]
+
+
+class WooHeader:
+    """
+    The columns of an export, resolved to row indexes once from its header.
+
+    Rows stay lists of strings as csv.reader returns them; a WooHeader reads
+    them the way they would read as csv.DictReader dicts. When a name appears
+    in the header twice the last column wins, rows shorter than the header
+    read None for the columns they lack (see fill) and the cells of longer
+    rows past the header are kept under None.
+    """
+
+    def __init__(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self.width = len(self.fieldnames)
+        self.indexes = {name: index for index, name in enumerate(self.fieldnames)}
+        self.distinct = len(self.indexes) == self.width
+        # repr(self.items(row)) of a filled row with the names written out
+        # once, leaving a %r for each value
+        pairs = (
+            "(" + repr(name).replace("%", "%%") + ", %r)" for name in self.fieldnames
+        )
+        self._items_format = "[" + ", ".join(pairs) + "]"
+
+    def index(self, name):
+        """Return the index of column name, or None if the export lacks it."""
+        return self.indexes.get(name)
+
+    def fill(self, row):
+        """Return row padded with None to the width of the header."""
+        return list(row) + [None] * (self.width - len(row))
+
+    def field(self, row, name, *default):
+        """
+        Return a column of a filled row like row[name] of a dict, or like
+        row.get(name, default) when a default is given.
+
+        Raises:
+            KeyError: If the export lacks the column and there is no default
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        return row[index]
+
+    def as_dict(self, row):
+        """Return row as the dict csv.DictReader would have read."""
+        row_dict = dict(zip(self.fieldnames, row))
+        if self.width < len(row):
+            row_dict[None] = row[self.width :]
+        elif self.width > len(row):
+            for name in self.fieldnames[len(row) :]:
+                row_dict[name] = None
+        return row_dict
+
+    def items(self, row):
+        """Return list(self.as_dict(row).items()), without the dict if possible."""
+        if not self.distinct or self.width > len(row):
+            return list(self.as_dict(row).items())
+        items = list(zip(self.fieldnames, row))
+        if self.width < len(row):
+            items.append((None, row[self.width :]))
+        return items
+
+    def items_repr(self, row):
+        """Return repr(self.items(row)), formatted without building the items."""
+        if not self.distinct or self.width != len(row):
+            return repr(self.items(row))
+        return self._items_format % tuple(row)
+
+
+def read_woo_rows(file_path, cache_dir=None):
+    """
+    Yield the rows of an export as lists of strings, the header row first,
+    the way csv.reader does but without blank rows.
+
+    Without a cache_dir rows are streamed straight from the file, decompressed
+    on the fly from a .gz or .zip. With one, the decoded rows are loaded from
+    (or saved to) the parse cache. Rows after the header are added to the
+    "rows" counter of the current profiling stage. Nothing is yielded for an
+    empty file.
+    """
+    if cache_dir is None:
+        with open_source(file_path, newline="") as f:
+            reader = csv.reader(f)
+            fieldnames = next(reader, None)
+            logger.debug("CSV Headers Found: %s", fieldnames)
+            if fieldnames is None:
+                return
+            yield fieldnames
+            row_count = 0
+            for row in reader:
+                if row:
+                    row_count += 1
+                    yield row
+            profiling.count("rows", row_count)
+        return
+    fieldnames, rows = cached_parse(cache_dir, "woo", decode_woo_csv, file_path)
+    logger.debug("CSV Headers Found: %s", fieldnames)
+    if fieldnames is None:
+        return
+    profiling.count("rows", len(rows))
+    yield fieldnames
+    yield from rows
+
+
+def iter_woo_orders(
+    data_folder,
+    csv_file,
+    catalog,
+    payout_amounts,
+    missing_payout_orders,
+    cache_dir=None,
+    engine="decimal",
+    batch=None,
+    diagnostics=None,
 ):
+    """
+    Yield completed orders from a WooCommerce export one at a time.
+
+    "All Export" writes the line items of an order on consecutive rows, so an
+    order is complete as soon as the next Order ID shows up and is yielded
+    right away. Only the order being assembled is held in memory.
+
+    Foreign currency orders without a payout amount are appended to
+    missing_payout_orders instead of being yielded. An order whose rows are
+    not consecutive is yielded once per run of rows. File and decoding errors
+    are raised to the caller. With a cache_dir the decoded rows of an
+    unchanged export are read from the cache instead. engine, batch and
+    diagnostics are passed on to build_woo_orders.
+    """
     file_path = os.path.join(data_folder, csv_file)
-    sales_data = {}
-    missing_payout_orders = []
-    try:
-        with open(file_path, newline="", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            logger.debug("CSV Headers Found: %s", reader.fieldnames)
-            for row in reader:
-                try:
-                    if row["Order Status"].lower() != "wc-completed":
-                        continue
-                    order_id = row["Order ID"]
-                    if order_id not in sales_data:
-                        sale_date = datetime.strptime(
-                            row["Order Date"], "%Y-%m-%d %H:%M:%S"
-                        )
-                        customer_name = (
-                            f"{row['Billing First Name']} {row['Billing Last Name']}".strip()
-                            or "Unknown Customer"
+    return build_woo_orders(
+        read_woo_rows(file_path, cache_dir),
+        catalog,
+        payout_amounts,
+        missing_payout_orders,
+        engine,
+        batch,
+        diagnostics,
+    )
+
+
+def build_woo_orders(
+    rows,
+    catalog,
+    payout_amounts,
+    missing_payout_orders,
+    engine="decimal",
+    batch=None,
+    diagnostics=None,
+):
+    """
+    Turn export rows into orders, yielding each one once its rows are done.
+
+    rows are lists of strings, the header row first, as read_woo_rows yields
+    them. Only the columns an order is built from are looked at: a row's
+    status is checked before anything else is read from it, and the header
+    fields of an order are parsed from its first completed row.
+
+    Every order carries a "fingerprint" of its completed rows, payout amount
+    and the catalog entries its SKUs resolve to (see order_fingerprint).
+
+    With a GstBatch the line items are added to it without amounts, which
+    are filled in when the caller runs the batch. Unmapped SKUs, invalid
+    numbers, currency conversions and rows that cannot be processed are
+    reported to diagnostics; without one, each is printed as it is found.
+    """
+    compute_amounts = MONEY_ENGINES[engine][0]
+    if diagnostics is None:
+        diagnostics = Diagnostics("all")
+    rows = iter(rows)
+    fieldnames = next(rows, None)
+    if fieldnames is None:
+        return
+    header = WooHeader(fieldnames)
+    field = header.field
+    width = header.width
+    status_at = header.index("Order Status")
+    id_at = header.index("Order ID")
+    sku_at = header.index("SKU")
+    quantity_at = header.index("Quantity")
+    item_cost_at = header.index("Item Cost")
+    # The last Order Date parsed, as each row of an order that is missing its
+    # payout starts the order again
+    date_text = sale_date = None
+    current_order = None
+    current_id = None
+    current_rows = []
+    for row in rows:
+        if len(row) < width:
+            row = header.fill(row)
+        try:
+            if status_at is None:
+                raise KeyError("Order Status")
+            status = row[status_at]
+            if status != "wc-completed" and status.lower() != "wc-completed":
+                continue
+            if id_at is None:
+                raise KeyError("Order ID")
+            order_id = row[id_at]
+            if order_id != current_id:
+                if current_order is not None:
+                    current_order.fingerprint = order_fingerprint(
+                        current_rows,
+                        payout_amounts.get(current_id),
+                        catalog,
+                        header,
+                    )
+                    yield current_order
+                current_order = None
+                current_id = order_id
+                current_rows = []
+            current_rows.append(row)
+            if current_order is None:
+                order_date = field(row, "Order Date")
+                if order_date != date_text or sale_date is None:
+                    sale_date = parse_order_date(order_date)
+                    date_text = order_date
+                customer_name = (
+                    f"{field(row, 'Billing First Name')} {field(row, 'Billing Last Name')}".strip()
+                    or "Unknown Customer"
+                )
+                customer_phone = field(row, "Billing Phone") or "N/A"
+                customer_email = field(row, "Billing Email Address") or "N/A"
+                original_amount = safe_decimal_conversion(
+                    field(row, "Order Total"), "Order Total", "0", diagnostics, order_id
+                )
+                order_currency = field(row, "Order Currency", "").strip()
+                original_shipping_cost = safe_decimal_conversion(
+                    field(row, "Shipping Cost", ""),
+                    "Shipping Cost",
+                    "0",
+                    diagnostics,
+                    order_id,
+                )
+                total_fee_str = field(row, "Total Fee Amount", "0").strip()
+                if not total_fee_str:
+                    diagnostics.report(
+                        "blank_fee",
+                        "Total Fee Amount",
+                        f"Warning: Blank Total Fee Amount for order {order_id}, defaulting to 0",
+                        order_id,
+                    )
+                    original_donation_amount = Decimal("0")
+                else:
+                    original_donation_amount = safe_decimal_conversion(
+                        field(row, "Total Fee Amount", ""),
+                        "Total Fee Amount",
+                        "0",
+                        diagnostics,
+                        order_id,
+                    )
+                country = field(row, "Shipping Country")
+                party_ledger = catalog.ledgers.party_ledger(country)
+                is_domestic = country == "IN"
+                conversion_ratio = Decimal("1.0")
+                final_amount = original_amount
+                final_shipping_cost = original_shipping_cost
+                final_donation_amount = original_donation_amount
+                if order_currency and order_currency != "INR":
+                    payout_amount = payout_amounts.get(order_id)
+                    if payout_amount:
+                        conversion_ratio = payout_amount / original_amount
+                        final_amount = payout_amount
+                        final_shipping_cost = original_shipping_cost * conversion_ratio
+                        final_donation_amount = (
+                            original_donation_amount * conversion_ratio
                         )
-                        customer_phone = row["Billing Phone"] or "N/A"
-                        customer_email = row["Billing Email Address"] or "N/A"
-                        original_amount = safe_decimal_conversion(
-                            row["Order Total"], "Order Total"
+                        diagnostics.report(
+                            "fx_conversion",
+                            order_currency,
+                            f"Order {order_id}: Converting {order_currency} to INR"
+                            f" (ratio: {conversion_ratio:.6f})"
+                            f" - Original: {original_amount} {order_currency}"
+                            f" - INR: {final_amount} INR",
+                            order_id,
                         )
-                        order_currency = row.get("Order Currency", "").strip()
-                        original_shipping_cost = safe_decimal_conversion(
-                            row.get("Shipping Cost", ""), "Shipping Cost"
+                    else:
+                        diagnostics.report(
+                            "missing_payout",
+                            order_currency,
+                            f"Warning: No payout amount found for foreign currency order {order_id} ({order_currency})",
+                            order_id,
                         )
-                        total_fee_str = row.get("Total Fee Amount", "0").strip()
-                        if not total_fee_str:
-                            print(
-                                f"Warning: Blank Total Fee Amount for order {order_id}, defaulting to 0"
-                            )
-                            original_donation_amount = Decimal("0")
-                        else:
-                            original_donation_amount = safe_decimal_conversion(
-                                row.get("Total Fee Amount", ""), "Total Fee Amount"
-                            )
-                        country = row["Shipping Country"]
-                        party_ledger = get_party_ledger(country)
-                        is_domestic = country == "IN"
-                        conversion_ratio = Decimal("1.0")
-                        final_amount = original_amount
-                        final_shipping_cost = original_shipping_cost
-                        final_donation_amount = original_donation_amount
-                        if order_currency and order_currency != "INR":
-                            payout_amount = payout_amounts.get(order_id)
-                            if payout_amount:
-                                conversion_ratio = payout_amount / original_amount
-                                final_amount = payout_amount
-                                final_shipping_cost = (
-                                    original_shipping_cost * conversion_ratio
-                                )
-                                final_donation_amount = (
-                                    original_donation_amount * conversion_ratio
-                                )
-                                print(
-                                    f"Order {order_id}: Converting {order_currency} to INR"
-                                    f" (ratio: {conversion_ratio:.6f})"
-                                    f" - Original: {original_amount} {order_currency}"
-                                    f" - INR: {final_amount} INR"
-                                )
-                            else:
-                                print(
-                                    f"Warning: No payout amount found for foreign currency order {order_id} ({order_currency})"
-                                )
-                                missing_payout_orders.append(
-                                    {
-                                        "order_id": order_id,
-                                        "order_currency": order_currency,
-                                        "woo_amount": original_amount,
-                                        "customer_name": customer_name,
-                                        "order_date": row["Order Date"],
-                                        "country": country,
-                                    }
-                                )
-                                continue
-                        narration_parts = [
-                            f"Customer: {customer_name}",
-                            f"Phone: {customer_phone}",
-                            f"Email: {customer_email}",
-                        ]
-                        if order_currency and order_currency != "INR":
-                            narration_parts.append(
-                                f"FX Rate: {conversion_ratio:.6f} ({order_currency} to INR)"
-                            )
-                        sales_data[order_id] = {
-                            "date": sale_date,
-                            "amount": final_amount,
-                            "original_amount": original_amount,
-                            "order_currency": order_currency,
-                            "conversion_ratio": conversion_ratio,
-                            "shipping_cost": final_shipping_cost,
-                            "donation_amount": final_donation_amount,
-                            "voucher_number": order_id,
-                            "products": [],
-                            "narration": ", ".join(narration_parts),
-                            "party_ledger": party_ledger,
-                            "is_domestic": is_domestic,
-                        }
-                    sku = row["SKU"].strip() if "SKU" in row else ""
-                    tally_names = get_tally_products_by_sku(sku, sku_mapping)
-                    quantity = int(
-                        safe_decimal_conversion(
-                            row.get("Quantity", ""), "Quantity", "1"
+                        missing_payout_orders.append(
+                            {
+                                "order_id": order_id,
+                                "order_currency": order_currency,
+                                "woo_amount": original_amount,
+                                "customer_name": customer_name,
+                                "order_date": order_date,
+                                "country": country,
+                            }
                         )
+                        continue
+                narration_parts = [
+                    f"Customer: {customer_name}",
+                    f"Phone: {customer_phone}",
+                    f"Email: {customer_email}",
+                ]
+                if order_currency and order_currency != "INR":
+                    narration_parts.append(
+                        f"FX Rate: {conversion_ratio:.6f} ({order_currency} to INR)"
                     )
-                    original_item_cost = safe_decimal_conversion(
-                        row.get("Item Cost", ""), "Item Cost"
-                    )
-                    converted_item_cost = (
-                        original_item_cost * sales_data[order_id]["conversion_ratio"]
-                    )
-                    for tally_name in tally_names:
-                        if tally_name in tally_products:
-                            product_details = tally_products[tally_name]
-                            gst_rate = product_details["gst_rate"]
-                            godown_name = product_details["godown_name"]
-                            gst_rate = (
-                                gst_rate
-                                if sales_data[order_id]["is_domestic"]
-                                else Decimal("0.0")
-                            )
-                            ledger_name = get_sales_ledger(
-                                gst_rate, sales_data[order_id]["is_domestic"]
-                            )
-                            if len(tally_names) > 1:
-                                missing_prices = [
-                                    name
-                                    for name in tally_names
-                                    if name not in product_prices
-                                ]
-                                if missing_prices:
-                                    print(
-                                        f"Error: Missing prices for products: {', '.join(missing_prices)}. "
-                                        f"SKU '{sku}' requires prices for all mapped Tally products."
-                                    )
-                                    continue
-                                normal_prices = {
-                                    name: product_prices[name] for name in tally_names
-                                }
-                                total_normal_price = sum(normal_prices.values())
-                                discount_ratio = (
-                                    converted_item_cost / total_normal_price
-                                )
-                                product_base_cost = (
-                                    normal_prices[tally_name] * discount_ratio
-                                )
-                            else:
-                                product_base_cost = converted_item_cost
-                            base_rate = round_decimal(
-                                product_base_cost / (Decimal("1") + gst_rate)
-                                if gst_rate > Decimal("0")
-                                else product_base_cost
-                            )
-                            total_base = round_decimal(
-                                base_rate * Decimal(str(quantity))
-                            )
-                            total_gst = round_decimal(
-                                (product_base_cost - base_rate) * Decimal(str(quantity))
-                                if gst_rate > Decimal("0")
-                                else Decimal("0.0")
-                            )
-                            cgst_amount = round_decimal(
-                                total_gst / Decimal("2")
-                                if gst_rate > Decimal("0")
-                                else Decimal("0.0")
-                            )
-                            sgst_amount = round_decimal(
-                                total_gst / Decimal("2")
-                                if gst_rate > Decimal("0")
-                                else Decimal("0.0")
-                            )
-                            sales_data[order_id]["products"].append(
-                                {
-                                    "name": tally_name,
-                                    "quantity": quantity,
-                                    "base_rate": base_rate,
-                                    "base_amount": total_base,
-                                    "gst_rate": gst_rate,
-                                    "cgst_amount": cgst_amount,
-                                    "sgst_amount": sgst_amount,
-                                    "ledger_name": ledger_name,
-                                    "godown_name": godown_name,
-                                    "original_item_cost": original_item_cost,
-                                    "converted_item_cost": converted_item_cost,
-                                }
-                            )
-                        else:
-                            print(
-                                f"Warning: Tally product '{tally_name}' not found in tally_products"
-                            )
-                except (KeyError, ValueError, InvalidOperation) as e:
-                    print(
-                        f"Error processing order {row.get('Order ID', 'unknown')}: {e}"
-                    )
-                    print(f"  Row data: {dict(row)}")
+                current_order = Order(
+                    date=sale_date,
+                    amount=final_amount,
+                    original_amount=original_amount,
+                    order_currency=order_currency,
+                    conversion_ratio=conversion_ratio,
+                    shipping_cost=final_shipping_cost,
+                    donation_amount=final_donation_amount,
+                    voucher_number=order_id,
+                    narration=", ".join(narration_parts),
+                    party_ledger=party_ledger,
+                    is_domestic=is_domestic,
+                )
+            sku = row[sku_at].strip() if sku_at is not None else ""
+            sku_entry = catalog.get(sku)
+            if sku_entry is None:
+                diagnostics.report(
+                    "unmapped_sku",
+                    sku,
+                    f"Warning: SKU '{sku}' not found in mapping",
+                    order_id,
+                )
+            quantity = int(
+                safe_decimal_conversion(
+                    row[quantity_at] if quantity_at is not None else "",
+                    "Quantity",
+                    "1",
+                    diagnostics,
+                    order_id,
+                )
+            )
+            original_item_cost = safe_decimal_conversion(
+                row[item_cost_at] if item_cost_at is not None else "",
+                "Item Cost",
+                "0",
+                diagnostics,
+                order_id,
+            )
+            converted_item_cost = original_item_cost * current_order.conversion_ratio
+            if sku_entry is None:
+                continue
+            for component in sku_entry.components:
+                if current_order.is_domestic:
+                    gst_rate = component.gst_rate
+                    ledger_name = component.domestic_ledger
+                else:
+                    gst_rate = Decimal("0.0")
+                    ledger_name = component.export_ledger
+                amount_inputs = (
+                    converted_item_cost,
+                    component.normal_price,
+                    sku_entry.total_normal_price,
+                    gst_rate,
+                )
+                if batch is None:
+                    amounts = compute_amounts(*amount_inputs, quantity)
+                else:
+                    amounts = (None,) * 5
+                base_rate, total_base, _, cgst_amount, sgst_amount = amounts
+                line_item = LineItem(
+                    name=component.name,
+                    quantity=quantity,
+                    base_rate=base_rate,
+                    base_amount=total_base,
+                    gst_rate=gst_rate,
+                    cgst_amount=cgst_amount,
+                    sgst_amount=sgst_amount,
+                    ledger_name=ledger_name,
+                    godown_name=component.godown_name,
+                    original_item_cost=original_item_cost,
+                    converted_item_cost=converted_item_cost,
+                )
+                if batch is not None:
+                    batch.add(line_item, *amount_inputs)
+                current_order.products.append(line_item)
+        except (KeyError, ValueError, InvalidOperation) as e:
+            failed_id = row[id_at] if id_at is not None else "unknown"
+            diagnostics.report(
+                "row_error",
+                f"{type(e).__name__}: {e}",
+                f"Error processing order {failed_id}: {e}",
+                failed_id,
+                f"  Row data: {header.as_dict(row)}",
+            )
+    if current_order is not None:
+        current_order.fingerprint = order_fingerprint(
+            current_rows,
+            payout_amounts.get(current_id),
+            catalog,
+            header,
+        )
+        yield current_order
+
+
+def read_woo_csv(
+    data_folder,
+    csv_file,
+    catalog,
+    payout_amounts,
+    cache_dir=None,
+    engine="decimal",
+    batch_threshold=DEFAULT_BATCH_THRESHOLD,
+    diagnostics=None,
+):
+    sales_data = {}
+    missing_payout_orders = []
+    batch = GstBatch(MONEY_ENGINES[engine][0], batch_threshold)
+    try:
+        with profiling.stage(
+            "woo",
+            csv_file,
+            bytes_read=source_size(os.path.join(data_folder, csv_file)),
+        ) as counters:
+            for order in iter_woo_orders(
+                data_folder,
+                csv_file,
+                catalog,
+                payout_amounts,
+                missing_payout_orders,
+                cache_dir,
+                engine,
+                batch,
+                diagnostics,
+            ):
+                order_id = order.voucher_number
+                if order_id in sales_data:
+                    sales_data[order_id].products.extend(order.products)
+                    sales_data[order_id].fingerprint = None
+                else:
+                    sales_data[order_id] = order
+                    progress.tick("woo", csv_file, len(sales_data))
+            counters["orders"] = len(sales_data)
+        with profiling.stage("gst", csv_file, rows=len(batch)):
+            batch.run()
         return list(sales_data.values()), missing_payout_orders
     except FileNotFoundError:
         print(f"Error: File '{csv_file}' not found!")
@@ -366,142 +665,536 @@ def read_woo_csv(
         return [], []
 
 
-def create_tally_xml(data_folder, sales_data, base_name="Sales"):
+def voucher_amounts(sale):
+    """
+    Compute the rounded amounts of every ledger entry in a sale's voucher.
+
+    Returns:
+        Dict with sale_amount, shipping_amount and donation_amount (None when
+        the voucher has no such entry), products as (base_rate, base_amount)
+        per line item, gst as (gst_rate, cgst_amount, sgst_amount) per rate
+        with None for a zero side, and rounding_off (None below one paisa)
+    """
+    sale_amount = round_decimal(sale.amount)
+    total_entries_value = Decimal("0.0")
+    shipping_amount = None
+    donation_amount = None
+    if sale.shipping_cost > Decimal("0"):
+        shipping_amount = round_decimal(sale.shipping_cost)
+        total_entries_value += shipping_amount
+    if sale.donation_amount > Decimal("0"):
+        donation_amount = round_decimal(sale.donation_amount)
+        total_entries_value += donation_amount
+    products = []
+    for product in sale.products:
+        base_rate = round_decimal(product.base_rate)
+        base_amount = round_decimal(product.base_amount)
+        products.append((base_rate, base_amount))
+        total_entries_value += base_amount
+    gst_entries = []
+    if sale.is_domestic:
+        gst_rates_used = {}
+        for product in sale.products:
+            if product.gst_rate > Decimal("0"):
+                gst_rate = product.gst_rate
+                if gst_rate not in gst_rates_used:
+                    gst_rates_used[gst_rate] = {
+                        "cgst": Decimal("0"),
+                        "sgst": Decimal("0"),
+                    }
+                gst_rates_used[gst_rate]["cgst"] += product.cgst_amount
+                gst_rates_used[gst_rate]["sgst"] += product.sgst_amount
+        for gst_rate, amounts in gst_rates_used.items():
+            cgst_amount = None
+            sgst_amount = None
+            if amounts["cgst"] > Decimal("0"):
+                cgst_amount = round_decimal(amounts["cgst"])
+                total_entries_value += cgst_amount
+            if amounts["sgst"] > Decimal("0"):
+                sgst_amount = round_decimal(amounts["sgst"])
+                total_entries_value += sgst_amount
+            gst_entries.append((gst_rate, cgst_amount, sgst_amount))
+    rounding_diff = sale_amount - total_entries_value
+    return {
+        "sale_amount": sale_amount,
+        "shipping_amount": shipping_amount,
+        "donation_amount": donation_amount,
+        "products": products,
+        "gst": gst_entries,
+        "rounding_off": (
+            rounding_diff if abs(rounding_diff) >= Decimal("0.01") else None
+        ),
+    }
+
+
+# Money engines selectable with --engine: (line item amounts, voucher amounts)
+MONEY_ENGINES = {
+    "decimal": (compute_gst_amounts, voucher_amounts),
+    "paise": (compute_gst_amounts_paise, voucher_amounts_paise),
+}
+
+
+def build_voucher_message(sale, ledgers, engine="decimal"):
+    import xml.etree.ElementTree as ET
+
+    amounts = MONEY_ENGINES[engine][1](sale)
+    tally_msg = ET.Element("TALLYMESSAGE", xmlns="TallyDeveloper")
+    voucher = ET.SubElement(
+        tally_msg,
+        "VOUCHER",
+        VCHTYPE="Sales",
+        ACTION="Create",
+        OBJVIEW="Invoice Voucher View",
+    )
+    ET.SubElement(voucher, "DATE").text = sale.date.strftime("%Y%m%d")
+    ET.SubElement(voucher, "EFFECTIVEDATE").text = sale.date.strftime("%Y%m%d")
+    ET.SubElement(voucher, "VOUCHERTYPENAME").text = "Sales"
+    ET.SubElement(voucher, "VOUCHERNUMBER").text = sale.voucher_number
+    ET.SubElement(voucher, "PARTYLEDGERNAME").text = sale.party_ledger
+    ET.SubElement(voucher, "CSTFORMISSUETYPE").text = ""
+    ET.SubElement(voucher, "CSTFORMRECVTYPE").text = ""
+    ET.SubElement(voucher, "FBTPAYMENTTYPE").text = "Default"
+    ET.SubElement(voucher, "PERSISTEDVIEW").text = "Invoice Voucher View"
+    ET.SubElement(voucher, "NARRATION").text = sale.narration
+
+    party_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+    ET.SubElement(party_entry, "LEDGERNAME").text = sale.party_ledger
+    ET.SubElement(party_entry, "ISDEEMEDPOSITIVE").text = "Yes"
+    ET.SubElement(party_entry, "AMOUNT").text = f"-{amounts['sale_amount']}"
+
+    if amounts["shipping_amount"] is not None:
+        shipping_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+        ET.SubElement(shipping_entry, "LEDGERNAME").text = SHIPPING_LEDGER
+        ET.SubElement(shipping_entry, "ISDEEMEDPOSITIVE").text = "No"
+        ET.SubElement(shipping_entry, "AMOUNT").text = str(amounts["shipping_amount"])
+    if amounts["donation_amount"] is not None:
+        donation_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+        ET.SubElement(donation_entry, "LEDGERNAME").text = DONATION_LEDGER
+        ET.SubElement(donation_entry, "ISDEEMEDPOSITIVE").text = "No"
+        ET.SubElement(donation_entry, "AMOUNT").text = str(amounts["donation_amount"])
+
+    for product, (base_rate, base_amount) in zip(sale.products, amounts["products"]):
+        if not product.godown_name:
+            ledger_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+            ET.SubElement(ledger_entry, "LEDGERNAME").text = product.name
+            ET.SubElement(ledger_entry, "ISDEEMEDPOSITIVE").text = "No"
+            ET.SubElement(ledger_entry, "AMOUNT").text = str(base_amount)
+        else:
+            inventory_entry = ET.SubElement(voucher, "ALLINVENTORYENTRIES.LIST")
+            ET.SubElement(inventory_entry, "STOCKITEMNAME").text = product.name
+            ET.SubElement(inventory_entry, "ISDEEMEDPOSITIVE").text = "No"
+            ET.SubElement(inventory_entry, "RATE").text = f"{base_rate}/Nos"
+            ET.SubElement(inventory_entry, "AMOUNT").text = str(base_amount)
+            ET.SubElement(inventory_entry, "ACTUALQTY").text = f"{product.quantity} Nos"
+            ET.SubElement(inventory_entry, "BILLEDQTY").text = f"{product.quantity} Nos"
+            ET.SubElement(inventory_entry, "GODOWNNAME").text = product.godown_name
+            accounting = ET.SubElement(inventory_entry, "ACCOUNTINGALLOCATIONS.LIST")
+            ET.SubElement(accounting, "LEDGERNAME").text = product.ledger_name
+            ET.SubElement(accounting, "ISDEEMEDPOSITIVE").text = "No"
+            ET.SubElement(accounting, "AMOUNT").text = str(base_amount)
+    for gst_rate, cgst_amount, sgst_amount in amounts["gst"]:
+        gst_ledgers = ledgers.gst_ledgers(gst_rate, sale.is_domestic)
+        if cgst_amount is not None:
+            cgst_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+            ET.SubElement(cgst_entry, "LEDGERNAME").text = gst_ledgers["cgst_ledger"]
+            ET.SubElement(cgst_entry, "ISDEEMEDPOSITIVE").text = "No"
+            ET.SubElement(cgst_entry, "AMOUNT").text = str(cgst_amount)
+        if sgst_amount is not None:
+            sgst_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+            ET.SubElement(sgst_entry, "LEDGERNAME").text = gst_ledgers["sgst_ledger"]
+            ET.SubElement(sgst_entry, "ISDEEMEDPOSITIVE").text = "No"
+            ET.SubElement(sgst_entry, "AMOUNT").text = str(sgst_amount)
+    rounding_diff = amounts["rounding_off"]
+    if rounding_diff is not None:
+        rounding_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
+        ET.SubElement(rounding_entry, "LEDGERNAME").text = ROUNDING_LEDGER
+        is_deemed_positive = "Yes" if rounding_diff > Decimal("0") else "No"
+        ET.SubElement(rounding_entry, "ISDEEMEDPOSITIVE").text = is_deemed_positive
+        ET.SubElement(rounding_entry, "AMOUNT").text = str(rounding_diff)
+    return tally_msg
+
+
+TALLY_XML_HEAD = (
+    b"<?xml version='1.0' encoding='utf-8'?>\n"
+    b"<ENVELOPE><HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>"
+    b"<BODY><IMPORTDATA><REQUESTDESC><REPORTNAME>All Vouchers</REPORTNAME>"
+    b"<STATICVARIABLES /></REQUESTDESC><REQUESTDATA>"
+)
+TALLY_XML_TAIL = b"</REQUESTDATA></IMPORTDATA></BODY></ENVELOPE>"
+
+
+def serialize_voucher(sale, ledgers, engine="decimal"):
+    """Return (manifest record, TALLYMESSAGE bytes) for one sale."""
+    import xml.etree.ElementTree as ET
+
+    record = {
+        "order_id": sale.voucher_number,
+        "input": sale.fingerprint,
+        "domestic": sale.is_domestic,
+    }
+    return record, ET.tostring(
+        build_voucher_message(sale, ledgers, engine), encoding="utf-8"
+    )
+
+
+def write_tally_xml(
+    output_filename, sales_data, ledgers, engine="decimal", shard_size=None
+):
+    """
+    Stream vouchers to output_filename one TALLYMESSAGE at a time.
+
+    Each voucher is built, serialized and dropped before the next one, so
+    memory does not grow with the number of orders. See write_voucher_xml.
+    When sales_data is a list split into more than one shard, the shards are
+    serialized in parallel instead (see write_shards_parallel).
+
+    Returns:
+        Number of vouchers written
+    """
+    if shard_size and isinstance(sales_data, list) and len(sales_data) > shard_size:
+        import multiprocessing
+
+        # A worker converting one of several exports (-j) writes them in turn
+        if multiprocessing.parent_process() is None:
+            return write_shards_parallel(
+                output_filename, sales_data, ledgers, engine, shard_size
+            )
+    return write_voucher_xml(
+        output_filename,
+        (serialize_voucher(sale, ledgers, engine) for sale in sales_data),
+        len(sales_data) if isinstance(sales_data, list) else None,
+        shard_size,
+    )
+
+
+def write_voucher_xml(output_filename, vouchers, total=None, shard_size=None):
+    """
+    Write serialized vouchers into a Tally envelope, with a manifest alongside.
+
+    The envelope is written to a temporary file and moved into place only once
+    it is complete, so a failed run never leaves a truncated XML that later
+    runs would skip. No file is produced when vouchers turns out to be empty.
+    While profiling, the write is recorded as the "xml" stage, which also
+    covers building the vouchers when vouchers is a generator (--stream).
+
+    Args:
+        output_filename: XML file to write
+        vouchers: Iterable of (manifest record, TALLYMESSAGE bytes)
+        total: Number of vouchers, if known, for progress events
+        shard_size: Split the output into shards of at most this many
+            vouchers instead (see write_shards)
+
+    Returns:
+        Number of vouchers written
+    """
+    import hashlib
+
+    if shard_size:
+        return write_shards(output_filename, vouchers, shard_size, total)
+    temp_filename = f"{output_filename}.tmp"
+    xml_name = os.path.basename(output_filename)
+    progress.report("xml", xml_name, 0, total)
+    manifest = ManifestWriter(output_filename)
+    xml_digest = hashlib.sha256(TALLY_XML_HEAD)
+    offset = len(TALLY_XML_HEAD)
+    try:
+        with profiling.stage("xml", xml_name) as counters:
+            with open(temp_filename, "wb") as f:
+                f.write(TALLY_XML_HEAD)
+                for record, data in vouchers:
+                    f.write(data)
+                    xml_digest.update(data)
+                    record = dict(
+                        record,
+                        output=hashlib.sha256(data).hexdigest(),
+                        offset=offset,
+                        length=len(data),
+                    )
+                    manifest.add(record)
+                    offset += len(data)
+                    progress.tick("xml", xml_name, manifest.count, total)
+                f.write(TALLY_XML_TAIL)
+                xml_digest.update(TALLY_XML_TAIL)
+                counters["orders"] = manifest.count
+                counters["bytes_written"] = offset + len(TALLY_XML_TAIL)
+        if manifest.count:
+            os.replace(temp_filename, output_filename)
+            manifest.commit(xml_digest.hexdigest())
+            remove_stale_shards(output_filename, 0)
+    finally:
+        manifest.close()
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    return manifest.count
+
+
+# Columns of the shard index, one row per shard
+SHARD_INDEX_FIELDS = [
+    "file",
+    "first_voucher",
+    "last_voucher",
+    "vouchers",
+    "domestic",
+    "international",
+    "amount",
+    "sha256",
+]
+
+
+def voucher_amount(data):
+    """Return the sale amount of a serialized voucher, from its party ledger entry."""
+    # The party entry is the first one with an amount, written as -<sale amount>
+    start = data.index(b"<AMOUNT>") + len(b"<AMOUNT>")
+    amount = data[start : data.index(b"</AMOUNT>", start)].decode("ascii")
+    return -Decimal(amount)
+
+
+def write_shard(filename, vouchers, xml_name=None, done=0, total=None):
+    """
+    Write vouchers into one Tally envelope at filename.
+
+    Returns:
+        Tuple of (manifest records, shard summary), where the summary holds
+        the hash, voucher range, counts and total amount of the shard
+    """
+    import hashlib
+
+    records = []
+    digest = hashlib.sha256(TALLY_XML_HEAD)
+    offset = len(TALLY_XML_HEAD)
+    amount = Decimal("0")
+    domestic = 0
+    with open(filename, "wb") as f:
+        f.write(TALLY_XML_HEAD)
+        for record, data in vouchers:
+            f.write(data)
+            digest.update(data)
+            records.append(
+                dict(
+                    record,
+                    output=hashlib.sha256(data).hexdigest(),
+                    offset=offset,
+                    length=len(data),
+                )
+            )
+            offset += len(data)
+            amount += voucher_amount(data)
+            domestic += bool(record["domestic"])
+            if xml_name:
+                progress.tick("xml", xml_name, done + len(records), total)
+        f.write(TALLY_XML_TAIL)
+        digest.update(TALLY_XML_TAIL)
+    summary = {
+        "xml_sha256": digest.hexdigest(),
+        "vouchers": len(records),
+        "first_voucher": records[0]["order_id"] if records else None,
+        "last_voucher": records[-1]["order_id"] if records else None,
+        "domestic": domestic,
+        "amount": str(amount),
+        "bytes": offset + len(TALLY_XML_TAIL),
+    }
+    return records, summary
+
+
+def _serialize_shard(filename, sales, ledgers, engine):
+    return write_shard(
+        filename, (serialize_voucher(sale, ledgers, engine) for sale in sales)
+    )
+
+
+def write_shards(output_filename, vouchers, shard_size, total=None):
+    """
+    Write vouchers into shards of at most shard_size vouchers, one after the
+    other, in place of output_filename (see commit_shards).
+
+    Returns:
+        Number of vouchers written
+    """
+    xml_name = os.path.basename(output_filename)
+    progress.report("xml", xml_name, 0, total)
+    vouchers = iter(vouchers)
+    temp_filenames = []
+    shards = []
+    try:
+        with profiling.stage("xml", xml_name) as counters:
+            done = 0
+            while True:
+                number = len(temp_filenames) + 1
+                temp_filenames.append(f"{shard_path_for(output_filename, number)}.tmp")
+                records, summary = write_shard(
+                    temp_filenames[-1],
+                    itertools.islice(vouchers, shard_size),
+                    xml_name,
+                    done,
+                    total,
+                )
+                if not records:
+                    break
+                shards.append((temp_filenames[-1], records, summary))
+                done += len(records)
+            counters["orders"] = done
+            counters["bytes_written"] = sum(
+                summary["bytes"] for _, _, summary in shards
+            )
+        return commit_shards(output_filename, shards, shard_size)
+    finally:
+        for temp_filename in temp_filenames:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+
+def write_shards_parallel(output_filename, sales_data, ledgers, engine, shard_size):
+    """
+    Serialize sales_data into shards of at most shard_size vouchers on a
+    pool of worker processes, one shard per task, in place of
+    output_filename (see commit_shards).
+
+    Returns:
+        Number of vouchers written
+    """
+    xml_name = os.path.basename(output_filename)
+    total = len(sales_data)
+    progress.report("xml", xml_name, 0, total)
+    chunks = [
+        sales_data[start : start + shard_size] for start in range(0, total, shard_size)
+    ]
+    temp_filenames = [
+        f"{shard_path_for(output_filename, number)}.tmp"
+        for number in range(1, len(chunks) + 1)
+    ]
+    executor = create_executor(len(chunks))
+    try:
+        with profiling.stage("xml", xml_name) as counters:
+            if executor:
+                tasks = [
+                    executor.submit(_serialize_shard, filename, chunk, ledgers, engine)
+                    for filename, chunk in zip(temp_filenames, chunks)
+                ]
+                results = (task.result() for task in tasks)
+            else:
+                results = (
+                    _serialize_shard(filename, chunk, ledgers, engine)
+                    for filename, chunk in zip(temp_filenames, chunks)
+                )
+            shards = []
+            done = 0
+            for filename, (records, summary) in zip(temp_filenames, results):
+                shards.append((filename, records, summary))
+                done += len(records)
+                progress.report("xml", xml_name, done, total)
+            counters["orders"] = done
+            counters["bytes_written"] = sum(
+                summary["bytes"] for _, _, summary in shards
+            )
+        return commit_shards(output_filename, shards, shard_size)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        for filename in temp_filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+def commit_shards(output_filename, shards, shard_size):
+    """
+    Move written shards into place and describe them in the manifest and the
+    shard index of output_filename, which lists each shard's voucher range
+    and totals so a shard whose import failed can be imported again alone.
+
+    Args:
+        output_filename: The XML the shards replace
+        shards: List of (temporary file, manifest records, shard summary)
+        shard_size: Most vouchers in a shard, for the message
+
+    Returns:
+        Number of vouchers written
+    """
+    if not shards:
+        return 0
+    manifest = ManifestWriter(output_filename)
+    try:
+        summaries = []
+        for number, (temp_filename, records, summary) in enumerate(shards, 1):
+            shard_filename = shard_path_for(output_filename, number)
+            for record in records:
+                manifest.add(dict(record, shard=number))
+            os.replace(temp_filename, shard_filename)
+            summaries.append(dict(summary, xml=os.path.basename(shard_filename)))
+        index_filename = shard_index_path_for(output_filename)
+        write_shard_index(index_filename, summaries)
+        manifest.commit(shards=summaries)
+        remove_stale_shards(output_filename, len(summaries))
+    finally:
+        manifest.close()
+    shard_count = f"{len(summaries)} shard{'s' if len(summaries) != 1 else ''}"
+    print(
+        f"Split into {shard_count} of at most {shard_size} vouchers,"
+        f" listed in {os.path.basename(index_filename)}."
+    )
+    return manifest.count
+
+
+def write_shard_index(index_filename, summaries):
+    """Write the file, voucher range and totals of each shard to index_filename."""
+    temp_filename = f"{index_filename}.tmp"
+    with open(temp_filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SHARD_INDEX_FIELDS)
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(
+                {
+                    "file": summary["xml"],
+                    "first_voucher": summary["first_voucher"],
+                    "last_voucher": summary["last_voucher"],
+                    "vouchers": summary["vouchers"],
+                    "domestic": summary["domestic"],
+                    "international": summary["vouchers"] - summary["domestic"],
+                    "amount": summary["amount"],
+                    "sha256": summary["xml_sha256"],
+                }
+            )
+    os.replace(temp_filename, index_filename)
+
+
+def remove_stale_shards(output_filename, shard_count):
+    """
+    Remove what an earlier run wrote in another layout: the single XML and
+    shards past shard_count when the output is split, every shard and the
+    index when it is not (shard_count 0).
+    """
+    import glob
+
+    stale = []
+    if shard_count:
+        stale.append(output_filename)
+    else:
+        stale.append(shard_index_path_for(output_filename))
+    base, _ = os.path.splitext(output_filename)
+    for shard_filename in glob.glob(f"{glob.escape(base)}.part-*.xml"):
+        number = shard_filename[len(base) + len(".part-") : -len(".xml")]
+        if number.isdigit() and int(number) > shard_count:
+            stale.append(shard_filename)
+    for filename in stale:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def create_tally_xml(
+    data_folder,
+    sales_data,
+    ledgers,
+    base_name="Sales",
+    engine="decimal",
+    shard_size=None,
+):
     if not sales_data:
         print(f"No sales data to process.")
         return None
     print(f"Generating XML for {len(sales_data)} total orders...")
-    envelope = ET.Element("ENVELOPE")
-    header = ET.SubElement(envelope, "HEADER")
-    ET.SubElement(header, "TALLYREQUEST").text = "Import Data"
-    body = ET.SubElement(envelope, "BODY")
-    import_data = ET.SubElement(body, "IMPORTDATA")
-    request_desc = ET.SubElement(import_data, "REQUESTDESC")
-    ET.SubElement(request_desc, "REPORTNAME").text = "All Vouchers"
-    ET.SubElement(request_desc, "STATICVARIABLES").text = ""
-    request_data = ET.SubElement(import_data, "REQUESTDATA")
-    for sale in sales_data:
-        tally_msg = ET.SubElement(request_data, "TALLYMESSAGE", xmlns="TallyDeveloper")
-        voucher = ET.SubElement(
-            tally_msg,
-            "VOUCHER",
-            VCHTYPE="Sales",
-            ACTION="Create",
-            OBJVIEW="Invoice Voucher View",
-        )
-        ET.SubElement(voucher, "DATE").text = sale["date"].strftime("%Y%m%d")
-        ET.SubElement(voucher, "EFFECTIVEDATE").text = sale["date"].strftime("%Y%m%d")
-        ET.SubElement(voucher, "VOUCHERTYPENAME").text = "Sales"
-        ET.SubElement(voucher, "VOUCHERNUMBER").text = sale["voucher_number"]
-        ET.SubElement(voucher, "PARTYLEDGERNAME").text = sale["party_ledger"]
-        ET.SubElement(voucher, "CSTFORMISSUETYPE").text = ""
-        ET.SubElement(voucher, "CSTFORMRECVTYPE").text = ""
-        ET.SubElement(voucher, "FBTPAYMENTTYPE").text = "Default"
-        ET.SubElement(voucher, "PERSISTEDVIEW").text = "Invoice Voucher View"
-        ET.SubElement(voucher, "NARRATION").text = sale["narration"]
-
-        sale_amount = round_decimal(sale["amount"])
-        party_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-        ET.SubElement(party_entry, "LEDGERNAME").text = sale["party_ledger"]
-        ET.SubElement(party_entry, "ISDEEMEDPOSITIVE").text = "Yes"
-        ET.SubElement(party_entry, "AMOUNT").text = f"-{sale_amount}"
-
-        total_entries_value = Decimal("0.0")
-
-        if sale["shipping_cost"] > Decimal("0"):
-            shipping_amount = round_decimal(sale["shipping_cost"])
-            shipping_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-            ET.SubElement(
-                shipping_entry, "LEDGERNAME"
-            ).text = "Packing and Transport Charges Collected"
-            ET.SubElement(shipping_entry, "ISDEEMEDPOSITIVE").text = "No"
-            ET.SubElement(shipping_entry, "AMOUNT").text = str(shipping_amount)
-            total_entries_value += shipping_amount
-        if sale["donation_amount"] > Decimal("0"):
-            donation_amount = round_decimal(sale["donation_amount"])
-            donation_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-            ET.SubElement(donation_entry, "LEDGERNAME").text = "Pad for Pad scheme"
-            ET.SubElement(donation_entry, "ISDEEMEDPOSITIVE").text = "No"
-            ET.SubElement(donation_entry, "AMOUNT").text = str(donation_amount)
-            total_entries_value += donation_amount
-
-        for product in sale["products"]:
-            if not product["godown_name"]:
-                ledger_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-                ET.SubElement(ledger_entry, "LEDGERNAME").text = product["name"]
-                ET.SubElement(ledger_entry, "ISDEEMEDPOSITIVE").text = "No"
-                base_amount = round_decimal(product["base_amount"])
-                ET.SubElement(ledger_entry, "AMOUNT").text = str(base_amount)
-                total_entries_value += base_amount
-            else:
-                inventory_entry = ET.SubElement(voucher, "ALLINVENTORYENTRIES.LIST")
-                ET.SubElement(inventory_entry, "STOCKITEMNAME").text = product["name"]
-                ET.SubElement(inventory_entry, "ISDEEMEDPOSITIVE").text = "No"
-                base_rate = round_decimal(product["base_rate"])
-                base_amount = round_decimal(product["base_amount"])
-                ET.SubElement(inventory_entry, "RATE").text = f"{base_rate}/Nos"
-                ET.SubElement(inventory_entry, "AMOUNT").text = str(base_amount)
-                ET.SubElement(
-                    inventory_entry, "ACTUALQTY"
-                ).text = f"{product['quantity']} Nos"
-                ET.SubElement(
-                    inventory_entry, "BILLEDQTY"
-                ).text = f"{product['quantity']} Nos"
-                ET.SubElement(inventory_entry, "GODOWNNAME").text = product[
-                    "godown_name"
-                ]
-                accounting = ET.SubElement(
-                    inventory_entry, "ACCOUNTINGALLOCATIONS.LIST"
-                )
-                ET.SubElement(accounting, "LEDGERNAME").text = product["ledger_name"]
-                ET.SubElement(accounting, "ISDEEMEDPOSITIVE").text = "No"
-                ET.SubElement(accounting, "AMOUNT").text = str(base_amount)
-                total_entries_value += base_amount
-        if sale["is_domestic"]:
-            gst_rates_used = {}
-            for product in sale["products"]:
-                if product["gst_rate"] > Decimal("0"):
-                    gst_rate = product["gst_rate"]
-                    if gst_rate not in gst_rates_used:
-                        gst_rates_used[gst_rate] = {
-                            "cgst": Decimal("0"),
-                            "sgst": Decimal("0"),
-                        }
-                    gst_rates_used[gst_rate]["cgst"] += product["cgst_amount"]
-                    gst_rates_used[gst_rate]["sgst"] += product["sgst_amount"]
-            for gst_rate, amounts in gst_rates_used.items():
-                gst_ledgers = get_gst_ledgers(gst_rate, sale["is_domestic"])
-                if amounts["cgst"] > Decimal("0"):
-                    cgst_amount = round_decimal(amounts["cgst"])
-                    cgst_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-                    ET.SubElement(cgst_entry, "LEDGERNAME").text = gst_ledgers[
-                        "cgst_ledger"
-                    ]
-                    ET.SubElement(cgst_entry, "ISDEEMEDPOSITIVE").text = "No"
-                    ET.SubElement(cgst_entry, "AMOUNT").text = str(cgst_amount)
-                    total_entries_value += cgst_amount
-                if amounts["sgst"] > Decimal("0"):
-                    sgst_amount = round_decimal(amounts["sgst"])
-                    sgst_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-                    ET.SubElement(sgst_entry, "LEDGERNAME").text = gst_ledgers[
-                        "sgst_ledger"
-                    ]
-                    ET.SubElement(sgst_entry, "ISDEEMEDPOSITIVE").text = "No"
-                    ET.SubElement(sgst_entry, "AMOUNT").text = str(sgst_amount)
-                    total_entries_value += sgst_amount
-        rounding_diff = sale_amount - total_entries_value
-        if abs(rounding_diff) >= Decimal("0.01"):
-            rounding_entry = ET.SubElement(voucher, "LEDGERENTRIES.LIST")
-            ET.SubElement(rounding_entry, "LEDGERNAME").text = "Rounding Off"
-            is_deemed_positive = "Yes" if rounding_diff > Decimal("0") else "No"
-            ET.SubElement(rounding_entry, "ISDEEMEDPOSITIVE").text = is_deemed_positive
-            ET.SubElement(rounding_entry, "AMOUNT").text = str(rounding_diff)
-            total_entries_value += rounding_diff
     output_filename = os.path.join(data_folder, f"{base_name}.xml")
     print(f"Writing to {output_filename}...")
     try:
-        tree = ET.ElementTree(envelope)
-        tree.write(output_filename, encoding="utf-8", xml_declaration=True)
+        write_tally_xml(output_filename, sales_data, ledgers, engine, shard_size)
         print(f"Successfully wrote {output_filename}.")
         return output_filename
     except Exception as e:
@@ -509,10 +1202,67 @@ def create_tally_xml(data_folder, sales_data, base_name="Sales"):
         return None
 
 
-def save_missing_payout_orders(data_folder, csv_file, missing_orders, config):
-    if not missing_orders:
-        return
-    base_name = os.path.basename(csv_file).replace(".csv", "")
+def rebuild_from_store(config, ledgers):
+    """
+    Write the XML of every export recorded in the order store again, from
+    the stored orders and in their original order.
+
+    Returns:
+        Number of XML files written
+    """
+    import sqlite3
+
+    from order_store import OrderStore, store_path_for
+
+    data_folder = config["data_folder"]
+    store_path = store_path_for(config, data_folder)
+    if store_path is None:
+        print("Error: No order store configured, pass --store or set order_store")
+        return 0
+    if not os.path.exists(store_path):
+        print(f"Error: Order store '{store_path}' not found!")
+        return 0
+    engine = config.get("money_engine", "decimal")
+    written = 0
+    try:
+        with OrderStore(store_path) as store:
+            for export in store.exports():
+                output_filename = os.path.join(data_folder, export["xml_file"])
+                print(
+                    f"\nRebuilding {export['xml_file']} from {export['orders']}"
+                    f" stored orders of {export['csv_file']}..."
+                )
+                try:
+                    count = write_tally_xml(
+                        output_filename,
+                        store.load_orders(export["csv_file"]),
+                        ledgers,
+                        engine,
+                        config.get("shard_size"),
+                    )
+                except Exception as e:
+                    print(f"Error writing {output_filename}: {e}")
+                    continue
+                if count:
+                    print(f"Wrote {output_filename} ({count} orders).")
+                    written += 1
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error reading order store '{store_path}': {e}")
+    return written
+
+
+def export_ledger_names(ledgers, output_file):
+    """Write the registry's ledger names to output_file, one per line."""
+    names = ledgers.ledger_names()
+    with open(output_file, "w", encoding="utf-8") as f:
+        for name in names:
+            f.write(f"{name}\n")
+    print(f"Wrote {len(names)} ledger names to {output_file}")
+
+
+def missing_payout_path(data_folder, csv_file, config):
+    """Return the missing-payout file written for the export csv_file."""
+    base_name = source_name(csv_file).replace(".csv", "")
     woo_prefix = config.get("woo_prefix", "Orders-Export")
     missing_prefix = config.get("missing_payout_prefix", "missing-payout")
     if base_name.startswith(woo_prefix):
@@ -520,20 +1270,36 @@ def save_missing_payout_orders(data_folder, csv_file, missing_orders, config):
         missing_file = f"{missing_prefix}{suffix}.csv"
     else:
         missing_file = f"{missing_prefix}-{base_name}.csv"
-    missing_file_path = os.path.join(data_folder, missing_file)
+    return os.path.join(data_folder, missing_file)
+
+
+MISSING_PAYOUT_FIELDS = [
+    "order_id",
+    "order_currency",
+    "woo_amount",
+    "customer_name",
+    "order_date",
+    "country",
+]
+
+
+def missing_payout_csv(missing_orders):
+    """Return the text of the missing-payout file listing missing_orders."""
+    buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(buffer, fieldnames=MISSING_PAYOUT_FIELDS)
+    writer.writeheader()
+    writer.writerows(missing_orders)
+    return buffer.getvalue()
+
+
+def save_missing_payout_orders(data_folder, csv_file, missing_orders, config):
+    if not missing_orders:
+        return
+    missing_file_path = missing_payout_path(data_folder, csv_file, config)
+    missing_file = os.path.basename(missing_file_path)
     try:
         with open(missing_file_path, "w", newline="", encoding="utf-8") as f:
-            fieldnames = [
-                "order_id",
-                "order_currency",
-                "woo_amount",
-                "customer_name",
-                "order_date",
-                "country",
-            ]
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(missing_orders)
+            f.write(missing_payout_csv(missing_orders))
         print(
             f"Saved {len(missing_orders)} orders with missing payout amounts to: {missing_file}"
         )
@@ -541,98 +1307,885 @@ def save_missing_payout_orders(data_folder, csv_file, missing_orders, config):
         print(f"Error saving missing payout orders file: {e}")
 
 
-def main():
-    print("WooCommerce CSV to Tally XML Converter with SKU-based Mapping")
+def refresh_missing_payout_orders(data_folder, csv_file, missing_orders, config):
+    """
+    Bring the missing-payout file of an updated export in line with
+    missing_orders, every order of the export still without a payout.
+
+    The file is rewritten only when the orders in it changed, and removed
+    once none is left, so exports whose late payouts have arrived are no
+    longer treated as pending (see watch.affected_exports).
+    """
+    missing_file_path = missing_payout_path(data_folder, csv_file, config)
+    missing_file = os.path.basename(missing_file_path)
+    try:
+        with open(missing_file_path, "r", newline="", encoding="utf-8") as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = None
+    except OSError:
+        current = ""
+    if not missing_orders:
+        if current is None:
+            return
+        try:
+            os.remove(missing_file_path)
+            print(f"Every order now has its payout, removed {missing_file}")
+        except OSError as e:
+            print(f"Error removing missing payout orders file: {e}")
+        return
+    if current != missing_payout_csv(missing_orders):
+        save_missing_payout_orders(data_folder, csv_file, missing_orders, config)
+
+
+def report_diagnostics(diagnostics, output_filename):
+    """Print the summary of an export's issues and save them as a sidecar."""
+    diagnostics.print_summary()
+    sidecar = diagnostics.save(output_filename)
+    if sidecar:
+        print(f"Saved all {len(diagnostics)} issues to {os.path.basename(sidecar)}")
+
+
+def recorded(orders, recorder):
+    """Yield orders, adding each one to recorder on the way if there is one."""
+    for order in orders:
+        if recorder:
+            recorder.add(order)
+        yield order
+
+
+class SplitOrderError(Exception):
+    """Raised by stream_woo_csv for an order on non-consecutive rows."""
+
+
+def stream_woo_csv(
+    data_folder,
+    csv_file,
+    base_name,
+    catalog,
+    payout_amounts,
+    config,
+):
+    """
+    Convert one export by piping iter_woo_orders straight into the XML writer.
+
+    Returns:
+        Number of vouchers written (0 if no XML was produced)
+
+    Raises:
+        SplitOrderError: If an order's rows are not consecutive, as the
+            rows before the gap are already written as a voucher. The XML
+            and the order store are left as they were.
+    """
+    from order_store import export_recorder
+
+    engine = config.get("money_engine", "decimal")
+    diagnostics = Diagnostics(config.get("diagnostics", DEFAULT_LEVEL))
+    missing_payouts = []
+    order_counts = {"domestic": 0, "international": 0}
+    seen_order_ids = set()
+
+    def counted(orders):
+        for order in orders:
+            if order.voucher_number in seen_order_ids:
+                raise SplitOrderError(order.voucher_number)
+            seen_order_ids.add(order.voucher_number)
+            if order.is_domestic:
+                order_counts["domestic"] += 1
+            else:
+                order_counts["international"] += 1
+            yield order
+
+    output_filename = os.path.join(data_folder, f"{base_name}.xml")
+    print(f"Writing to {output_filename}...")
+    with export_recorder(config, csv_file, output_filename) as recorder:
+        orders = counted(
+            iter_woo_orders(
+                data_folder,
+                csv_file,
+                catalog,
+                payout_amounts,
+                missing_payouts,
+                engine=engine,
+                diagnostics=diagnostics,
+            )
+        )
+        try:
+            total_processed = write_tally_xml(
+                output_filename,
+                recorded(orders, recorder),
+                catalog.ledgers,
+                engine,
+                config.get("shard_size"),
+            )
+        except FileNotFoundError:
+            print(f"Error: File '{csv_file}' not found!")
+            return 0
+        except SplitOrderError:
+            raise
+        except Exception as e:
+            print(f"Error converting {csv_file}: {e}")
+            return 0
+        if recorder and total_processed:
+            recorder.commit()
+    if missing_payouts:
+        save_missing_payout_orders(data_folder, csv_file, missing_payouts, config)
+    report_diagnostics(diagnostics, output_filename)
+    if not total_processed:
+        print("No valid sales data processed for this CSV. Check your file.")
+        return 0
+    print(f"Domestic orders detected: {order_counts['domestic']}")
+    print(f"International orders detected: {order_counts['international']}")
+    print(f"Processed {total_processed} completed orders.")
+    print(
+        f"All orders (domestic and international) saved to '{output_filename}' ({total_processed} orders)."
+    )
+    return total_processed
+
+
+def convert_woo_csv(
+    data_folder,
+    csv_file,
+    base_name,
+    catalog,
+    payout_amounts,
+    config,
+    stream=False,
+    cache_dir=None,
+):
+    """
+    Convert one WooCommerce export into <base_name>.xml.
+
+    Decoded rows are cached in cache_dir unless stream is set, since caching
+    needs the whole export in memory. A streamed export with an order on
+    non-consecutive rows is read whole instead, so the order is written as
+    one voucher.
+
+    Returns:
+        True if the export contained orders to process
+    """
+    from order_store import export_recorder
+
+    print(f"\nProcessing {csv_file}...")
+    engine = config.get("money_engine", "decimal")
+    if stream:
+        try:
+            return bool(
+                stream_woo_csv(
+                    data_folder,
+                    csv_file,
+                    base_name,
+                    catalog,
+                    payout_amounts,
+                    config,
+                )
+            )
+        except SplitOrderError as e:
+            print(
+                f"Order {e} appears on non-consecutive rows of {csv_file},"
+                " reading the whole export instead of streaming it"
+            )
+    diagnostics = Diagnostics(config.get("diagnostics", DEFAULT_LEVEL))
+    sales_data, missing_payouts = read_woo_csv(
+        data_folder,
+        csv_file,
+        catalog,
+        payout_amounts,
+        cache_dir,
+        engine,
+        config.get("gst_batch_threshold", DEFAULT_BATCH_THRESHOLD),
+        diagnostics,
+    )
+    if missing_payouts:
+        save_missing_payout_orders(data_folder, csv_file, missing_payouts, config)
+    report_diagnostics(diagnostics, os.path.join(data_folder, f"{base_name}.xml"))
+    if not sales_data:
+        print("No valid sales data processed for this CSV. Check your file.")
+        return False
+    domestic_count = len([sale for sale in sales_data if sale.is_domestic])
+    international_count = len([sale for sale in sales_data if not sale.is_domestic])
+    print(f"Domestic orders detected: {domestic_count}")
+    print(f"International orders detected: {international_count}")
+    sales_file = create_tally_xml(
+        data_folder,
+        sales_data,
+        catalog.ledgers,
+        base_name=base_name,
+        engine=engine,
+        shard_size=config.get("shard_size"),
+    )
+    total_processed = len(sales_data)
+    print(f"Processed {total_processed} completed orders.")
+    if sales_file:
+        print(
+            f"All orders (domestic and international) saved to '{sales_file}' ({total_processed} orders)."
+        )
+        with export_recorder(config, csv_file, sales_file) as recorder:
+            if recorder:
+                recorder.add_all(sales_data)
+                recorder.commit()
+    else:
+        print("No sales file generated for this CSV.")
+    return True
+
+
+def record_update(config, csv_file, xml_file, orders, order_ids):
+    """
+    Record an update of csv_file in the order store, if one is configured
+    (see ExportRecorder.replace).
+
+    Returns:
+        False if orders of the export are still missing from the store, so
+        the inputs are not recorded and the next run updates it again
+    """
+    from order_store import export_recorder
+
+    with export_recorder(config, csv_file, xml_file) as recorder:
+        if not recorder:
+            return True
+        recorder.replace(orders, order_ids)
+        recorder.commit()
+    return not recorder.missing_count
+
+
+def update_woo_csv(
+    data_folder,
+    csv_file,
+    base_name,
+    catalog,
+    payout_amounts,
+    config,
+    cache_dir=None,
+    inputs=None,
+):
+    """
+    Bring an existing <base_name>.xml up to date with its export.
+
+    Orders whose fingerprint matches the manifest keep their voucher bytes
+    from the current XML; only the others are recomputed. The XML and
+    manifest are rewritten only when a voucher was added, removed or changed,
+    and those vouchers are listed. Issues found in the recomputed orders are
+    summarized, but the diagnostics sidecar of the last full conversion is
+    left as it is. Once the XML is up to date, the file_stamps in inputs
+    are recorded in its manifest so the next run can skip it while none of
+    those files changes.
+
+    Returns:
+        True if the XML was rewritten
+    """
+    import hashlib
+
+    from order_store import recorded_fingerprints
+
+    print(f"\nChecking {csv_file} for changed orders...")
+    engine = config.get("money_engine", "decimal")
+    output_filename = os.path.join(data_folder, f"{base_name}.xml")
+    old_records = load_manifest(output_filename) or {}
+    order_rows = {}
+    file_path = os.path.join(data_folder, csv_file)
+    try:
+        with profiling.stage(
+            "woo", csv_file, bytes_read=source_size(file_path)
+        ) as counters:
+            rows = read_woo_rows(file_path, cache_dir)
+            header = WooHeader(next(rows, None) or [])
+            status_at = header.index("Order Status")
+            id_at = header.index("Order ID")
+            for row in rows:
+                if len(row) < header.width:
+                    row = header.fill(row)
+                status = row[status_at] if status_at is not None else None
+                if (status or "").lower() == "wc-completed":
+                    order_id = row[id_at] if id_at is not None else None
+                    order_rows.setdefault(order_id, []).append(row)
+            counters["orders"] = len(order_rows)
+    except FileNotFoundError:
+        print(f"Error: File '{csv_file}' not found!")
+        return False
+    except Exception as e:
+        print(f"Error reading CSV: {e}")
+        return False
+    diagnostics = Diagnostics(config.get("diagnostics", DEFAULT_LEVEL))
+    missing_payouts = []
+    vouchers = []
+    recomputed_orders = []
+    recomputed_count = 0
+    stored_fingerprints = recorded_fingerprints(config, csv_file)
+    # Orders whose voucher is kept but which the order store is missing
+    unrecorded_orders = []
+    with VoucherReader(output_filename) as old_xml:
+        for checked, (order_id, rows) in enumerate(order_rows.items()):
+            progress.tick("woo", csv_file, checked, len(order_rows))
+            fingerprint = order_fingerprint(
+                rows,
+                payout_amounts.get(order_id),
+                catalog,
+                header,
+            )
+            old_record = old_records.get(order_id)
+            if old_record and old_record["input"] == fingerprint:
+                record = {
+                    "order_id": order_id,
+                    "input": fingerprint,
+                    "domestic": old_record["domestic"],
+                }
+                vouchers.append((record, old_xml.read(old_record)))
+                if (
+                    stored_fingerprints is not None
+                    and stored_fingerprints.get(order_id) != fingerprint
+                ):
+                    unrecorded_orders.extend(
+                        build_woo_orders(
+                            [header.fieldnames, *rows],
+                            catalog,
+                            payout_amounts,
+                            [],
+                            engine,
+                        )
+                    )
+                continue
+            recomputed_count += 1
+            for order in build_woo_orders(
+                [header.fieldnames, *rows],
+                catalog,
+                payout_amounts,
+                missing_payouts,
+                engine,
+                diagnostics=diagnostics,
+            ):
+                vouchers.append(serialize_voucher(order, catalog.ledgers, engine))
+                recomputed_orders.append(order)
+    refresh_missing_payout_orders(data_folder, csv_file, missing_payouts, config)
+    diagnostics.print_summary("Diagnostics for the recomputed orders")
+    new_hashes = {
+        record["order_id"]: hashlib.sha256(data).hexdigest()
+        for record, data in vouchers
+    }
+    added = [order_id for order_id in new_hashes if order_id not in old_records]
+    removed = [order_id for order_id in old_records if order_id not in new_hashes]
+    changed = [
+        order_id
+        for order_id, voucher_hash in new_hashes.items()
+        if order_id in old_records and old_records[order_id]["output"] != voucher_hash
+    ]
+    print(f"Recomputed {recomputed_count} of {len(order_rows)} orders.")
+    shard_size = config.get("shard_size")
+    # Shard of each voucher as written now (None for one XML) and as written before
+    layout_changed = [
+        index // shard_size + 1 if shard_size else None
+        for index in range(len(vouchers))
+    ] != [record.get("shard") for record in old_records.values()]
+    unchanged = not (added or removed or changed) and list(new_hashes) == list(
+        old_records
+    )
+    order_ids = [record["order_id"] for record, _ in vouchers]
+    if unchanged and not layout_changed:
+        print(f"No voucher changes, keeping {base_name}.xml.")
+        recorded = not unrecorded_orders or record_update(
+            config, csv_file, output_filename, unrecorded_orders, order_ids
+        )
+        if inputs is not None and recorded:
+            record_inputs(output_filename, inputs)
+        return False
+    if not vouchers:
+        print("No valid sales data processed for this CSV. Check your file.")
+        return False
+    for label, order_ids in (
+        ("Changed", changed),
+        ("New", added),
+        ("Removed", removed),
+    ):
+        if order_ids:
+            print(f"{label} vouchers ({len(order_ids)}): {', '.join(order_ids)}")
+    if unchanged and shard_size:
+        print(f"No voucher changes, splitting {base_name}.xml into shards.")
+    elif unchanged:
+        print(f"No voucher changes, joining the shards of {base_name}.xml.")
+    print(f"Writing to {output_filename}...")
+    try:
+        write_voucher_xml(output_filename, vouchers, len(vouchers), shard_size)
+    except Exception as e:
+        print(f"Error writing {output_filename}: {e}")
+        return False
+    print(f"Updated {output_filename} ({len(vouchers)} orders).")
+    recorded = record_update(
+        config,
+        csv_file,
+        output_filename,
+        recomputed_orders + unrecorded_orders,
+        order_ids,
+    )
+    if inputs is not None and recorded:
+        record_inputs(output_filename, inputs)
+    return True
+
+
+# Catalogs and payout amounts shared by every conversion in this process. Set
+# once per worker by the pool initializer so they are not re-sent per file.
+_worker_state = None
+
+
+def _init_conversion_worker(*state):
+    global _worker_state
+    _worker_state = state
+
+
+def _convert_in_worker(csv_file, base_name, update=False, inputs=None):
+    (
+        data_folder,
+        catalog,
+        payout_amounts,
+        config,
+        stream,
+        cache_dir,
+    ) = _worker_state
+    if update:
+        return update_woo_csv(
+            data_folder,
+            csv_file,
+            base_name,
+            catalog,
+            payout_amounts,
+            config,
+            cache_dir,
+            inputs,
+        )
+    processed = convert_woo_csv(
+        data_folder,
+        csv_file,
+        base_name,
+        catalog,
+        payout_amounts,
+        config,
+        stream,
+        cache_dir,
+    )
+    if processed and inputs is not None:
+        record_inputs(os.path.join(data_folder, f"{base_name}.xml"), inputs)
+    return processed
+
+
+def print_skipped(csv_file, base_name, action):
+    """Say why an export planned as "skip" or "current" is not converted."""
+    if action == "skip":
+        print(
+            f"\nSkipping {os.path.basename(csv_file)}... Output file {base_name}.xml already exists."
+        )
+    else:
+        print(
+            f"\nSkipping {os.path.basename(csv_file)}... {base_name}.xml is up to date."
+        )
+
+
+def build_parser():
+    """Return the command line parser of gst-tally."""
     parser = argparse.ArgumentParser(
         description="Convert WooCommerce CSV to Tally XML with GST calculations using SKU mapping"
     )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("convert", "watch", "push"),
+        default="convert",
+        help="convert (the default) converts every new or changed export once; watch does "
+        "the same, then keeps the catalog and payouts loaded and converts exports as they "
+        "and their payout files arrive in the data folder; push posts the vouchers of the "
+        "converted exports that Tally does not have yet to Tally's XML server",
+    )
     parser.add_argument(
         "-c", "--config", default="config.yaml", help="Path to configuration file"
     )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Enable verbose debug output"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each order to the XML as soon as it is read instead of loading the whole export first",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to convert export files in parallel",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Parse every input file again instead of reusing results cached by earlier runs",
+    )
+    parser.add_argument(
+        "--export-ledgers",
+        metavar="FILE",
+        help="Write every ledger name the vouchers can use to FILE, one per line, and exit",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(MONEY_ENGINES),
+        help="Arithmetic used for GST and voucher amounts (default: decimal, or money_engine in the config). "
+        "paise does the same math in integer paise and produces identical amounts",
+    )
+    parser.add_argument(
+        "--batch-threshold",
+        type=int,
+        metavar="ITEMS",
+        help="Compute GST amounts in one batch pass for exports with at least this many line items "
+        f"(default: {DEFAULT_BATCH_THRESHOLD}, or gst_batch_threshold in the config)",
+    )
+    parser.add_argument(
+        "--diagnostics",
+        choices=LEVELS,
+        help="How much detail to print about unmapped SKUs, invalid numbers, currency conversions "
+        "and other issues while converting: summary prints one table per export, first adds the "
+        "first occurrence of each issue, all prints every occurrence (default: summary, or "
+        "diagnostics in the config). Every occurrence is saved next to the XML either way",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        metavar="VOUCHERS",
+        help="Split each XML into shards of at most this many vouchers, such as "
+        "sales-June-2025.part-003.xml, listed with their voucher ranges and totals in "
+        "sales-June-2025.index.csv, so a failed import can be repeated for one shard "
+        "(default: shard_size in the config, or 0 for one XML per export)",
+    )
+    parser.add_argument(
+        "--store",
+        metavar="DB",
+        help="Record every converted order with its line items, GST amounts and payout in the "
+        "SQLite file DB (default: order_store in the config, relative to the data folder)",
+    )
+    parser.add_argument(
+        "--rebuild-from-store",
+        action="store_true",
+        help="Write the XML of every export recorded in the order store again from the stored "
+        "orders, without reading the exports or payout files, and exit",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="With watch, wait until no file has changed for this long before converting "
+        "(default: 2)",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="With watch, scan the data folder every few seconds instead of using inotify",
+    )
+    parser.add_argument(
+        "--tally-url",
+        metavar="URL",
+        help="With push, address of Tally's XML server "
+        "(default: tally_url in the config, or http://localhost:9000)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        metavar="VOUCHERS",
+        help="With push, vouchers posted per request "
+        "(default: push_batch_size in the config, or 100)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        metavar="REQUESTS",
+        help="With push, requests in flight at once, each over its own persistent connection "
+        "(default: push_concurrency in the config, or 1)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="With push, times a request that gets no usable answer from Tally is sent again, "
+        "waiting longer each time (default: 3)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="JSON",
+        help="Record wall and CPU time, row, order and byte counts and peak memory of each stage "
+        "(config, catalog, payouts, woo, gst, xml, push) and write them to JSON",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="PSTATS",
+        help="Run under cProfile and dump the statistics to PSTATS (worker processes are not "
+        "included, so combine with -j 1)",
+    )
+    return parser
+
+
+def main():
+    print("WooCommerce CSV to Tally XML Converter with SKU-based Mapping")
+    parser = build_parser()
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.batch_threshold is not None and args.batch_threshold < 0:
+        parser.error("--batch-threshold must not be negative")
+    if args.debounce < 0:
+        parser.error("--debounce must not be negative")
+    if args.shard_size is not None and args.shard_size < 0:
+        parser.error("--shard-size must not be negative")
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    run = convert_exports
+    if args.command == "watch":
+        from watch import watch_exports as run
+    elif args.command == "push":
+        from tally_push import push_exports as run
+    run_profile = profiling.start() if args.profile else None
+    profiler = None
+    if args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    try:
+        if profiler:
+            profiler.runcall(run, args)
+        else:
+            run(args)
+    finally:
+        if profiler:
+            profiler.dump_stats(args.cprofile)
+            print(
+                f"\ncProfile statistics written to {args.cprofile}"
+                f" (view them with: python -m pstats {args.cprofile})"
+            )
+        if run_profile:
+            profiling.stop()
+            profiling.write_report(run_profile, args.profile)
+
+
+def load_run_config(args):
+    """Load the configuration and apply the command line options that override it."""
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
-    config = load_config(args.config)
+    with profiling.stage("config"):
+        config = load_config(args.config)
     if not config:
-        return
-    data_folder = config["data_folder"]
-    tally_products_file = config["tally_products_file"]
-    sku_mapping_file = config["sku_mapping_file"]
-    woo_prefix = config["woo_prefix"]
-    tally_prefix = config["tally_prefix"]
-    product_prices_file = config["product_prices_file"]
+        return None
+    if args.engine:
+        config["money_engine"] = args.engine
+    if args.batch_threshold is not None:
+        config["gst_batch_threshold"] = args.batch_threshold
+    if args.diagnostics:
+        config["diagnostics"] = args.diagnostics
+    if args.store:
+        config["order_store"] = os.path.abspath(args.store)
+    if args.shard_size is not None:
+        config["shard_size"] = args.shard_size
+    if args.tally_url:
+        config["tally_url"] = args.tally_url
+    if args.batch_size is not None:
+        config["push_batch_size"] = args.batch_size
+    if args.concurrency is not None:
+        config["push_concurrency"] = args.concurrency
+    return config
+
+
+def catalog_files(config):
+    """Return the product files the catalog is compiled from."""
+    return [
+        config["tally_products_file"],
+        config["sku_mapping_file"],
+        config["product_prices_file"],
+    ]
+
+
+def load_catalog(config):
+    """
+    Load the product files named in config and compile the catalog.
+
+    Returns:
+        The compiled ProductCatalog, or None if a file is missing or empty
+    """
+    tally_products_file, sku_mapping_file, product_prices_file = catalog_files(config)
     if not os.path.exists(tally_products_file):
         print(f"Error: Tally products file '{tally_products_file}' not found!")
-        return
+        return None
     if not os.path.exists(sku_mapping_file):
         print(f"Error: SKU mapping file '{sku_mapping_file}' not found!")
+        return None
+    with profiling.stage("catalog"):
+        tally_products = load_tally_products(tally_products_file)
+        sku_mapping = load_sku_mapping(sku_mapping_file)
+        product_prices = load_product_prices(product_prices_file)
+        if not tally_products:
+            print("Failed to load Tally products. Exiting.")
+            return None
+        if not sku_mapping:
+            print("Failed to load SKU mapping. Exiting.")
+            return None
+        if not product_prices:
+            print("Failed to load product price file. Exiting.")
+            return None
+        return ProductCatalog(sku_mapping, tally_products, product_prices).compile()
+
+
+def plan_conversion(config, csv_file):
+    """
+    Decide what to do with one export.
+
+    Returns:
+        Tuple of (base name of its XML, action), where action is "convert"
+        when there is no XML (or shard index) yet, "update" when the output
+        has a manifest and "skip" for an output without one
+    """
+    filename = source_name(csv_file)
+    suffix = filename.replace(config["woo_prefix"], "").replace(".csv", "")
+    base_name = f"{config['tally_prefix']}{suffix}"
+    output_filename = os.path.join(config["data_folder"], f"{base_name}.xml")
+    if not (
+        os.path.exists(output_filename)
+        or os.path.exists(shard_index_path_for(output_filename))
+    ):
+        return base_name, "convert"
+    if os.path.exists(manifest_path_for(output_filename)):
+        return base_name, "update"
+    return base_name, "skip"
+
+
+def cache_dir_for(config, no_cache=False):
+    """Return the parse cache folder of config, or None with no_cache."""
+    if no_cache:
+        return None
+    return os.path.expanduser(
+        config.get("cache_folder") or default_cache_dir(config["data_folder"])
+    )
+
+
+def plan_exports(config, csv_files, source_stamps):
+    """
+    Plan every export with plan_conversion, turning "update" into "current"
+    for an XML already brought up to date from the same files.
+
+    Returns:
+        List of (csv_file, base name, action, input stamps to record)
+    """
+    conversions = []
+    for csv_file in csv_files:
+        base_name, action = plan_conversion(config, csv_file)
+        inputs = dict(source_stamps, **file_stamps([csv_file]))
+        # Splitting into shards changes the output without changing a file
+        inputs["shard_size"] = config.get("shard_size") or None
+        # An order store configured since is filled in by an update
+        inputs["order_store"] = config.get("order_store") or None
+        output_filename = os.path.join(config["data_folder"], f"{base_name}.xml")
+        if action == "update" and manifest_is_current(output_filename, inputs):
+            action = "current"
+        conversions.append((csv_file, base_name, action, inputs))
+    return conversions
+
+
+def convert_exports(args):
+    """Run the conversion main parsed the command line for."""
+    from order_store import save_payouts
+
+    config = load_run_config(args)
+    if not config:
         return
-    tally_products = load_tally_products(tally_products_file)
-    sku_mapping = load_sku_mapping(sku_mapping_file)
-    product_prices = load_product_prices(product_prices_file)
-    print("\nLoading payout data...")
-    payout_amounts = load_all_order_amounts_from_config(args.config)
-    if not tally_products:
-        print("Failed to load Tally products. Exiting.")
-        return
-    if not sku_mapping:
-        print("Failed to load SKU mapping. Exiting.")
-        return
-    if not product_prices:
-        print("Failed to load product price file. Exiting.")
+    data_folder = config["data_folder"]
+    woo_prefix = config["woo_prefix"]
+    if args.export_ledgers or args.rebuild_from_store:
+        catalog = load_catalog(config)
+        if catalog is None:
+            return
+        if args.export_ledgers:
+            export_ledger_names(catalog.ledgers, args.export_ledgers)
+        else:
+            rebuild_from_store(config, catalog.ledgers)
         return
-    csv_file_pattern = os.path.join(data_folder, f"{woo_prefix}*.csv")
-    csv_files = glob.glob(csv_file_pattern)
+    csv_files = export_files(config)
     if not csv_files:
         print(f"No CSV files found with '{woo_prefix}' prefix.")
         return
+    # Stamped before anything is read, so a file changed during the run is
+    # read again next time
+    conversions = plan_exports(config, csv_files, file_stamps(source_files(config)))
+    pending = [
+        conversion
+        for conversion in conversions
+        if conversion[2] in ("convert", "update")
+    ]
+    catalog = None
+    payout_amounts = {}
+    cache_dir = cache_dir_for(config, args.no_cache)
+    if pending:
+        from fx_payout import load_all_order_amounts_from_config
+
+        catalog = load_catalog(config)
+        if catalog is None:
+            return
+        print("\nLoading payout data...")
+        progress.report("payouts")
+        payout_amounts = load_all_order_amounts_from_config(config, cache_dir=cache_dir)
+        save_payouts(config, payout_amounts)
     print(f"Found {len(csv_files)} CSV files to process.")
     processed_count = 0
     skipped_count = 0
-    for csv_file in csv_files:
-        filename = os.path.basename(csv_file)
-        suffix = filename.replace(woo_prefix, "").replace(".csv", "")
-        base_name = f"{tally_prefix}{suffix}"
-        output_filename = os.path.join(data_folder, f"{base_name}.xml")
-        if os.path.exists(output_filename):
-            print(
-                f"\nSkipping {filename}... Output file {os.path.basename(output_filename)} already exists."
-            )
-            skipped_count += 1
-            continue
-        print(f"\nProcessing {csv_file}...")
-        sales_data, missing_payouts = read_woo_csv(
-            data_folder,
-            csv_file,
-            sku_mapping,
-            tally_products,
-            product_prices,
-            payout_amounts,
+    worker_state = (
+        data_folder,
+        catalog,
+        payout_amounts,
+        config,
+        args.stream,
+        cache_dir,
+    )
+    jobs = min(args.jobs, len(pending))
+    executor = None
+    futures = {}
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        print(f"Converting with {jobs} worker processes...")
+        executor = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_conversion_worker,
+            initargs=worker_state,
         )
-        if missing_payouts:
-            save_missing_payout_orders(data_folder, csv_file, missing_payouts, config)
-        if sales_data:
-            domestic_count = len([sale for sale in sales_data if sale["is_domestic"]])
-            international_count = len(
-                [sale for sale in sales_data if not sale["is_domestic"]]
+        for csv_file, base_name, action, inputs in pending:
+            futures[csv_file] = executor.submit(
+                call_captured,
+                profiling.worker_task(_convert_in_worker),
+                csv_file,
+                base_name,
+                action == "update",
+                inputs,
             )
-            print(f"Domestic orders detected: {domestic_count}")
-            print(f"International orders detected: {international_count}")
-            sales_file = create_tally_xml(data_folder, sales_data, base_name=base_name)
-            total_processed = len(sales_data)
-            print(f"Processed {total_processed} completed orders.")
-            processed_count += 1
-            if sales_file:
-                print(
-                    f"All orders (domestic and international) saved to '{sales_file}' ({total_processed} orders)."
-                )
+    else:
+        _init_conversion_worker(*worker_state)
+    try:
+        for index, (csv_file, base_name, action, inputs) in enumerate(conversions):
+            progress.report(
+                "export", os.path.basename(csv_file), index, len(conversions)
+            )
+            if action in ("skip", "current"):
+                print_skipped(csv_file, base_name, action)
+                skipped_count += 1
+                continue
+            if executor:
+                processed, output = futures[csv_file].result()
+                processed = profiling.collect(processed)
+                print(output, end="")
             else:
-                print("No sales file generated for this CSV.")
-        else:
-            print("No valid sales data processed for this CSV. Check your file.")
+                processed = _convert_in_worker(
+                    csv_file, base_name, action == "update", inputs
+                )
+            if processed:
+                processed_count += 1
+            elif action == "update":
+                skipped_count += 1
+    finally:
+        if executor:
+            executor.shutdown()
+    progress.report("done", None, len(conversions), len(conversions))
     print(
         f"\nProcessed {processed_count} CSV files, skipped {skipped_count} CSV files (already processed)."
     )